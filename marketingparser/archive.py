@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+import zlib
+from marketingparser.httpclient import Response
+
+INDEX_SUFFIX = '.idx'
+# a gzip member per record, so that the archive is also readable with zcat
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+COMPRESS_LEVEL = 6
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ArchiveMiss(IOError):
+    """
+    Url is not in the archive being replayed.
+    """
+    pass
+
+
+class Archive:
+    """
+    Append-only file of fetched responses, for re-extracting posts without the network.
+
+    Each response is stored as a gzip member holding a JSON header line (url, status, reason,
+    headers, fetched) followed by the body. The index file next to the archive
+    (i.e. 'digitalbuzzblog.warc.gz.idx') lists the offset and length of each record by url,
+    so that replay reads a single record per url. The latest record of a url wins.
+    """
+
+    def __init__(self, path, replay=False):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.replay = replay
+        self.lock = threading.Lock()
+        self.records = {}
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.load_index()
+        self.file = open(path, 'rb' if replay else 'ab')
+        if replay:
+            logger.info('Replaying %d responses from %s' % (len(self.records), path))
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t', 2)
+                # a line cut short by an interrupted run has no url
+                if len(fields) == 3:
+                    self.records[fields[2]] = (int(fields[0]), int(fields[1]))
+
+    def key(self, url):
+        return url.encode('utf-8') if isinstance(url, unicode) else url
+
+    def __contains__(self, url):
+        return self.key(url) in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, url):
+        """
+        Return the archived response of specified url, raising ArchiveMiss if there is none.
+        """
+        if url not in self:
+            raise ArchiveMiss('Not archived: %s' % url)
+        offset, length = self.records[self.key(url)]
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        header, body = zlib.decompress(data, GZIP_WBITS).split('\n', 1)
+        meta = json.loads(header)
+        return Response(meta['url'], meta['status'], meta['reason'], meta['headers'], body)
+
+    def put(self, url, response):
+        """
+        Append a response, recording it under the url it was requested with.
+        """
+        header = json.dumps({
+            'url': response.url,
+            'status': response.status,
+            'reason': response.reason,
+            'headers': response.headers,
+            'fetched': int(time.time())
+        })
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        data = compressor.compress(header + '\n' + response.body) + compressor.flush()
+        url = self.key(url)
+        with self.lock:
+            # the record is written before its index line, so the index never points past the archive
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            self.file.write(data)
+            self.file.flush()
+            with open(self.index_path, 'ab') as f:
+                f.write('%d\t%d\t%s\n' % (offset, len(data), url))
+            self.records[url] = (offset, len(data))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
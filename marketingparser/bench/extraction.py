@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import gc
+import json
+import logging
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+import marketingparser.website
+from marketingparser.archive import Archive
+from marketingparser.bench.memory import max_rss
+from marketingparser.httpclient import Response
+from marketingparser.metrics import METRICS
+from marketingparser.parser import WEBSITES
+from marketingparser.website import Website, get_charset, load_response
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+LISTING_FIXTURES = (('listing.html', 'text/html; charset=utf-8'), ('sitemap.xml', 'application/xml'))
+FIELDS = tuple(field for field, _ in Website.FIELD_GETTERS)
+ROUNDS = 20
+TOLERANCE = 0.2
+
+
+def read_fixture(sitename, name):
+    path = os.path.join(FIXTURES_DIR, sitename, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def record_fixtures(path, sitename):
+    """
+    Record a site's fixtures to an archive: its listing page, and its post page under every listed url.
+
+    Returns the listed urls.
+    """
+    website = WEBSITES[sitename].__class__()
+    archive = Archive(path)
+    for name, content_type in LISTING_FIXTURES:
+        body = read_fixture(sitename, name)
+        if body is not None:
+            url = website.get_page_url(0)
+            archive.put(url, Response(url, 200, 'OK', {'content-type': content_type}, body))
+    archive.close()
+    marketingparser.website.ARCHIVE = Archive(path, replay=True)
+    urls = website.load_page(0)
+    marketingparser.website.ARCHIVE.close()
+    archive = Archive(path)
+    body = read_fixture(sitename, 'post.html')
+    for url in urls:
+        archive.put(url, Response(url, 200, 'OK', {'content-type': 'text/html; charset=utf-8'}, body))
+    archive.close()
+    return urls
+
+
+def field_times():
+    """
+    Return the time spent extracting each field so far, by field name.
+    """
+    return dict((dict(labels)['field'], histogram.sum) for (name, labels), histogram in METRICS.histograms.items()
+                if name == 'extract_field_seconds')
+
+
+def per_post(seconds, posts):
+    return round(seconds * 1000 / posts, 4) if posts else 0
+
+
+def measure(sitename, rounds=ROUNDS):
+    """
+    Extract the posts of a site's listing fixture `rounds` times, served from a replayed archive.
+
+    Times are milliseconds per post: fetch (archive read), parse (building the tree) and
+    extract (reading fields off the tree, detailed by field as timed by the site's spec).
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, sitename + '.warc.gz')
+        record_fixtures(path, sitename)
+        marketingparser.website.ARCHIVE = Archive(path, replay=True)
+        gc.collect()
+        base_rss = max_rss()
+        website = WEBSITES[sitename].__class__()
+        start = timer()
+        urls = website.load_page(0)
+        listing_time = timer() - start
+        METRICS.reset()
+        fetch_time, parse_time, extract_time = 0, 0, 0
+        posts = 0
+        for _ in range(rounds):
+            for url in urls:
+                start = timer()
+                response = load_response(url)
+                fetched = timer()
+                if not website.parse_post(response.body, url, get_charset(response)):
+                    raise ValueError('No post found in %s fixture' % sitename)
+                parsed = timer()
+                website.get_post_info()
+                extracted = timer()
+                fetch_time += fetched - start
+                parse_time += parsed - fetched
+                extract_time += extracted - parsed
+                posts += 1
+        total = fetch_time + parse_time + extract_time
+        fields = field_times()
+        return collections.OrderedDict([
+            ('site', sitename),
+            ('posts', posts),
+            ('posts_per_sec', round(posts / total, 1)),
+            ('listing_ms', round(listing_time * 1000, 4)),
+            ('fetch_ms', per_post(fetch_time, posts)),
+            ('parse_ms', per_post(parse_time, posts)),
+            ('extract_ms', per_post(extract_time, posts)),
+            ('fields_ms', collections.OrderedDict((name, per_post(fields.get(name, 0), posts)) for name in FIELDS)),
+            ('peak_rss_kb', max_rss()),
+            ('rss_growth_kb', max_rss() - base_rss)
+        ])
+    finally:
+        marketingparser.website.ARCHIVE = None
+        shutil.rmtree(directory)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Return messages for the sites whose throughput dropped by more than `tolerance` since `baseline`.
+    """
+    previous = dict((r['site'], r) for r in baseline)
+    regressions = []
+    for result in results:
+        before = previous.get(result['site'])
+        if before and result['posts_per_sec'] < before['posts_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.1f posts/sec, down from %.1f' %
+                               (result['site'], result['posts_per_sec'], before['posts_per_sec']))
+    return regressions
+
+
+def parse_args():
+    cli = argparse.ArgumentParser(description='Post extraction speed per site, over stored page fixtures')
+    cli.add_argument('sites', help='sites to measure (default: all)', nargs='*', metavar='site')
+    cli.add_argument('-n', '--rounds', help='number of times each listed post is extracted', type=int,
+                     default=ROUNDS)
+    cli.add_argument('-o', '--output', help='also write results to OUTPUT')
+    cli.add_argument('--baseline', help='results of a previous run; exit with 1 if a site got slower')
+    cli.add_argument('--tolerance', help='slowdown allowed against the baseline, as a ratio', type=float,
+                     default=TOLERANCE)
+    cli.add_argument('--in-process', help='measure in this process, peak memory then adds up across sites',
+                     action='store_true')
+    return cli.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.disable(logging.INFO)
+    sites = args.sites or sorted(WEBSITES.keys())
+    results = []
+    for site in sites:
+        if args.in_process:
+            results.append(measure(site, args.rounds))
+        else:
+            # peak RSS only grows, so every site is measured in a fresh process
+            output = subprocess.check_output([sys.executable, '-m', 'marketingparser.bench.extraction',
+                                              '--in-process', '-n', str(args.rounds), site])
+            results.extend(json.loads(output, object_pairs_hook=collections.OrderedDict))
+    report = json.dumps(results, indent=2, separators=(',', ': '))
+    print(report)
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(report)
+    if args.baseline:
+        with open(args.baseline, 'rb') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            sys.stderr.write('Regression %s\n' % message)
+        sys.exit(1 if regressions else 0)
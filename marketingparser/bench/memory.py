@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import gc
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import marketingparser.website
+from marketingparser.cache import ResponseCache
+from marketingparser.httpclient import Response
+from marketingparser.website import DigitalBuzz, PostInfo, Website
+
+MODES = ('retain', 'release')
+
+
+class DictPostInfo:
+    """
+    PostInfo as it was before __slots__, for record size comparison.
+    """
+
+    def __init__(self, post):
+        for name in PostInfo.__slots__:
+            setattr(self, name, getattr(post, name))
+
+
+def post_page(i, paragraphs=200, comments=100):
+    """
+    Build a Digital Buzz post page with sidebar, footer and scripts around the post.
+    """
+    text = ''.join('<p>Paragraph %d of post %d, about drones delivering happiness.</p>' % (p, i)
+                   for p in range(paragraphs))
+    sidebar = ''.join('<li><a href="/related/%d">Related post %d</a><img src="/thumb/%d.jpg"></li>' % (r, r, r)
+                      for r in range(paragraphs))
+    comment_list = ''.join('<li class="wordpress"><div class="social-comment-body">Comment %d</div></li>' % c
+                           for c in range(comments))
+    return ('<html><head><title>Post %d</title><script>var tracking = "%s";</script></head><body>'
+            '<div id="sidebar"><ul>%s</ul></div>'
+            '<div class="post box"><h2><a href="#">Post %d</a></h2>'
+            '<table class="date-comments"><tr><td>Sun, May 11, 2014</td>'
+            '<td class="post-ratings">average: 3.63 out of 5</td></tr></table>'
+            '<div class="author_info"><h3>Posted by: Aden Hepburn</h3></div>'
+            '<div class="entry">%s<img src="/post.jpg"></div></div>'
+            '<div id="social-tabs-comments"><div class="social-wordpress"><span>(%d)</span></div>'
+            '<ul>%s</ul></div><div id="footer">%s</div></body></html>') % \
+        (i, 'x' * 10000, sidebar, i, text, comments, comment_list, sidebar)
+
+
+def max_rss():
+    """
+    Peak resident set size of this process, in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(mode, posts, workers):
+    """
+    Extract `posts` pages served from an offline cache and report memory use.
+
+    In 'retain' mode post pages are kept referenced after extraction, as they were before
+    Website.release was introduced.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ResponseCache(directory, offline=True)
+        urls = ['http://www.digitalbuzzblog.com/post-%d/' % i for i in range(posts)]
+        for i, url in enumerate(urls):
+            cache.put(url, Response(url, 200, 'OK', {'content-type': 'text/html; charset=utf-8'}, post_page(i)))
+        marketingparser.website.CACHE = cache
+        if mode == 'retain':
+            Website.release = lambda self: None
+        websites = [DigitalBuzz() for _ in range(workers)]
+        page = []
+        gc.collect()
+        base_rss = max_rss()
+        for i, url in enumerate(urls):
+            website = websites[i % workers]
+            website.load_post(url)
+            # like a writer, hold on to one page of records
+            page = page[-website.posts_per_page + 1:] + [website.get_post_info()]
+        peak_rss = max_rss()
+        record = page[-1]
+        dict_record = DictPostInfo(record)
+        return {
+            'mode': mode,
+            'posts': posts,
+            'workers': workers,
+            'peak_rss_kb': peak_rss,
+            'rss_per_post_kb': float(peak_rss - base_rss) / posts,
+            'record_bytes': sys.getsizeof(record),
+            'dict_record_bytes': sys.getsizeof(dict_record) + sys.getsizeof(dict_record.__dict__)
+        }
+    finally:
+        shutil.rmtree(directory)
+
+
+def parse_args():
+    cli = argparse.ArgumentParser(description='Peak memory of post extraction, with and without releasing pages')
+    cli.add_argument('-n', '--posts', help='number of posts to extract', type=int, default=200)
+    cli.add_argument('-w', '--workers', help='number of website instances, as with parser.py -w', type=int,
+                     default=8)
+    cli.add_argument('--mode', help='measure a single mode in this process', choices=MODES)
+    return cli.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    marketingparser.website.logger.disabled = True
+    if args.mode:
+        print(json.dumps(measure(args.mode, args.posts, args.workers)))
+    else:
+        # peak RSS only grows, so every mode is measured in a fresh process
+        results = []
+        for mode in MODES:
+            output = subprocess.check_output([sys.executable, '-m', 'marketingparser.bench.memory', '--mode', mode,
+                                              '-n', str(args.posts), '-w', str(args.workers)])
+            results.append(json.loads(output.splitlines()[-1]))
+        print(json.dumps(results, indent=2))
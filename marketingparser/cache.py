@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+from marketingparser.httpclient import HTTPError, Response
+
+CACHE_DIR = os.path.join('data', 'cache')
+TTL = 7 * 24 * 3600
+MAX_SIZE = 1024 * 1024 * 1024
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CacheMiss(IOError):
+    """
+    Url is not cached and the cache is offline.
+    """
+    pass
+
+
+class CacheEntry:
+    """
+    Cached response body with its validators, and the time it was last fetched or revalidated.
+    """
+
+    def __init__(self, meta, body, validated):
+        self.meta = meta
+        self.body = body
+        self.validated = validated
+
+    def age(self):
+        return time.time() - self.validated
+
+    def response(self):
+        headers = {}
+        for name, field in (('content-type', 'content_type'), ('etag', 'etag'), ('last-modified', 'last_modified')):
+            if self.meta.get(field):
+                headers[name] = self.meta[field]
+        return Response(self.meta['url'], 200, 'OK', headers, self.body)
+
+
+class ResponseCache:
+    """
+    On-disk cache of successful responses, keyed by url.
+
+    Entries younger than `ttl` seconds are served as is, older ones are revalidated
+    with If-None-Match / If-Modified-Since. Least recently used entries are evicted once
+    the cache grows over `max_size` bytes. In offline mode only cached bodies are served.
+
+    A file's modification time is when its entry was last fetched or revalidated, and its access
+    time when it was last used, so that neither takes rewriting the file.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=TTL, max_size=MAX_SIZE, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.scan()
+
+    def scan(self):
+        """
+        Rebuild the LRU order from the files' access times.
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            else:
+                stat = os.stat(path)
+                files.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+
+    def key(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return hashlib.sha1(url).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, url):
+        key = self.key(url)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries[key] = self.entries.pop(key)
+        try:
+            with open(self.path(key), 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+                validated = os.fstat(f.fileno()).st_mtime
+            os.utime(self.path(key), (time.time(), validated))
+        except (IOError, OSError, ValueError):
+            return None
+        return CacheEntry(meta, body, validated) if meta['url'] == url else None
+
+    def touch(self, url):
+        """
+        Record that the cached response of a url was revalidated now.
+        """
+        try:
+            os.utime(self.path(self.key(url)), None)
+        except OSError:
+            pass
+
+    def put(self, url, response):
+        meta = {
+            'url': url,
+            'etag': response.getheader('etag'),
+            'last_modified': response.getheader('last-modified'),
+            'content_type': response.getheader('content-type'),
+            'fetched': time.time()
+        }
+        key = self.key(url)
+        path = self.path(key)
+        # unique across threads and the processes of a sharded crawl
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(meta))
+            f.write('\n')
+            f.write(response.body)
+        os.rename(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.size += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+        self.evict()
+
+    def evict(self):
+        while True:
+            with self.lock:
+                if self.size <= self.max_size or not self.entries:
+                    return
+                key, size = self.entries.popitem(last=False)
+                self.size -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def fetch(self, client, url, ttl=None):
+        """
+        Load specified url through the cache, using `client` for (conditional) requests.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        entry = self.get(url)
+        if entry and (self.offline or entry.age() < ttl):
+            return entry.response()
+        if self.offline:
+            raise CacheMiss('Url is not cached: %s' % url)
+        headers = {}
+        if entry and entry.meta['etag']:
+            headers['If-None-Match'] = entry.meta['etag']
+        if entry and entry.meta['last_modified']:
+            headers['If-Modified-Since'] = entry.meta['last_modified']
+        response = client.request(url, headers)
+        if response.status == 304 and entry:
+            logger.debug('Not modified: %s' % url)
+            self.touch(url)
+            return entry.response()
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason)
+        if response.status == 200:
+            self.put(url, response)
+        return response
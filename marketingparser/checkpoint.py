@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import os.path
+import struct
+import time
+from marketingparser.writer import BASE_DIR
+
+DIGEST = struct.Struct('<Q')
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path, content):
+    """
+    Replace file content so that readers see either the old or the new version, never a partial one.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+class SeenIndex:
+    """
+    Persistent set of urls already written, stored as 8-byte url digests in an append-only file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.digests = set()
+
+    def digest(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return DIGEST.unpack(hashlib.sha1(url).digest()[:DIGEST.size])[0]
+
+    def __contains__(self, url):
+        return self.digest(url) in self.digests
+
+    def __len__(self):
+        return len(self.digests)
+
+    def load(self):
+        self.digests = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            # ignore a trailing partial digest left by an interrupted write
+            for i in range(0, len(data) - len(data) % DIGEST.size, DIGEST.size):
+                self.digests.add(DIGEST.unpack_from(data, i)[0])
+
+    def add(self, urls):
+        digests = [self.digest(u) for u in urls if u]
+        with open(self.path, 'ab') as f:
+            f.write(''.join(DIGEST.pack(d) for d in digests))
+            f.flush()
+            os.fsync(f.fileno())
+        self.digests.update(digests)
+
+    def reset(self):
+        self.digests = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Checkpoint:
+    """
+    Crawl progress of a website: the listing position to resume from and the urls already written.
+
+    Saved next to the website's output (i.e. 'data/digitalbuzzblog.checkpoint' and
+    'data/digitalbuzzblog.seen') every time the writer flushes.
+    """
+
+    def __init__(self, filename, base_dir=BASE_DIR):
+        if not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+        name = os.path.splitext(filename)[0]
+        self.path = os.path.join(base_dir, name + '.checkpoint')
+        self.seen = SeenIndex(os.path.join(base_dir, name + '.seen'))
+        self.position = 0
+        self.post_count = 0
+        # number of posts in the listing index when position was taken, None without an index
+        self.listed = None
+
+    def load(self):
+        """
+        Load saved progress, returning False if there is none.
+        """
+        self.seen.load()
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            state = json.load(f)
+        self.position = state['position']
+        self.post_count = state['post_count']
+        self.listed = state.get('listed')
+        return True
+
+    def save(self, urls):
+        """
+        Record written urls, then the position following the last written post.
+        """
+        self.seen.add(urls)
+        self.post_count += len(urls)
+        write_atomic(self.path, json.dumps({
+            'position': self.position,
+            'post_count': self.post_count,
+            'listed': self.listed,
+            'updated': time.strftime('%Y-%m-%d %H:%M:%S')
+        }))
+        logger.debug('Checkpoint at post %d' % self.position)
+
+    def reset(self):
+        self.seen.reset()
+        self.position = 0
+        self.post_count = 0
+        self.listed = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# bytes of records sorted in memory at a time, more are spilled to sorted runs on disk
+RUN_SIZE = 64 * 1024 * 1024
+# runs merged at a time, bounding open files
+FAN_IN = 64
+# bytes held per record besides the record itself, roughly
+ITEM_OVERHEAD = 128
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def write_run(items, directory):
+    """
+    Save sorted items to a new run file in directory, returning its path.
+    """
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+        for item in items:
+            pickler.dump(item)
+            # items are independent, nothing to remember between them
+            pickler.clear_memo()
+    return path
+
+
+def read_run(path):
+    with open(path, 'rb') as f:
+        unpickler = pickle.Unpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+
+def merge_runs(paths, directory, fan_in=FAN_IN):
+    """
+    Return sorted items of runs merged, merging them into fewer runs first if there are more than `fan_in`.
+    """
+    paths = list(paths)
+    while len(paths) > fan_in:
+        group, paths = paths[:fan_in], paths[fan_in:]
+        paths.append(write_run(heapq.merge(*[read_run(p) for p in group]), directory))
+        for path in group:
+            os.remove(path)
+    return heapq.merge(*[read_run(p) for p in paths])
+
+
+def external_sort(items, directory, run_size=RUN_SIZE, fan_in=FAN_IN):
+    """
+    Yield items in sorted order, holding about `run_size` bytes of them in memory.
+
+    Items are lists whose last value is an encoded record, and whose other values order them
+    without ties. Sorted runs of items are spilled to files in `directory`.
+    """
+    paths = []
+    run = []
+    size = 0
+    for item in items:
+        run.append(item)
+        size += len(item[-1]) + ITEM_OVERHEAD
+        if size >= run_size:
+            run.sort()
+            paths.append(write_run(run, directory))
+            run = []
+            size = 0
+    run.sort()
+    if not paths:
+        for item in run:
+            yield item
+        return
+    if run:
+        paths.append(write_run(run, directory))
+    del run
+    for item in merge_runs(paths, directory, fan_in):
+        yield item
+
+
+def date_key(post):
+    # newest first, undated posts last
+    return -post.date.toordinal() if post.date else 0
+
+
+def compact(writer, run_size=RUN_SIZE, fan_in=FAN_IN):
+    """
+    Rewrite a writer's output sorted by date, newest first, then url, each post once.
+
+    Of the records saved for the same url, the one saved last is kept, having the newest counts.
+    Output of any size is sorted in bounded memory, by an external merge sort in two passes: by url
+    to drop duplicates, then by date. The output is replaced atomically once compacted.
+
+    Return the numbers of posts kept and duplicates dropped.
+    """
+    if not writer.exists():
+        logger.info('Nothing to compact, %s does not exist' % writer.filename)
+        return 0, 0
+    directory = tempfile.mkdtemp(prefix='.compact-', dir=os.path.dirname(writer.path) or '.')
+    try:
+        # the last record of a url sorts first
+        by_url = external_sort(([post.url, -seq, date_key(post), record]
+                                for seq, (record, post) in enumerate(writer.saved_records())),
+                               directory, run_size, fan_in)
+        counts = {'posts': 0, 'duplicates': 0}
+
+        def unique(items):
+            last = None
+            for seq, (url, _, key, record) in enumerate(items):
+                # posts without urls cannot be told apart, all are kept
+                if url and url == last:
+                    counts['duplicates'] += 1
+                    continue
+                last = url
+                counts['posts'] += 1
+                yield [key, url, seq, record]
+
+        by_date = external_sort(unique(by_url), directory, run_size, fan_in)
+        writer.replace(item[-1] for item in by_date)
+    finally:
+        shutil.rmtree(directory)
+    logger.info('Compacted %s to %d posts, dropped %d duplicates' %
+                (writer.filename, counts['posts'], counts['duplicates']))
+    return counts['posts'], counts['duplicates']
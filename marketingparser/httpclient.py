@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import httplib
+import logging
+import socket
+import threading
+import time
+import urlparse
+import zlib
+from marketingparser.metrics import METRICS
+
+USER_AGENT = 'Magic Browser'
+TIMEOUT = 10
+POOL_SIZE = 8
+IDLE_TIMEOUT = 30
+DNS_TTL = 300
+MAX_REDIRECTS = 5
+ACCEPT_ENCODING = 'gzip, deflate'
+CHUNK_SIZE = 64 * 1024
+# decoded bodies over this size are refused, post pages are well under a megabyte
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+CONNECTIONS = {'http': httplib.HTTPConnection, 'https': httplib.HTTPSConnection}
+REDIRECTS = (301, 302, 303, 307, 308)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(IOError):
+    """
+    Error status returned by the server.
+    """
+
+    def __init__(self, url, code, reason=''):
+        IOError.__init__(self, 'HTTP Error %d %s: %s' % (code, reason, url))
+        self.url = url
+        self.code = code
+        self.reason = reason
+
+
+class ResponseTooLarge(IOError):
+    """
+    Response body over the client's size limit.
+    """
+
+    def __init__(self, url, limit):
+        IOError.__init__(self, 'Response body over %d bytes: %s' % (limit, url))
+        self.url = url
+        self.limit = limit
+
+
+class Response:
+    """
+    Fully read HTTP response.
+    """
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class Decoder:
+    """
+    Streaming decoder of a gzip or deflate encoded body.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+        self.started = False
+
+    def decode(self, data, max_length=0):
+        """
+        Return decoded data, at most `max_length` bytes of it if given.
+        """
+        if not self.started and self.encoding == 'deflate':
+            self.started = True
+            try:
+                return self.decompressor.decompress(data, max_length)
+            except zlib.error:
+                # some servers send raw deflate data, without the zlib wrapper
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decompressor.decompress(data, max_length)
+
+    def flush(self):
+        return self.decompressor.flush()
+
+    def stream(self, chunks, chunk_size=CHUNK_SIZE):
+        """
+        Yield the decoded data of encoded chunks as they come, in parts of at most `chunk_size` bytes.
+        """
+        for data in chunks:
+            part = self.decode(data, chunk_size)
+            while True:
+                if part:
+                    yield part
+                tail = self.decompressor.unconsumed_tail
+                if not tail:
+                    break
+                part = self.decompressor.decompress(tail, chunk_size)
+        yield self.flush()
+
+
+class ChunkReader:
+    """
+    File-like reader of data coming in chunks, for parsers reading it incrementally.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            data = next(self.chunks, None)
+            if data is None:
+                break
+            self.buffer += data
+        if size < 0:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class BodyReader(ChunkReader):
+    """
+    Reader of a response body as it arrives, decoded.
+
+    The connection goes back to its pool once the body is read to its end, and is discarded if the
+    reader is closed before, or fails.
+    """
+
+    def __init__(self, url, response, headers, pool, conn):
+        self.url = url
+        self.response = response
+        self.pool = pool
+        self.conn = conn
+        self.host = urlparse.urlsplit(url).hostname
+        self.encoding = headers.get('content-encoding', '').strip().lower()
+        chunks = iter(self.receive, '')
+        if self.encoding in ('gzip', 'deflate'):
+            chunks = Decoder(self.encoding).stream(chunks)
+        ChunkReader.__init__(self, chunks)
+
+    def receive(self):
+        try:
+            data = self.response.read(CHUNK_SIZE)
+        except httplib.HTTPException as ex:
+            raise IOError('Failed to read %s: %s' % (self.url, ex))
+        METRICS.inc('received_bytes_total', len(data), host=self.host)
+        return data
+
+    def read(self, size=-1):
+        try:
+            data = ChunkReader.read(self, size)
+        except zlib.error as ex:
+            self.close()
+            raise IOError('Invalid %s body (%s): %s' % (self.encoding, ex, self.url))
+        except:
+            self.close()
+            raise
+        if size < 0 or len(data) < size:
+            # the end of the body
+            self.close(True)
+        return data
+
+    def drain(self):
+        """
+        Read the rest of a short body, such as a redirect's, and close it, so that the connection is reused.
+        """
+        self.read(CHUNK_SIZE)
+        self.close()
+
+    def close(self, complete=False):
+        if self.conn is None:
+            return
+        if complete and not self.response.will_close:
+            self.pool.release(self.conn)
+        else:
+            self.pool.discard(self.conn)
+        self.conn = None
+
+
+class Resolver:
+    """
+    Caches DNS lookups, so that new connections to a known host skip name resolution.
+    """
+
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self.addresses = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        now = time.time()
+        with self.lock:
+            cached = self.addresses.get((host, port))
+        if cached and now - cached[1] < self.ttl:
+            return cached[0]
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        with self.lock:
+            self.addresses[(host, port)] = (addresses, now)
+        return addresses
+
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        """
+        Drop-in replacement for socket.create_connection using cached addresses.
+        """
+        host, port = address
+        error = None
+        for family, socktype, proto, _, sockaddr in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except socket.error as ex:
+                error = ex
+                if sock is not None:
+                    sock.close()
+        raise error or socket.error('getaddrinfo returned an empty list for %s' % host)
+
+
+class ConnectionPool:
+    """
+    Persistent connections to a single host.
+
+    At most `size` connections are open at once; idle connections older than
+    `idle_timeout` seconds are closed instead of being reused.
+    """
+
+    def __init__(self, scheme, host, port, resolver, size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT, timeout=TIMEOUT):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.resolver = resolver
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        """
+        Return a (connection, reused) pair, waiting for a free slot if the pool is exhausted.
+        """
+        self.slots.acquire()
+        self.evict()
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()[0], True
+        return self.connect(), False
+
+    def release(self, conn):
+        with self.lock:
+            self.idle.append((conn, time.time()))
+        self.slots.release()
+
+    def discard(self, conn):
+        conn.close()
+        self.slots.release()
+
+    def connect(self):
+        conn = CONNECTIONS[self.scheme](self.host, self.port, timeout=self.timeout)
+        # httplib opens sockets through this hook, which lets us skip repeated DNS lookups
+        conn._create_connection = self.resolver.create_connection
+        return conn
+
+    def evict(self, idle_timeout=None):
+        """
+        Close connections that have been idle for too long.
+        """
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        now = time.time()
+        with self.lock:
+            expired = [c for c, used in self.idle if now - used >= idle_timeout]
+            self.idle = [(c, used) for c, used in self.idle if now - used < idle_timeout]
+        for conn in expired:
+            conn.close()
+
+    def close(self):
+        self.evict(0)
+
+
+class HTTPClient:
+    """
+    HTTP client reusing keep-alive connections, shared by all websites.
+
+    Requests go through `throttle` if set, see marketingparser.throttle. Responses are asked for
+    gzip or deflate compressed, and decoded as their chunks arrive; bodies over `max_body_size`
+    bytes, decoded, are refused, unless they are streamed with `open`.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT, timeout=TIMEOUT, throttle=None,
+                 max_body_size=MAX_BODY_SIZE):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.throttle = throttle
+        self.max_body_size = max_body_size
+        self.resolver = Resolver()
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = ConnectionPool(scheme, host, port, self.resolver,
+                                                 self.pool_size, self.idle_timeout, self.timeout)
+            return self.pools[key]
+
+    def get(self, url, headers=None):
+        """
+        Load specified url, following redirects and raising HTTPError on error status.
+        """
+        response = self.request(url, headers)
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason)
+        return response
+
+    def open(self, url, headers=None):
+        """
+        Load specified url like `get`, returning a response whose body is a BodyReader, to read as it
+        arrives and close. Bodies read this way are not held in memory, so their size is not limited.
+        """
+        if self.throttle:
+            # robots.txt is read whole, before the streamed request
+            self.throttle.limiter(self.send, url)
+        response = self.request(url, headers, stream=True)
+        if response.status >= 400:
+            response.body.drain()
+            raise HTTPError(url, response.status, response.reason)
+        return response
+
+    def request(self, url, headers=None, stream=False):
+        """
+        Load specified url, following redirects, and return the response whatever its status.
+        """
+        send = functools.partial(self.send, stream=True) if stream else self.send
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.throttle.call(send, url, headers) if self.throttle else send(url, headers)
+            location = response.getheader('location')
+            if response.status not in REDIRECTS or not location:
+                return response
+            if stream:
+                response.body.drain()
+            url = urlparse.urljoin(url, location)
+        raise HTTPError(url, response.status, 'Too many redirects')
+
+    def send(self, url, headers=None, stream=False):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in CONNECTIONS:
+            raise IOError('Unsupported url: %s' % url)
+        pool = self.pool(parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING}
+        request_headers.update(headers or {})
+        while True:
+            conn, reused = pool.acquire()
+            try:
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+                headers = dict(response.getheaders())
+                if stream:
+                    return Response(url, response.status, response.reason, headers,
+                                    BodyReader(url, response, headers, pool, conn))
+                body = self.read_body(url, response, headers)
+            except (httplib.HTTPException, socket.error):
+                pool.discard(conn)
+                if reused:
+                    # the server has closed an idle keep-alive connection, try a fresh one
+                    continue
+                raise
+            except IOError:
+                # the rest of the body is still on the connection
+                pool.discard(conn)
+                raise
+            if response.will_close:
+                pool.discard(conn)
+            else:
+                pool.release(conn)
+            return Response(url, response.status, response.reason, headers, body)
+
+    def read_body(self, url, response, headers):
+        """
+        Read a response body chunk by chunk, decoding it as it arrives.
+
+        Headers of a decoded body are updated to describe it as received.
+        """
+        encoding = headers.get('content-encoding', '').strip().lower()
+        decoder = Decoder(encoding) if encoding in ('gzip', 'deflate') else None
+        limit = self.max_body_size
+        length = headers.get('content-length', '')
+        if limit and not decoder and length.isdigit() and int(length) > limit:
+            raise ResponseTooLarge(url, limit)
+        chunks = []
+        size = 0
+        received = 0
+        try:
+            while True:
+                data = response.read(CHUNK_SIZE)
+                if not data:
+                    break
+                received += len(data)
+                if decoder:
+                    # decoding stops one byte past the limit, however far the data would inflate
+                    data = decoder.decode(data, limit - size + 1 if limit else 0)
+                size += len(data)
+                if limit and size > limit:
+                    raise ResponseTooLarge(url, limit)
+                chunks.append(data)
+            if decoder:
+                data = decoder.flush()
+                size += len(data)
+                if limit and size > limit:
+                    raise ResponseTooLarge(url, limit)
+                chunks.append(data)
+        except zlib.error as ex:
+            raise IOError('Invalid %s body (%s): %s' % (encoding, ex, url))
+        finally:
+            METRICS.inc('received_bytes_total', received, host=urlparse.urlsplit(url).hostname)
+        if decoder:
+            del headers['content-encoding']
+            headers['content-length'] = str(size)
+        return ''.join(chunks)
+
+    def close(self):
+        with self.lock:
+            pools = self.pools.values()
+        for pool in pools:
+            pool.close()
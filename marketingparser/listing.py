@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import time
+from marketingparser.httpclient import HTTPError
+from marketingparser.writer import BASE_DIR
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ListingIndex:
+    """
+    Persistent index of a website's post urls by stable position, counting from its oldest post,
+    with the listing page each post was found on.
+
+    Saved next to the website's output (i.e. 'data/digitalbuzzblog.index.db'). Listing offsets, as
+    taken by `load_page`, follow the website's own listing: from the newest post, or from the first
+    listed on websites not listing the newest first. The index serves any page with one lookup, and
+    new posts get the next positions instead of shifting older ones; on websites not listing the
+    newest first, they come after the others.
+
+    Posts found by an update are saved page by page as the listing is walked, and indexed once it
+    is through: an interrupted update continues from the last page it saved.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS posts (
+            position INTEGER PRIMARY KEY,
+            url TEXT UNIQUE NOT NULL,
+            page_url TEXT,
+            indexed TEXT
+        )""",
+        # posts found by an unfinished update, in listing order, with the offset of their page
+        """CREATE TABLE IF NOT EXISTS walked (
+            seq INTEGER PRIMARY KEY,
+            url TEXT UNIQUE NOT NULL,
+            page_url TEXT,
+            post_from INTEGER,
+            indexed TEXT
+        )""",
+    )
+
+    def __init__(self, website, base_dir=BASE_DIR):
+        if not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+        self.website = website
+        self.path = os.path.join(base_dir, os.path.splitext(website.filename)[0] + '.index.db')
+        self.connection = None
+        # the parser reads pages from its prefetch thread
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if not self.connection:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            for statement in ListingIndex.SCHEMA:
+                self.connection.execute(statement)
+        return self.connection
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connect().execute(sql, parameters).fetchall()
+
+    def __len__(self):
+        return self.query('SELECT COUNT(*) FROM posts')[0][0]
+
+    def __contains__(self, url):
+        return bool(self.query('SELECT 1 FROM posts WHERE url = ?', (url,)))
+
+    def newest(self):
+        """
+        Return the position of the newest post, -1 if the index is empty.
+        """
+        position = self.query('SELECT MAX(position) FROM posts')[0][0]
+        return -1 if position is None else position
+
+    def position(self, post_from):
+        """
+        Return the stable position of the post at specified listing offset.
+        """
+        return self.newest() - post_from if self.website.NEWEST_FIRST else post_from
+
+    def offset(self, post_from, listed):
+        """
+        Return the listing offset of the post that was at `post_from` when the index had `listed` posts.
+        """
+        if listed is None or not self.website.NEWEST_FIRST:
+            return post_from
+        # posts indexed since come first
+        return post_from + len(self) - listed
+
+    def url(self, position):
+        rows = self.query('SELECT url FROM posts WHERE position = ?', (position,))
+        return rows[0][0] if rows else None
+
+    def page(self, post_from, count):
+        """
+        Return `count` post urls in listing order from specified listing offset.
+        """
+        if self.website.NEWEST_FIRST:
+            rows = self.query('SELECT url FROM posts WHERE position <= (SELECT MAX(position) FROM posts) - ? '
+                              'ORDER BY position DESC LIMIT ?', (post_from, count))
+        else:
+            rows = self.query('SELECT url FROM posts WHERE position >= ? ORDER BY position LIMIT ?',
+                              (post_from, count))
+        return [row[0] for row in rows]
+
+    def load_page(self, post_from):
+        """
+        Load a list of post urls on a page, starting from specified post index, like Website.load_page.
+        """
+        return self.page(post_from, self.website.posts_per_page)
+
+    def walk(self, website, known):
+        """
+        Save posts listed on the website and not in `known` or walked already, a page at a time.
+
+        Listings sorted newest first are walked until a page with known posts; others to the end.
+        A walk left unfinished is continued from the last page it saved.
+        """
+        walked = set(row[0] for row in self.query('SELECT url FROM walked'))
+        post_from = self.query('SELECT MAX(post_from) FROM walked')[0][0]
+        if post_from is None:
+            post_from = 0
+        else:
+            logger.info('Continuing the listing walk from post %d, %d posts found so far' % (post_from, len(walked)))
+        while True:
+            page_url = website.get_page_url(post_from / website.posts_per_page)
+            try:
+                links = website.load_page(post_from)
+            except HTTPError as ex:
+                if ex.code != 404:
+                    raise
+                # paginated listings end with a missing page
+                links = []
+            new = [l for l in links if l not in known and l not in walked]
+            walked.update(new)
+            indexed = time.strftime('%Y-%m-%d %H:%M:%S')
+            with self.lock:
+                with self.connect():
+                    self.connection.executemany(
+                        'INSERT INTO walked (url, page_url, post_from, indexed) VALUES (?, ?, ?, ?)',
+                        [(url, page_url, post_from, indexed) for url in new])
+            if not links or (website.NEWEST_FIRST and any(l in known for l in links)):
+                return
+            post_from += len(links)
+
+    def update(self):
+        """
+        Index posts published since the last update, returning their number.
+        """
+        known = set(row[0] for row in self.query('SELECT url FROM posts'))
+        # a new instance, so that walking the listing does not move the website's own pager
+        self.walk(self.website.__class__(), known)
+        newest = self.newest()
+        with self.lock:
+            with self.connect():
+                first, count = self.connection.execute('SELECT MIN(seq), COUNT(*) FROM walked').fetchone()
+                if self.website.NEWEST_FIRST:
+                    # the newest post found gets the top position
+                    position = '%d - (seq - ?)' % (newest + count)
+                else:
+                    position = '%d + (seq - ?)' % (newest + 1)
+                self.connection.execute('INSERT INTO posts (position, url, page_url, indexed) '
+                                        'SELECT %s, url, page_url, indexed FROM walked' % position, (first,))
+                self.connection.execute('DELETE FROM walked')
+        logger.info('Indexed %d new posts, %d in total' % (count, len(self)))
+        return count
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
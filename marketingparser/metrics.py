@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from timeit import default_timer as timer
+
+# latency histogram upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+EXPORT_INTERVAL = 10
+PREFIX = 'marketingparser_'
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Counts of observed values by bucket upper bound, with their sum.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # the last count is for values over the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Return the upper bound of the bucket holding the `q` quantile, None if it is over all bounds.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+
+
+class Registry:
+    """
+    Counters and latency histograms of a run, by name and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = collections.defaultdict(float)
+            self.histograms = {}
+            self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, label_key(labels))] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the time spent in a with block, whether or not it raises.
+        """
+        start = timer()
+        try:
+            yield
+        finally:
+            self.observe(name, timer() - start, **labels)
+
+    def total(self, name):
+        with self.lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def snapshot(self):
+        """
+        Return the current metrics as a JSON-serializable dictionary.
+        """
+        elapsed = time.time() - self.started
+        posts = self.total('posts_total')
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(key), 'value': value}
+                        for (name, key), value in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(key), 'count': h.count, 'sum': h.sum,
+                           'buckets': dict(zip([str(b) for b in h.buckets] + ['+Inf'], h.counts))}
+                          for (name, key), h in sorted(self.histograms.items())]
+        return {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed': elapsed,
+            'posts_per_sec': posts / elapsed if elapsed else 0,
+            'counters': counters,
+            'histograms': histograms
+        }
+
+    def merge(self, snapshot):
+        """
+        Add the counters and histograms of a snapshot, i.e. one taken in another process.
+        """
+        with self.lock:
+            for counter in snapshot['counters']:
+                self.counters[(counter['name'], label_key(counter['labels']))] += counter['value']
+            for h in snapshot['histograms']:
+                key = (h['name'], label_key(h['labels']))
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                histogram = self.histograms[key]
+                bounds = [str(b) for b in histogram.buckets] + ['+Inf']
+                histogram.counts = [c + h['buckets'].get(b, 0) for c, b in zip(histogram.counts, bounds)]
+                histogram.count += h['count']
+                histogram.sum += h['sum']
+
+    def prometheus(self):
+        """
+        Return the current metrics in Prometheus text format.
+        """
+        lines = []
+        typed = set()
+        with self.lock:
+            for (name, key), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append('# TYPE %s%s counter' % (PREFIX, name))
+                    typed.add(name)
+                lines.append('%s%s%s %s' % (PREFIX, name, format_labels(key), repr(value)))
+            for (name, key), h in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip([repr(float(b)) for b in h.buckets] + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append('%s%s_bucket%s %d' % (PREFIX, name, format_labels(key, [('le', bound)]), cumulative))
+                lines.append('%s%s_sum%s %s' % (PREFIX, name, format_labels(key), repr(h.sum)))
+                lines.append('%s%s_count%s %d' % (PREFIX, name, format_labels(key), h.count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        Log totals and latencies of the run.
+        """
+        snapshot = self.snapshot()
+        logger.info('%d posts in %.1fs, %.2f posts/sec' %
+                    (self.total('posts_total'), snapshot['elapsed'], snapshot['posts_per_sec']))
+        for counter in snapshot['counters']:
+            logger.info('%s%s: %d' % (counter['name'], format_labels(label_key(counter['labels'])),
+                                      counter['value']))
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            for (name, key), h in histograms:
+                p95 = h.quantile(0.95)
+                logger.info('%s%s: %d calls, mean %.1fms, p95 %s' %
+                            (name, format_labels(key), h.count, h.sum * 1000 / h.count,
+                             '<= %gms' % (p95 * 1000) if p95 is not None else '> %gs' % h.buckets[-1]))
+
+
+class Exporter(threading.Thread):
+    """
+    Writes metrics snapshots every `interval` seconds: JSON to `json_path` and Prometheus text
+    format to `prometheus_path` (i.e. for node_exporter's textfile collector).
+    """
+
+    def __init__(self, registry, json_path, prometheus_path, interval=EXPORT_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.registry = registry
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.exported = time.time()
+
+    def write(self, path, content):
+        # renamed into place, so that collectors never read a partial file
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.rename(path + '.tmp', path)
+
+    def export(self):
+        self.exported = time.time()
+        self.write(self.json_path, json.dumps(self.registry.snapshot(), indent=2))
+        self.write(self.prometheus_path, self.registry.prometheus())
+
+    def poll(self):
+        """
+        Export if `interval` seconds passed since the last export, for callers exporting without the thread.
+        """
+        if time.time() - self.exported >= self.interval:
+            try:
+                self.export()
+            except EnvironmentError as ex:
+                logger.warning('Failed to export metrics: %s' % ex)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.export()
+            except EnvironmentError as ex:
+                logger.warning('Failed to export metrics: %s' % ex)
+
+    def stop(self):
+        """
+        Stop exporting, writing a last snapshot.
+        """
+        self.stopped.set()
+        self.export()
+
+
+METRICS = Registry()
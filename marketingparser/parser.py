@@ -2,11 +2,34 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import collections
+import datetime
 import logging
-from marketingparser.website import PostInfo, DigitalBuzz, CreativeGuerrilla, CreativeCriminals, \
-                                    ViralBlog, ImprovEverywhere, OnTheGroundLookingUp, ThousandHeads, \
-                                    GuerrillaComm
-from marketingparser.writer import CSVWriter
+import os
+import os.path
+import shutil
+import signal
+import threading
+from multiprocessing import Pool, TimeoutError
+from multiprocessing.pool import ThreadPool
+import marketingparser.cache
+import marketingparser.httpclient
+import marketingparser.throttle
+import marketingparser.website
+from marketingparser.archive import Archive
+from marketingparser.cache import ResponseCache
+from marketingparser.checkpoint import Checkpoint
+from marketingparser.compact import RUN_SIZE, compact
+from marketingparser.listing import ListingIndex
+from marketingparser.metrics import EXPORT_INTERVAL, METRICS, Exporter
+from marketingparser.refresh import refresh
+from marketingparser.shards import FAILED, SHARD_SIZE, Coordinator, ShardListing, ShardQueue, ShardWriter, merge, \
+    queue_path, work
+from marketingparser.social import SocialCounter
+from marketingparser.website import extract_post, get_charset, load_response, PostInfo, DigitalBuzz, \
+                                    CreativeGuerrilla, CreativeCriminals, ViralBlog, ImprovEverywhere, \
+                                    OnTheGroundLookingUp, ThousandHeads, GuerrillaComm
+from marketingparser.writer import BASE_DIR, CSVWriter, FileWriter, JSONWriter, SQLiteWriter
 
 WEBSITES = {
     'digitalbuzzblog': DigitalBuzz(),
@@ -19,80 +42,589 @@ WEBSITES = {
     'guerrillacomm': GuerrillaComm()
 }
 
+FORMATS = {
+    'csv': (CSVWriter, {}),
+    'jsonl': (JSONWriter, {}),
+    'jsonl.gz': (JSONWriter, {'compression': 'gzip'}),
+    'jsonl.zst': (JSONWriter, {'compression': 'zstd'}),
+    'sqlite': (SQLiteWriter, {})
+}
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# seconds to block on a worker result before checking for interrupts
+POLL_INTERVAL = 1
+# listing pages loaded ahead of the posts being parsed
+PREFETCH_DEPTH = 2
+
+
+def init_process():
+    """
+    Set up a forked parse process.
+
+    Threads of the parent (social counts, metrics export, shard heartbeats) may hold a lock as it
+    forks, which then stays held for good in the child: the locks taken while parsing are made anew.
+    """
+    # Ctrl-C is handled by the parent, which terminates parse processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    METRICS.lock = threading.Lock()
+    for log in [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values()):
+        # placeholders of parent loggers have no handlers
+        for handler in getattr(log, 'handlers', ()):
+            handler.createLock()
+
+
+class ListingPrefetcher(threading.Thread):
+    """
+    Loads the listing pages of a website on a background thread, from listing position
+    `post_from` on, keeping up to `depth` pages ahead of the consumer.
+
+    Pages are loaded in order, so websites chaining them (i.e. through an "older posts" link)
+    are followed as they would be synchronously.
+    """
+
+    def __init__(self, website, post_from, depth=PREFETCH_DEPTH):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.website = website
+        self.depth = depth
+        # listing position of the next page handed out, None once the listing is over
+        self.position = post_from
+        self.pages = collections.deque()
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def run(self):
+        post_from = self.position
+        while True:
+            # a page is loaded only once there is room for it, so that no more than `depth` are ahead
+            with self.condition:
+                while len(self.pages) >= self.depth and not self.stopped:
+                    self.condition.wait(POLL_INTERVAL)
+                if self.stopped:
+                    return
+            links, error = [], None
+            try:
+                with METRICS.timer('load_page_seconds'):
+                    links = self.website.load_page(post_from)
+            except StandardError as ex:
+                error = ex
+            with self.condition:
+                if self.stopped:
+                    return
+                self.pages.append((post_from, links, error))
+                self.condition.notify_all()
+            if error or not links:
+                return
+            post_from += len(links)
+
+    def ready(self):
+        """
+        Tell whether the next page is loaded and has posts.
+        """
+        with self.condition:
+            return bool(self.pages) and bool(self.pages[0][1])
+
+    def get(self):
+        """
+        Return the post links of the next page, waiting for it to load, or raise the error loading it.
+        """
+        with self.condition:
+            while not self.pages:
+                self.condition.wait(POLL_INTERVAL)
+            post_from, links, error = self.pages.popleft()
+            self.condition.notify_all()
+        self.position = None if error or not links else post_from + len(links)
+        if error:
+            raise error
+        return links
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
 
 class Parser:
+    """
+    Iterates over the posts of a website, in listing order.
 
-    def __init__(self, website):
+    Posts are fetched on `workers` threads. With `processes`, pages are parsed in that many
+    processes instead, so that parsing is not serialized with fetching by the interpreter lock.
+    With `prefetch`, that many listing pages are loaded ahead in the background, and workers get
+    the posts of the next page as soon as they are done with those of the current one. Listing
+    pages come from `listing` if given (i.e. a ListingIndex), from the website otherwise.
+
+    With `since`, posts published before that date are left out. As listings start with the
+    newest posts, iteration stops at the first of them, unless the website lists its posts in
+    another order.
+    """
+
+    def __init__(self, website, workers=1, limit=None, skip=None, processes=0, prefetch=PREFETCH_DEPTH,
+                 listing=None, since=None):
         self.website = website
+        self.listing = listing if listing is not None else website
+        self.limit = limit
+        self.skip = skip
+        self.since = since
+        self.finished = False
+        # forked before this parser's threads start, if not before the caller's; each fetch thread waits
+        # on one parse at a time
+        self.processes = Pool(processes, init_process) if processes > 0 else None
+        self.workers = max(workers, processes)
+        self.pool = ThreadPool(self.workers) if self.workers > 1 else None
+        self.local = threading.local()
+        self.prefetch = prefetch
+        self.prefetcher = None
         self.post_links = []
+        self.skipped = set()
+        self.posts = None
+        # posts of the page cut off at the limit, handed to the workers if earlier ones are too old
+        self.unsubmitted = []
+        # next page already handed to the workers: (post_from, post_links, skipped, posts, unsubmitted)
+        self.upcoming = None
         self.post_from = 0
         self.current_index = 0
+        self.returned = 0
+        # number of posts handed to the workers
+        self.submitted = 0
+        # listing positions of returned posts, for consumers to pop as they handle them
+        self.positions = collections.deque()
 
     def __iter__(self):
         return self
 
     def next(self):
-        if self.current_index < len(self.post_links):
-            return self.next_post()
-        success = self.load(self.post_from + len(self.post_links))
-        if success:
-            return self.next_post()
-        else:
+        while True:
+            info = self.next_listed()
+            if self.since is None or not isinstance(info.date, datetime.date) or info.date >= self.since:
+                return info
+            self.positions.pop()
+            # too old posts do not count, another post is handed to the workers instead
+            self.returned -= 1
+            if self.pool:
+                self.submitted -= 1
+            if self.website.NEWEST_FIRST:
+                logger.info('Reached posts published before %s' % self.since)
+                self.finished = True
+                raise StopIteration
+            METRICS.inc('posts_total', status='too_old')
+
+    def next_listed(self):
+        """
+        Return the next post of the listing.
+        """
+        if self.finished or (self.limit is not None and self.returned >= self.limit):
             raise StopIteration
+        while True:
+            while self.current_index < len(self.post_links) and \
+                    self.post_links[self.current_index] in self.skipped:
+                self.current_index += 1
+            if self.current_index < len(self.post_links):
+                return self.next_post()
+            success = self.load(self.post_from + len(self.post_links))
+            if not success:
+                raise StopIteration
 
     def next_post(self):
-        info = self.load_post(self.post_links[self.current_index])
+        if self.pool:
+            if self.upcoming is None and len(self.post_links) - self.current_index <= self.workers:
+                self.start_next_page()
+            info = self.next_result()
+        else:
+            info = self.load_post(self.post_links[self.current_index])
+        self.positions.append(self.post_from + self.current_index)
         self.current_index += 1
+        self.returned += 1
         return info
 
+    def next_result(self):
+        """
+        Wait for the next post from the worker pool, in listing order.
+        """
+        while True:
+            try:
+                return self.posts.next(POLL_INTERVAL)
+            except TimeoutError:
+                pass
+            except StopIteration:
+                if not self.unsubmitted or self.submitted >= self.limit:
+                    raise
+                self.posts, self.unsubmitted = self.start_workers(self.unsubmitted, ())
+
+    def close(self):
+        self.stop_prefetcher()
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+        if self.processes:
+            self.processes.terminate()
+            self.processes = None
+
     def load(self, post_from=0):
         self.post_from = post_from
         try:
-            self.post_links = self.website.load_page(post_from)
+            if self.upcoming and self.upcoming[0] == post_from:
+                _, self.post_links, self.skipped, self.posts, self.unsubmitted = self.upcoming
+                self.upcoming = None
+            else:
+                self.post_links = self.load_page(post_from)
+                self.skipped = self.skipped_links(self.post_links)
+                if self.pool:
+                    self.posts, self.unsubmitted = self.start_workers(self.post_links, self.skipped)
             self.current_index = 0
             logger.info('Loaded %d posts from %d' % (len(self.post_links), self.post_from))
+            if self.skipped:
+                logger.info('Skipping %d posts already saved' % len(self.skipped))
             return len(self.post_links) > 0
         except StandardError as ex:
             logger.exception('Failed to load %d posts from %d: %s' % \
                   (len(self.post_links), self.post_from, ex.message))
             return False
 
-    def load_post(self, url):
+    def load_page(self, post_from):
+        """
+        Return the post links of the listing page at `post_from`, from the prefetcher if enabled.
+        """
+        if not self.prefetch:
+            with METRICS.timer('load_page_seconds'):
+                return self.listing.load_page(post_from)
+        if self.prefetcher is None or self.prefetcher.position != post_from:
+            # the stopped prefetcher may still be moving the listing's pager (i.e. GuerrillaComm's next page)
+            self.stop_prefetcher(wait=True)
+            self.prefetcher = ListingPrefetcher(self.listing, post_from, self.prefetch)
+            self.prefetcher.start()
+        # time the consumer waits for listing pages, zero when they are loaded ahead
+        with METRICS.timer('listing_wait_seconds'):
+            return self.prefetcher.get()
+
+    def stop_prefetcher(self, wait=False):
+        """
+        Stop the prefetcher, waiting for the page it is loading if the listing is used again.
+        """
+        if self.prefetcher:
+            self.prefetcher.stop()
+            # the thread exits as soon as it is not loading a page
+            self.prefetcher.join(None if wait else POLL_INTERVAL)
+            self.prefetcher = None
+
+    def skipped_links(self, links):
+        return set(l for l in links if self.skip(l)) if self.skip else set()
+
+    def start_next_page(self):
+        """
+        Hand the posts of the next page to the workers ahead, if it is already loaded.
+        """
+        post_from = self.post_from + len(self.post_links)
+        if not self.prefetcher or self.prefetcher.position != post_from or not self.prefetcher.ready():
+            return
+        # posts of this page come first
+        if self.unsubmitted or (self.limit is not None and self.submitted >= self.limit):
+            return
+        links = self.load_page(post_from)
+        skipped = self.skipped_links(links)
+        self.upcoming = (post_from, links, skipped) + self.start_workers(links, skipped)
+
+    def start_workers(self, links, skipped):
+        """
+        Hand the posts of a page to the worker pool, up to the limit.
+
+        Return the iterator of their results and the links left over.
+        """
+        links = [l for l in links if l not in skipped]
+        rest = []
+        if self.limit is not None:
+            links, rest = links[:self.limit - self.submitted], links[self.limit - self.submitted:]
+        self.submitted += len(links)
+        return self.pool.imap(self.load_local_post, links), rest
+
+    def load_local_post(self, url):
+        """
+        Load a post on a worker thread, using the thread's own website instance.
+        """
+        website = getattr(self.local, 'website', None)
+        if website is None:
+            website = self.local.website = self.website.__class__()
+        return self.load_post(url, website)
+
+    def extract_post(self, url):
+        """
+        Fetch a post on this thread and parse it in the process pool.
+        """
+        response = load_response(url)
+        return self.processes.apply(extract_post, (self.website.__class__, response.body, url,
+                                                   get_charset(response)))
+
+    def load_post(self, url, website=None):
+        website = website or self.website
         try:
-            success = self.website.load_post(url)
-            if not success:
+            with METRICS.timer('load_post_seconds'):
+                if self.processes:
+                    info = self.extract_post(url)
+                else:
+                    info = website.get_post_info() if website.load_post(url) else None
+            if info is None:
+                METRICS.inc('posts_total', status='not_found')
                 logger.exception('Error loading post (%s): post body not found' % url)
                 return PostInfo()
-            return self.website.get_post_info()
+            METRICS.inc('posts_total', status='ok')
+            return info
         except StandardError as ex:
+            METRICS.inc('posts_total', status='error')
             logger.exception('Error loading post (%s): %s' % (url, ex.message))
             return PostInfo()
+        finally:
+            website.release()
 
 
-def parse(website, writer, post_from=0, post_count=None):
-    if post_from == 0:
+def parse(website, writer, post_from=0, post_count=None, workers=1, social=None, checkpoint=None, resume=False,
+          processes=0, prefetch=PREFETCH_DEPTH, listing=None, since=None, skip=None):
+    # crawls since a date add to the output, like resumed ones
+    append = resume or since is not None
+    if (post_from == 0 and not append) or (append and not writer.exists()):
         writer.write_header()
-    feed = Parser(website)
-    feed.load(post_from)
-    for post in feed:
-        writer.save(post)
-        logger.debug('Processed %d of %s posts' % (writer.post_count, post_count or 'all'))
-        if post_count and writer.post_count == post_count:
-            break
-    writer.flush()
+    writer.checkpoint = checkpoint
+    if skip is None and checkpoint and append:
+        skip = checkpoint.seen.__contains__
+    feed = Parser(website, workers, post_count or None, skip, processes, prefetch, listing, since)
+    try:
+        feed.load(post_from)
+        for post in (social.process(feed) if social else feed):
+            position = feed.positions.popleft()
+            # under the lock, so that a timer flush does not checkpoint the position past a post not written yet
+            with writer.lock:
+                if checkpoint and since is None:
+                    # crawls since a date leave the position of the full crawl as it is
+                    checkpoint.position = position + 1
+                if not post.url:
+                    # a post that failed to load, counted as an error
+                    continue
+                writer.save(post)
+            logger.debug('Processed %d of %s posts' % (writer.post_count, post_count or 'all'))
+            if post_count and writer.post_count == post_count:
+                break
+    finally:
+        feed.close()
+        if social:
+            social.close()
+        writer.close()
+
+
+def prepare_worker(processes):
+    """
+    Set up a forked shard worker: its own connections, and its share of the rate limits of each host.
+    """
+    # counted in the parent before the fork, and merged back from every worker
+    METRICS.lock = threading.Lock()
+    METRICS.reset()
+    client = marketingparser.website.CLIENT
+    # idle connections are the parent's
+    client.close()
+    if client.throttle:
+        # rates, Crawl-delays and concurrency alike, for limiters created anew in this process
+        client.throttle.share = 1.0 / processes
+        client.throttle.limiters = {}
+    archive = marketingparser.website.ARCHIVE
+    if archive is not None:
+        # processes must not share the file position of the replayed archive
+        marketingparser.website.ARCHIVE = Archive(archive.path, replay=True)
+
+
+def crawl_shards(website, writer, listing, post_from, post_count, shard_processes, shard_size=SHARD_SIZE, workers=1,
+                 social=True, social_endpoint=None, checkpoint=None, processes=0, prefetch=PREFETCH_DEPTH,
+                 exporter=None, since=None, resume=False):
+    """
+    Crawl a range of the listing index in shards, in `shard_processes` worker processes, then save
+    their posts with `writer` in listing order, each post once.
+
+    Shards are queued in 'data/<website>.shards.db' and their posts saved under 'data/<website>.shards';
+    an interrupted crawl continues with the shards left, and both are removed once merged. Metrics of
+    the workers are merged into this process's, and exported with `exporter` while they crawl.
+
+    Like `parse`, resumed crawls and crawls since a date skip the posts saved before, and add to the output.
+    """
+    queue = ShardQueue(queue_path(website))
+    planned = queue.planned()
+    if planned is not None and not resume and \
+            (planned[0] != post_from or (post_count is not None and planned[1] != post_count)):
+        logger.error('Shards of %d posts from %d are queued in %s, crawl them with -r or -f %d -c %d first' %
+                     (planned[1], planned[0], queue.path, planned[0], planned[1]))
+        queue.close()
+        return
+    if planned is not None:
+        # an interrupted crawl continues with its own range
+        post_from, post_count = planned
+    elif post_count is None:
+        post_count = max(0, len(listing) - post_from)
+    append = resume or since is not None
+    skip = checkpoint.seen.__contains__ if checkpoint and append else None
+    if checkpoint and since is None:
+        checkpoint.position = post_from + post_count
+    directory = os.path.join(BASE_DIR, os.path.splitext(website.filename)[0] + '.shards')
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    left = queue.plan(post_from, post_count, shard_size, len(listing))
+    logger.info('Crawling %d shards of up to %d posts in %d processes' % (left, shard_size, shard_processes))
+    # the index is read by workers, with their own connections
+    listing.close()
+
+    def crawl(shard):
+        shard_writer = ShardWriter(website, shard.output)
+        shard_writer.write_header()
+        counter = SocialCounter(lambda url: marketingparser.website.fetch(url, 0).body, social_endpoint) \
+            if social else None
+        # posts indexed since the shards were planned may come first in the listing
+        shard_from = listing.offset(shard.post_from, shard.listed)
+        # skipped and too old posts do not count, the shard is crawled to the end of its range; saved posts are
+        # skipped from the parent's checkpoint, as forked with the worker
+        parse(website.__class__(), shard_writer, shard_from, None, workers, counter, processes=processes,
+              prefetch=prefetch, listing=ShardListing(listing, shard_from, shard.post_count), since=since, skip=skip)
+        return shard_writer.post_count
+
+    def worker(name):
+        prepare_worker(shard_processes)
+        worker_queue = ShardQueue(queue.path)
+        try:
+            work(worker_queue, name, crawl, directory)
+        except KeyboardInterrupt:
+            logger.info('Worker %s stopped' % name)
+        finally:
+            worker_queue.close()
+            listing.close()
+
+    try:
+        Coordinator(queue, shard_processes, worker, directory=directory, exporter=exporter).run()
+        counts = queue.counts()
+        if counts.get(FAILED):
+            logger.error('%d of %d shards failed, run again to retry them' % (counts[FAILED], sum(counts.values())))
+            return
+        if (post_from == 0 and not append) or not writer.exists():
+            writer.write_header()
+        writer.checkpoint = checkpoint
+        try:
+            duplicates = merge(queue, lambda path: ShardWriter(website, path).saved_posts(), writer, skip)
+        finally:
+            writer.close()
+        logger.info('Merged %d posts of %d shards, dropped %d duplicates' %
+                    (writer.post_count, sum(counts.values()), duplicates))
+    finally:
+        queue.close()
+    os.remove(queue.path)
+    shutil.rmtree(directory)
 
 
-def run(sitename, post_from=0, post_count=None):
+def run(sitename, post_from=0, post_count=None, workers=1, social=True, social_endpoint=None, resume=False,
+        output_format='csv', writer_options=None, processes=0, metrics_interval=None, prefetch=PREFETCH_DEPTH,
+        index=False, since=None, since_last=False, refresh_counts=False, shard_processes=0, shard_size=SHARD_SIZE,
+        compact_output=False, sort_memory=RUN_SIZE):
     if not WEBSITES.has_key(sitename):
         logger.exception('Unsupported website: %s\nSupported are: %s' % \
               (sitename, ', '.join(WEBSITES.keys())))
         return
     website = WEBSITES[sitename]
-    logger.info('Parsing "%s", %s posts starting from %d' % (website.url, post_count or 'all', post_from))
-    parse(website, CSVWriter(website), post_from, post_count)
+    if compact_output:
+        writer_class, options = FORMATS[output_format]
+        writer = writer_class(website, **dict(options, **(writer_options or {})))
+        if isinstance(writer, FileWriter):
+            try:
+                compact(writer, sort_memory)
+            except ValueError as ex:
+                logger.error('Cannot compact %s: %s' % (writer.filename, ex))
+        else:
+            logger.info('%s keeps each post once already, nothing to compact' % writer.filename)
+        return
+    archive = marketingparser.website.ARCHIVE
+    if shard_processes and archive is not None and not archive.replay:
+        logger.error('Recording an archive takes a single process, crawl without --shard-processes')
+        return
+    # shards are ranges of the listing index
+    listing = ListingIndex(website) if (index or shard_processes) and not refresh_counts else None
+    if listing is not None:
+        try:
+            listing.update()
+        except StandardError as ex:
+            logger.exception('Failed to update the listing index: %s' % ex)
+            if not len(listing):
+                listing.close()
+                listing = None
+    if shard_processes and listing is None:
+        logger.error('Crawling in shards takes a listing index')
+        return
+    writer_class, options = FORMATS[output_format]
+    options = dict(options, **(writer_options or {}))
+    writer = writer_class(website, **options)
+    if since_last and not refresh_counts:
+        try:
+            since = writer.newest_date()
+        except ValueError as ex:
+            logger.error('Cannot find the newest post date: %s' % ex)
+            if listing is not None:
+                listing.close()
+            return
+        if since is None:
+            logger.info('No dated posts in %s yet, parsing all' % website.filename)
+    checkpoint = Checkpoint(website.filename)
+    if refresh_counts:
+        # the crawl's checkpoint is left as it is
+        logger.info('Refreshing counts of %s posts saved to %s' % (post_count or 'all', writer.filename))
+    elif resume:
+        if checkpoint.load():
+            post_from = checkpoint.position
+            if listing is not None:
+                # posts published since the checkpoint may come first in the listing
+                post_from = listing.offset(post_from, checkpoint.listed)
+        logger.info('Resuming after %d saved posts' % len(checkpoint.seen))
+    elif since is not None:
+        # posts saved before are skipped, the newest date's included
+        checkpoint.load()
+        website.since = since
+        logger.info('Parsing posts published since %s' % since)
+    elif post_from == 0:
+        # a full crawl rewrites the output, so forget what was saved before
+        checkpoint.reset()
+    else:
+        checkpoint.load()
+        checkpoint.position = post_from
+    checkpoint.listed = len(listing) if listing is not None else None
+    if not refresh_counts:
+        logger.info('Parsing "%s", %s posts starting from %d' % (website.url, post_count or 'all', post_from))
+    # shard workers look counts up themselves, threads do not survive the fork
+    counter = SocialCounter(lambda url: marketingparser.website.fetch(url, 0).body, social_endpoint) \
+        if social and not shard_processes else None
+    METRICS.reset()
+    exporter = None
+    if metrics_interval:
+        name = os.path.join(BASE_DIR, os.path.splitext(website.filename)[0])
+        exporter = Exporter(METRICS, name + '.metrics.json', name + '.prom', metrics_interval)
+        # shard workers must not be forked alongside a thread, the coordinator exports instead
+        if not shard_processes:
+            exporter.start()
+    try:
+        if refresh_counts:
+            refresh(website, writer, writer.counts_writer(website), workers, counter, post_count)
+        elif shard_processes:
+            crawl_shards(website, writer, listing, post_from, post_count, shard_processes, shard_size, workers,
+                         social, social_endpoint, checkpoint, processes, prefetch, exporter, since, resume)
+        else:
+            parse(website, writer, post_from, post_count, workers, counter, checkpoint, resume, processes,
+                  prefetch, listing, since)
+    finally:
+        if exporter:
+            exporter.stop()
+        marketingparser.website.RETRY.report()
+        if marketingparser.website.CLIENT.throttle:
+            marketingparser.website.CLIENT.throttle.report()
+        METRICS.summary()
+        if listing is not None:
+            listing.close()
+
+
+def parse_date(text):
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date: %s, expected YYYY-MM-DD' % text)
 
 
 def parse_args():
@@ -100,9 +632,98 @@ def parse_args():
     cli.add_argument('sitename', help='name of the website to parse')
     cli.add_argument('-f', '--post_from', help='0-based index of the first post to parse', type=int, default=0)
     cli.add_argument('-c', '--count', help='number of posts to parse', type=int, default=None)
+    cli.add_argument('-r', '--resume', help='continue from the last checkpoint, skipping saved posts',
+                     action='store_true')
+    cli.add_argument('-w', '--workers', help='number of posts to fetch concurrently', type=int, default=1)
+    cli.add_argument('--parse-processes', help='number of processes parsing posts, raises --workers to match',
+                     type=int, default=0)
+    cli.add_argument('--prefetch-pages', help='number of listing pages loaded ahead in the background, 0 to load '
+                     'them when needed', type=int, default=PREFETCH_DEPTH)
+    cli.add_argument('--index', help='list posts from an index of the website kept in data/<website>.index.db, '
+                     'updated with new posts first', action='store_true')
+    since = cli.add_mutually_exclusive_group()
+    since.add_argument('--since', help='parse posts published on or after SINCE (YYYY-MM-DD), adding them to the '
+                       'output', type=parse_date)
+    since.add_argument('--since-last', help='parse posts published since the newest date in the output, adding '
+                       'them to it', action='store_true')
+    cli.add_argument('--refresh-counts', help='only refresh comment, tweet and Facebook like counts of saved posts, '
+                     'in place for sqlite output, to data/<website>.counts.csv otherwise', action='store_true')
+    cli.add_argument('--shard-processes', help='crawl in shards of the listing index, in SHARD_PROCESSES worker '
+                     'processes, merging their posts into the output; implies --index', type=int, default=0)
+    cli.add_argument('--shard-size', help='number of posts per shard', type=int, default=SHARD_SIZE)
+    cli.add_argument('--compact', help='only rewrite the output sorted by date and url, keeping the last saved '
+                     'copy of each post', action='store_true')
+    cli.add_argument('--sort-memory', help='megabytes of posts sorted in memory when compacting, more are sorted '
+                     'on disk', type=int, default=RUN_SIZE / 1024 / 1024)
+    cli.add_argument('--retries', help='maximum number of tries per url', type=int,
+                     default=marketingparser.website.RETRY_COUNT)
+    cli.add_argument('--rate', help='initial requests per second to each host, adjusted to its responses',
+                     type=float, default=marketingparser.throttle.INITIAL_RATE)
+    cli.add_argument('--max-rate', help='maximum requests per second to each host', type=float,
+                     default=marketingparser.throttle.MAX_RATE)
+    cli.add_argument('--max-concurrency', help='maximum concurrent requests to each host', type=int,
+                     default=marketingparser.throttle.MAX_CONCURRENCY)
+    cli.add_argument('--no-throttle', help='send requests as fast as workers allow, ignoring robots.txt',
+                     action='store_true')
+    cli.add_argument('--max-body-size', help='maximum response size in megabytes, once decompressed', type=int,
+                     default=marketingparser.httpclient.MAX_BODY_SIZE / 1024 / 1024)
+    cli.add_argument('--cache', help='cache responses under data/cache', action='store_true')
+    cli.add_argument('--cache-ttl', help='seconds before a cached response is revalidated', type=int,
+                     default=marketingparser.cache.TTL)
+    cli.add_argument('--cache-size', help='maximum cache size in megabytes', type=int,
+                     default=marketingparser.cache.MAX_SIZE / 1024 / 1024)
+    cli.add_argument('--offline', help='serve cached responses only, implies --cache', action='store_true')
+    archive = cli.add_mutually_exclusive_group()
+    archive.add_argument('--record', help='append fetched pages to the ARCHIVE file', metavar='ARCHIVE')
+    archive.add_argument('--replay', help='serve pages from the ARCHIVE file only, without the network',
+                         metavar='ARCHIVE')
+    cli.add_argument('--format', help='output format', choices=sorted(FORMATS.keys()), default='csv')
+    cli.add_argument('--flush-rows', help='flush output every FLUSH_ROWS posts (default: a page)', type=int)
+    cli.add_argument('--flush-bytes', help='flush output every FLUSH_BYTES bytes', type=int)
+    cli.add_argument('--flush-interval', help='flush output every FLUSH_INTERVAL seconds', type=float)
+    cli.add_argument('--fsync', help='sync output to disk on every flush', action='store_true')
+    cli.add_argument('--no-social', help='skip tweet and Facebook like counts', action='store_true')
+    cli.add_argument('--social-endpoint', help='host to send social count requests to instead, e.g. a local stub')
+    cli.add_argument('--metrics', help='export metrics to data/<website>.metrics.json and data/<website>.prom',
+                     action='store_true')
+    cli.add_argument('--metrics-interval', help='seconds between metrics exports', type=float,
+                     default=EXPORT_INTERVAL)
     return cli.parse_args()
 
 
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def setup(args):
+    """
+    Configure components shared by all websites.
+    """
+    marketingparser.website.RETRY.max_tries = args.retries
+    client = marketingparser.website.CLIENT
+    client.max_body_size = args.max_body_size * 1024 * 1024
+    if args.no_throttle:
+        client.throttle = None
+    else:
+        client.throttle.rate = args.rate
+        client.throttle.max_rate = args.max_rate
+        client.throttle.max_concurrency = args.max_concurrency
+        client.pool_size = max(client.pool_size, args.max_concurrency)
+    # stop cleanly on kill as on Ctrl-C, flushing saved posts and the checkpoint
+    signal.signal(signal.SIGTERM, interrupt)
+    if args.cache or args.offline:
+        marketingparser.website.CACHE = ResponseCache(ttl=args.cache_ttl, max_size=args.cache_size * 1024 * 1024,
+                                                      offline=args.offline)
+    if args.record or args.replay:
+        marketingparser.website.ARCHIVE = Archive(args.replay or args.record, replay=bool(args.replay))
+
+
 if __name__ == '__main__':
     args = parse_args()
-    run(args.sitename, args.post_from, args.count)
+    setup(args)
+    run(args.sitename, args.post_from, args.count, args.workers, not args.no_social, args.social_endpoint,
+        args.resume, args.format, {'flush_rows': args.flush_rows, 'flush_bytes': args.flush_bytes,
+                                   'flush_interval': args.flush_interval, 'fsync': args.fsync},
+        args.parse_processes, args.metrics_interval if args.metrics else None, args.prefetch_pages, args.index,
+        args.since, args.since_last, args.refresh_counts, args.shard_processes, args.shard_size, args.compact,
+        args.sort_memory * 1024 * 1024)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import logging
+from multiprocessing.pool import ThreadPool
+from marketingparser.metrics import METRICS
+from marketingparser.website import PostInfo
+
+# urls handed to the worker threads at a time
+CHUNK_SIZE = 100
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def saved_urls(writer):
+    """
+    Yield urls of posts in a writer's output, once each, in output order.
+    """
+    seen = set()
+    for post in writer.saved_posts():
+        if post.url and post.url not in seen:
+            seen.add(post.url)
+            yield post.url
+
+
+class CountsLoader:
+    """
+    Loads comment counts of posts on worker threads, a chunk of urls at a time, in order.
+    """
+
+    def __init__(self, website, workers=1, chunk_size=CHUNK_SIZE):
+        self.website = website
+        self.chunk_size = chunk_size
+        self.pool = ThreadPool(workers)
+
+    def load(self, url):
+        try:
+            with METRICS.timer('load_counts_seconds'):
+                post = self.website.load_counts(url)
+            METRICS.inc('posts_total', status='refreshed')
+            return post
+        except StandardError as ex:
+            METRICS.inc('posts_total', status='error')
+            logger.exception('Error loading comment count (%s): %s' % (url, ex))
+            # tweet and like counts are still looked up
+            post = PostInfo()
+            post.url = url
+            return post
+
+    def process(self, urls):
+        """
+        Yield posts with the comment counts of specified urls, in order.
+        """
+        urls = iter(urls)
+        while True:
+            chunk = list(itertools.islice(urls, self.chunk_size))
+            if not chunk:
+                return
+            for post in self.pool.imap(self.load, chunk):
+                yield post
+
+    def close(self):
+        self.pool.terminate()
+
+
+def refresh(website, writer, counts_writer, workers=1, social=None, post_count=None):
+    """
+    Refresh comment, tweet and Facebook like counts of posts saved by `writer`, saving them with
+    `counts_writer`.
+
+    Only the comment count is extracted from post pages, and pages of websites without comment
+    counts are not loaded at all.
+    """
+    urls = saved_urls(writer)
+    if post_count:
+        urls = itertools.islice(urls, post_count)
+    if not counts_writer.exists():
+        counts_writer.write_header()
+    loader = CountsLoader(website, workers)
+    try:
+        posts = loader.process(urls)
+        for post in (social.process(posts) if social else posts):
+            counts_writer.save(post)
+    finally:
+        loader.close()
+        if social:
+            social.close()
+        writer.close()
+        counts_writer.close()
+    logger.info('Refreshed counts of %d posts' % counts_writer.post_count)
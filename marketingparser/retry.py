@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import httplib
+import logging
+import random
+import socket
+import threading
+import time
+import urlparse
+from marketingparser.archive import ArchiveMiss
+from marketingparser.cache import CacheMiss
+from marketingparser.httpclient import HTTPError, ResponseTooLarge
+from marketingparser.metrics import METRICS
+
+MAX_TRIES = 10
+BASE_DELAY = 0.5
+MAX_DELAY = 30
+BUDGET_RATIO = 0.2
+MIN_RETRIES = 10
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def is_retryable(ex):
+    """
+    Tell transient errors (timeouts, dropped connections, overloaded servers) from permanent ones.
+    """
+    if isinstance(ex, HTTPError):
+        return ex.code in RETRYABLE_STATUS
+    if isinstance(ex, (CacheMiss, ArchiveMiss, ResponseTooLarge)):
+        return False
+    if isinstance(ex, socket.gaierror):
+        # unknown hosts stay unknown, only temporary resolver failures are worth retrying
+        return ex.errno == socket.EAI_AGAIN
+    return isinstance(ex, (IOError, httplib.HTTPException))
+
+
+class RetryPolicy:
+    """
+    Retries transient errors with exponential backoff and full jitter.
+
+    Retries to each host are limited to `budget_ratio` of the requests made to it, plus
+    `min_retries`, so that a failing host does not multiply the request volume.
+    """
+
+    def __init__(self, max_tries=MAX_TRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 budget_ratio=BUDGET_RATIO, min_retries=MIN_RETRIES, sleep=time.sleep):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.min_retries = min_retries
+        self.sleep = sleep
+        self.counters = collections.defaultdict(collections.Counter)
+        self.lock = threading.Lock()
+
+    def count(self, host, name):
+        with self.lock:
+            self.counters[host][name] += 1
+            return self.counters[host]
+
+    def fail(self, host, reason):
+        self.count(host, reason + '_failures')
+        METRICS.inc('failures_total', host=host, reason=reason)
+
+    def withdraw(self, host):
+        """
+        Take a retry from the host's budget, returning False if it is used up.
+        """
+        with self.lock:
+            counters = self.counters[host]
+            if counters['retries'] >= self.min_retries + self.budget_ratio * counters['requests']:
+                return False
+            counters['retries'] += 1
+            return True
+
+    def delay(self, tries):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (tries - 1)))
+
+    def call(self, url, function):
+        """
+        Call `function` loading specified url, retrying while the errors are transient.
+        """
+        host = urlparse.urlsplit(url).hostname
+        self.count(host, 'requests')
+        tries = 0
+        while True:
+            try:
+                return function()
+            except StandardError as ex:
+                tries += 1
+                if not is_retryable(ex):
+                    self.fail(host, 'permanent')
+                    raise
+                if tries >= self.max_tries:
+                    self.fail(host, 'exhausted')
+                    raise
+                if not self.withdraw(host):
+                    self.fail(host, 'over_budget')
+                    raise
+                METRICS.inc('retries_total', host=host)
+                delay = self.delay(tries)
+                logger.warning('Retry #%d for "%s" in %.1fs: %s' % (tries, url, delay, ex))
+                self.sleep(delay)
+
+    def report(self):
+        """
+        Log and return retry counters by host.
+        """
+        with self.lock:
+            counters = dict((host, dict(c)) for host, c in self.counters.items())
+        for host, c in sorted(counters.items()):
+            logger.info('%s: %d requests, %d retries, %d permanent, %d exhausted, %d over budget failures' %
+                        (host, c.get('requests', 0), c.get('retries', 0), c.get('permanent_failures', 0),
+                         c.get('exhausted_failures', 0), c.get('over_budget_failures', 0)))
+        return counters
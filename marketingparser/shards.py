@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import sqlite3
+import threading
+import time
+from marketingparser.metrics import METRICS
+from marketingparser.writer import BASE_DIR, JSONWriter
+
+SHARD_SIZE = 200
+# seconds a claimed shard stays with its worker without a heartbeat
+LEASE = 120
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 1.0
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Shard:
+    """
+    Range of listing offsets crawled by one worker, with the file its posts are saved to.
+    """
+
+    def __init__(self, id, post_from, post_count, attempts=0, output=None, listed=None):
+        self.id = id
+        self.post_from = post_from
+        self.post_count = post_count
+        self.attempts = attempts
+        self.output = output
+        # posts in the listing index when the shards were planned, see Checkpoint.listed
+        self.listed = listed
+
+
+class ShardQueue:
+    """
+    Work queue of shards of a crawl, kept in a SQLite database shared by worker processes.
+
+    Workers claim shards for `lease` seconds and renew the lease while they crawl; shards of
+    workers that fail or stop renewing go back to the queue, up to `max_attempts` claims.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS shards (
+            id INTEGER PRIMARY KEY,
+            post_from INTEGER NOT NULL,
+            post_count INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            output TEXT,
+            saved INTEGER,
+            listed INTEGER
+        )""",
+    )
+
+    def __init__(self, path, lease=LEASE, max_attempts=MAX_ATTEMPTS, clock=time.time):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.connection = None
+        # workers renew leases from a heartbeat thread
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if not self.connection:
+            # transactions are begun explicitly, so that claims lock the database before reading it
+            self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            for statement in ShardQueue.SCHEMA:
+                self.connection.execute(statement)
+        return self.connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connect().execute(sql, parameters).fetchall()
+
+    def planned(self):
+        """
+        Return the first listing offset and the number of posts of the shards queued, None if there are none.
+        """
+        post_from, post_count = self.query('SELECT MIN(post_from), SUM(post_count) FROM shards')[0]
+        return None if post_from is None else (post_from, post_count)
+
+    def plan(self, post_from, post_count, shard_size=SHARD_SIZE, listed=None):
+        """
+        Split a range of listing offsets into shards, unless the queue has some already, in which
+        case failed shards are tried again.
+
+        Return the number of shards left to crawl.
+        """
+        with self.transaction() as connection:
+            if connection.execute('SELECT COUNT(*) FROM shards').fetchone()[0]:
+                connection.execute('UPDATE shards SET state = ?, attempts = 0 WHERE state = ?', (PENDING, FAILED))
+            else:
+                connection.executemany(
+                    'INSERT INTO shards (post_from, post_count, state, listed) VALUES (?, ?, ?, ?)',
+                    [(start, min(shard_size, post_from + post_count - start), PENDING, listed)
+                     for start in range(post_from, post_from + post_count, shard_size)])
+        return self.unfinished()
+
+    def give_up(self, connection, now):
+        """
+        Mark shards claimed `max_attempts` times without being crawled as failed.
+        """
+        connection.execute('UPDATE shards SET state = ?, worker = NULL WHERE attempts >= ? AND '
+                           '(state = ? OR (state = ? AND lease_until < ?))',
+                           (FAILED, self.max_attempts, PENDING, RUNNING, now))
+
+    def claim(self, worker):
+        """
+        Return the next shard to crawl for specified worker, None if there is none.
+        """
+        now = self.clock()
+        with self.transaction() as connection:
+            self.give_up(connection, now)
+            row = connection.execute("SELECT id, post_from, post_count, attempts, listed FROM shards "
+                                     "WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY id LIMIT 1",
+                                     (PENDING, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE shards SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1 '
+                               'WHERE id = ?', (RUNNING, worker, now + self.lease, row[0]))
+        return Shard(row[0], row[1], row[2], row[3] + 1, listed=row[4])
+
+    def renew(self, shard, worker):
+        """
+        Extend the lease of a shard, returning False if the worker has lost it.
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute('UPDATE shards SET lease_until = ? WHERE id = ? AND worker = ? AND state = ?',
+                                        (self.clock() + self.lease, shard.id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def finish(self, shard, worker, saved):
+        """
+        Record a crawled shard, returning False if the worker had lost it.
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute('UPDATE shards SET state = ?, output = ?, saved = ? '
+                                        'WHERE id = ? AND worker = ? AND state = ?',
+                                        (DONE, shard.output, saved, shard.id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def release(self, worker, shard=None):
+        """
+        Put shards claimed by a worker back in the queue, returning their number.
+        """
+        sql = 'UPDATE shards SET state = ?, worker = NULL WHERE worker = ? AND state = ?'
+        parameters = (PENDING, worker, RUNNING)
+        if shard is not None:
+            sql += ' AND id = ?'
+            parameters += (shard.id,)
+        with self.transaction() as connection:
+            return connection.execute(sql, parameters).rowcount
+
+    def release_all(self):
+        """
+        Put all claimed shards back in the queue, i.e. those of an interrupted crawl.
+        """
+        with self.transaction() as connection:
+            return connection.execute('UPDATE shards SET state = ?, worker = NULL WHERE state = ?',
+                                      (PENDING, RUNNING)).rowcount
+
+    def counts(self):
+        return dict(self.query('SELECT state, COUNT(*) FROM shards GROUP BY state'))
+
+    def unfinished(self):
+        """
+        Return the number of shards left to crawl, giving up on those claimed too many times.
+        """
+        with self.transaction() as connection:
+            self.give_up(connection, self.clock())
+        counts = self.counts()
+        return counts.get(PENDING, 0) + counts.get(RUNNING, 0)
+
+    def claimable(self):
+        """
+        Return the number of shards a new worker could claim now.
+        """
+        return self.query('SELECT COUNT(*) FROM shards WHERE attempts < ? AND (state = ? OR '
+                          '(state = ? AND lease_until < ?))',
+                          (self.max_attempts, PENDING, RUNNING, self.clock()))[0][0]
+
+    def shards(self, state=DONE):
+        return [Shard(*row) for row in self.query(
+            'SELECT id, post_from, post_count, attempts, output, listed FROM shards WHERE state = ? ORDER BY id',
+            (state,))]
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+
+class ShardListing:
+    """
+    The range of a listing a shard covers, ending with it however many of its posts are skipped.
+    """
+
+    def __init__(self, listing, post_from, post_count):
+        self.listing = listing
+        self.post_to = post_from + post_count
+
+    def load_page(self, post_from):
+        return self.listing.load_page(post_from)[:max(0, self.post_to - post_from)]
+
+
+class ShardWriter(JSONWriter):
+    """
+    Saves a shard's posts as JSON lines to specified file, so that they read back as they were.
+    """
+
+    def __init__(self, website, path, **options):
+        JSONWriter.__init__(self, website, **options)
+        self.filename = os.path.basename(path)
+        self.path = path
+
+
+class Heartbeat(threading.Thread):
+    """
+    Renews the lease of a shard while it is being crawled.
+    """
+
+    def __init__(self, queue, shard, worker):
+        threading.Thread.__init__(self, name='heartbeat-%d' % shard.id)
+        self.daemon = True
+        self.queue = queue
+        self.shard = shard
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease / 3.0):
+            try:
+                if not self.queue.renew(self.shard, self.worker):
+                    logger.warning('Shard %d was given to another worker' % self.shard.id)
+                    return
+            except sqlite3.Error as ex:
+                logger.warning('Failed to renew the lease of shard %d: %s' % (self.shard.id, ex))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def save_metrics(directory, name):
+    """
+    Save the metrics collected in this process since it last did under `directory`, for the
+    coordinator to merge, and reset them.
+    """
+    path = os.path.join(directory, 'metrics-%s.json' % name)
+    with open(path + '.tmp', 'wb') as f:
+        json.dump(METRICS.snapshot(), f)
+    # renamed into place, so that the coordinator never reads a partial file
+    os.rename(path + '.tmp', path)
+    METRICS.reset()
+
+
+def collect_metrics(directory):
+    """
+    Merge the metrics saved by workers under `directory` into this process's, removing their files.
+    """
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('metrics-') and name.endswith('.json'):
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as f:
+                METRICS.merge(json.load(f))
+            os.remove(path)
+
+
+def work(queue, worker, crawl, directory):
+    """
+    Crawl shards claimed from the queue until none is left.
+
+    `crawl(shard)` saves the shard's posts to `shard.output`, a new file under `directory` for
+    every claim, and returns their number. The metrics of every claim are saved next to it.
+    """
+    while True:
+        shard = queue.claim(worker)
+        if shard is None:
+            return
+        shard.output = os.path.join(directory, 'shard-%d.%d.jsonl' % (shard.id, shard.attempts))
+        logger.info('Worker %s crawls shard %d, %d posts from %d' %
+                    (worker, shard.id, shard.post_count, shard.post_from))
+        heartbeat = Heartbeat(queue, shard, worker)
+        heartbeat.start()
+        try:
+            saved = crawl(shard)
+        except StandardError as ex:
+            logger.exception('Shard %d failed: %s' % (shard.id, ex))
+            queue.release(worker, shard)
+            continue
+        finally:
+            heartbeat.stop()
+            save_metrics(directory, '%s-%d.%d' % (worker, shard.id, shard.attempts))
+        queue.finish(shard, worker, saved)
+
+
+class Coordinator:
+    """
+    Runs up to `processes` worker processes over a shard queue, replacing workers that die while
+    shards are left.
+
+    `target(worker)` runs in each worker process. Metrics that workers save under `directory` are
+    merged as they come. Workers are forked from a process running no other thread, as locks held
+    by one would never be released in the worker: `exporter` is polled from here instead.
+    """
+
+    def __init__(self, queue, processes, target, poll_interval=POLL_INTERVAL, directory=None, exporter=None):
+        self.queue = queue
+        self.processes = processes
+        self.target = target
+        self.poll_interval = poll_interval
+        self.directory = directory
+        self.exporter = exporter
+        self.workers = {}
+        self.started = 0
+
+    def start_worker(self):
+        self.started += 1
+        name = '%d.%d' % (os.getpid(), self.started)
+        # SQLite connections must not be shared with a forked process, this one reconnects when used again
+        self.queue.close()
+        process = multiprocessing.Process(target=self.target, args=(name,), name='shard-worker-%s' % name)
+        process.start()
+        self.workers[name] = process
+
+    def reap(self):
+        """
+        Forget finished workers, putting back shards of those that died with one.
+        """
+        for name, process in self.workers.items():
+            if process.is_alive():
+                continue
+            process.join()
+            del self.workers[name]
+            released = self.queue.release(name)
+            if process.exitcode or released:
+                logger.warning('Worker %s exited with code %s, %d shards put back' %
+                               (name, process.exitcode, released))
+
+    def run(self):
+        released = self.queue.release_all()
+        if released:
+            logger.info('Putting back %d shards of an interrupted crawl' % released)
+        try:
+            while True:
+                self.reap()
+                claimable = self.queue.claimable()
+                while len(self.workers) < min(self.processes, claimable):
+                    self.start_worker()
+                if not self.workers and not self.queue.unfinished():
+                    return
+                self.poll()
+                time.sleep(self.poll_interval)
+        finally:
+            for process in self.workers.values():
+                process.terminate()
+            for name, process in self.workers.items():
+                process.join()
+                self.queue.release(name)
+            self.poll()
+
+    def poll(self):
+        if self.directory:
+            collect_metrics(self.directory)
+        if self.exporter:
+            self.exporter.poll()
+
+
+def merge(queue, read, writer, skip=None):
+    """
+    Save the posts of crawled shards with `writer`, in listing order and each url once.
+
+    `read(path)` yields the posts saved to a shard's file, and posts whose url `skip(url)` is true
+    were saved before. Return the number of duplicates dropped.
+    """
+    seen = set()
+    duplicates = 0
+    for shard in queue.shards(DONE):
+        for post in read(shard.output):
+            if post.url in seen or (skip and skip(post.url)):
+                duplicates += 1
+                continue
+            seen.add(post.url)
+            writer.save(post)
+    return duplicates
+
+
+def queue_path(website, base_dir=BASE_DIR):
+    return os.path.join(base_dir, os.path.splitext(website.filename)[0] + '.shards.db')
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import logging
+from xml.etree import cElementTree as ElementTree
+from marketingparser.httpclient import CHUNK_SIZE, ChunkReader, Decoder
+
+GZIP_MAGIC = '\x1f\x8b'
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def open_sitemap(stream):
+    """
+    Return a file-like object over sitemap content read from a stream, decompressing gzipped sitemaps
+    on the fly.
+    """
+    head = stream.read(len(GZIP_MAGIC))
+    chunks = itertools.chain([head], iter(lambda: stream.read(CHUNK_SIZE), ''))
+    return ChunkReader(Decoder('gzip').stream(chunks) if head == GZIP_MAGIC else chunks)
+
+
+def iter_entries(url, open_url):
+    """
+    Stream (loc, lastmod) pairs of a sitemap in document order, following sitemap index files.
+
+    `open_url(url)` returns a file-like object over a sitemap's body. It is parsed as it is read, and
+    elements are discarded as soon as they are, so memory use does not depend on sitemap size.
+    """
+    children = []
+    stream = open_url(url)
+    try:
+        for entry in parse_entries(open_sitemap(stream), children):
+            yield entry
+    finally:
+        stream.close()
+    for child in children:
+        logger.info('Reading sitemap %s' % child)
+        for entry in iter_entries(child, open_url):
+            yield entry
+
+
+def parse_entries(sitemap, children):
+    """
+    Yield (loc, lastmod) pairs of urls in a sitemap, adding the locs of sitemaps it lists to `children`.
+    """
+    root = None
+    for event, elem in ElementTree.iterparse(sitemap, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        name = local_name(elem.tag)
+        if name not in ('url', 'sitemap'):
+            continue
+        loc, lastmod = None, None
+        for child in elem:
+            if local_name(child.tag) == 'loc':
+                loc = (child.text or '').strip()
+            elif local_name(child.tag) == 'lastmod':
+                lastmod = (child.text or '').strip()
+        if name == 'sitemap':
+            children.append(loc)
+        elif loc:
+            yield loc, lastmod
+        root.clear()
+
+
+class SitemapIndex:
+    """
+    Post urls listed in a sitemap, read once per run.
+
+    `select` turns the stream of (loc, lastmod) entries into post urls, read from sitemaps opened
+    with `open_url`, see iter_entries. With `since`, posts last modified before that date are left
+    out; those without a lastmod are kept.
+    """
+
+    def __init__(self, url, select, open_url, since=None):
+        self.url = url
+        self.select = select
+        self.open_url = open_url
+        self.since = since
+        self.urls = None
+
+    def entries(self, modified):
+        for loc, lastmod in iter_entries(self.url, self.open_url):
+            modified[loc] = lastmod
+            yield loc, lastmod
+
+    def load(self):
+        if self.urls is None:
+            modified = {}
+            self.urls = list(self.select(self.entries(modified)))
+            if self.since is not None:
+                # W3C datetimes start with the date, so they compare as strings
+                since = self.since.isoformat()
+                self.urls = [url for url in self.urls if not modified.get(url) or modified[url][:10] >= since]
+            logger.info('Indexed %d posts from %s' % (len(self.urls), self.url))
+        return self.urls
+
+    def page(self, post_from, count):
+        return self.load()[post_from:post_from + count]
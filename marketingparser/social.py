@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import logging
+import threading
+import time
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+from marketingparser.metrics import METRICS
+
+BATCH_SIZE = 10
+WORKERS = 4
+FAILURE_THRESHOLD = 5
+COOLDOWN = 300
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Disables a provider after `threshold` consecutive failures.
+
+    After `cooldown` seconds a single trial request is let through; the provider is enabled again
+    if it succeeds.
+    """
+
+    def __init__(self, name, threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= self.cooldown:
+                # half-open: let this request through, hold the others back until it completes
+                self.opened = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            if self.opened is not None:
+                logger.info('Enabled %s counts again' % self.name)
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened is None:
+                    logger.warning('Disabled %s counts after %d failures' % (self.name, self.failures))
+                self.opened = time.time()
+
+
+class Provider:
+    """
+    Social count API, looking up counts for several post urls per request when the API allows it.
+    """
+
+    name = ''
+    field = ''
+    endpoint = ''
+    batch_size = 1
+
+    def __init__(self, endpoint=None):
+        if endpoint:
+            parts = urlparse.urlsplit(endpoint)
+            self.endpoint = urlparse.urlunsplit((parts.scheme, parts.netloc) + urlparse.urlsplit(self.endpoint)[2:])
+        self.breaker = CircuitBreaker(self.name)
+
+    def request_url(self, post_urls):
+        return ''
+
+    def parse(self, body, post_urls):
+        """
+        Return a dictionary of counts by post url.
+        """
+        return {}
+
+    def lookup(self, post_urls, fetch):
+        """
+        Return a dictionary of counts by post url, fetching `batch_size` urls per request.
+        """
+        counts = {}
+        for i in range(0, len(post_urls), self.batch_size):
+            batch = post_urls[i:i + self.batch_size]
+            if not self.breaker.allow():
+                break
+            try:
+                counts.update(self.parse(fetch(self.request_url(batch)), batch))
+                self.breaker.success()
+            except StandardError as ex:
+                logger.debug('Failed to load %s counts: %s' % (self.name, ex))
+                self.breaker.failure()
+        return counts
+
+
+class Twitter(Provider):
+
+    name = 'Twitter'
+    field = 'tweet_count'
+    endpoint = 'http://urls.api.twitter.com/1/urls/count.json?url=%s'
+
+    def request_url(self, post_urls):
+        return self.endpoint % post_urls[0]
+
+    def parse(self, body, post_urls):
+        return {post_urls[0]: str(json.loads(body)['count'])}
+
+
+class Facebook(Provider):
+
+    name = 'Facebook'
+    field = 'fb_count'
+    endpoint = 'https://graph.facebook.com/fql?q=%s'
+    batch_size = BATCH_SIZE
+
+    def request_url(self, post_urls):
+        query = 'select url, like_count from link_stat where url in (%s)' % \
+            ', '.join('"%s"' % u for u in post_urls)
+        return self.endpoint % urllib.quote(query)
+
+    def parse(self, body, post_urls):
+        likes = json.loads(body)['data']
+        if len(post_urls) == 1 and len(likes) == 1:
+            return {post_urls[0]: str(likes[0]['like_count'])}
+        return dict((l['url'], str(l['like_count'])) for l in likes)
+
+
+class SocialCounter:
+    """
+    Pipeline stage filling in tweet and Facebook like counts of parsed posts.
+
+    Counts are looked up in batches on background threads, so post extraction never waits for
+    the social APIs; posts come out of the stage in the order they came in.
+    """
+
+    def __init__(self, fetch, endpoint=None, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.fetch = fetch
+        self.providers = [Twitter(endpoint), Facebook(endpoint)]
+        self.batch_size = batch_size
+        self.max_pending = workers * 2
+        self.pool = ThreadPool(workers)
+
+    def count(self, posts):
+        urls = [p.url for p in posts if p.url]
+        for provider in self.providers:
+            with METRICS.timer('social_lookup_seconds', provider=provider.name):
+                counts = provider.lookup(urls, self.fetch)
+            for post in posts:
+                setattr(post, provider.field, counts.get(post.url, ''))
+
+    def process(self, posts):
+        """
+        Yield specified posts with their counts, in order.
+        """
+        pending = collections.deque()
+        batch = []
+        for post in posts:
+            batch.append(post)
+            if len(batch) == self.batch_size:
+                pending.append((batch, self.pool.apply_async(self.count, (batch,))))
+                batch = []
+            while pending and (pending[0][1].ready() or len(pending) > self.max_pending):
+                done, result = pending.popleft()
+                result.wait()
+                for p in done:
+                    yield p
+        if batch:
+            pending.append((batch, self.pool.apply_async(self.count, (batch,))))
+        while pending:
+            done, result = pending.popleft()
+            result.wait()
+            for p in done:
+                yield p
+
+    def close(self):
+        self.pool.terminate()
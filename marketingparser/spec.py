@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import re
+import soupsieve
+from bs4.element import Tag
+from marketingparser.metrics import METRICS
+
+COMPOUND = re.compile(r'^(?P<name>[\w-]+|\*)?(?P<rest>(?:[#.][\w-]+|\[[\w-]+(?:~?=[^\]]+)?\])*)$')
+PART = re.compile(r'([#.])([\w-]+)|\[([\w-]+)(?:(~?=)([^\]]+))?\]')
+COMBINATOR = re.compile(r'\s*>\s*|\s+')
+LINE_BREAK = re.compile(r'[\r\n]+')
+SCOPE = ':scope'
+
+
+def compile_compound(text):
+    """
+    Return a predicate matching tags against a compound selector such as 'div#main.post[rel~=bookmark]'.
+    """
+    match = COMPOUND.match(text)
+    if not match or not text:
+        raise ValueError('Unsupported selector: %s' % text)
+    name = match.group('name') if match.group('name') != '*' else None
+    element_id = None
+    classes = []
+    attributes = []
+    for kind, value, attribute, operator, expected in PART.findall(match.group('rest')):
+        if kind == '#':
+            element_id = value
+        elif kind == '.':
+            classes.append(value)
+        else:
+            attributes.append((attribute, operator, expected.strip('"\'')))
+
+    def matches(tag):
+        if name and tag.name != name:
+            return False
+        if element_id and tag.get('id') != element_id:
+            return False
+        if classes:
+            tag_classes = tag.get('class') or ()
+            for c in classes:
+                if c not in tag_classes:
+                    return False
+        for attribute, operator, expected in attributes:
+            value = tag.get(attribute)
+            if value is None:
+                return False
+            # multi-valued attributes (class, rel) are lists
+            values = value if isinstance(value, list) else value.split() if operator == '~=' else [value]
+            if operator == '=' and ' '.join(values) != expected:
+                return False
+            if operator == '~=' and expected not in values:
+                return False
+        return True
+    return matches
+
+
+class Selector:
+    """
+    CSS selector compiled once, then matched against many documents.
+
+    Selectors made of tag names, ids, classes and attribute tests, joined with descendant or
+    child combinators (or lists of them), are compiled to plain predicates over a walk of the
+    tree, which is much faster than searching the tree with bs4. Elements match within the root
+    they are selected from: ancestors above the root are not considered, as with bs4's find
+    methods. Other selectors are handed to soupsieve.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            self.alternatives = [self.compile(t) for t in text.split(',')]
+            self.fallback = None
+        except ValueError:
+            self.alternatives = None
+            self.fallback = soupsieve.compile(text)
+        # ':scope > x' only looks at the root's children
+        self.children_only = self.alternatives is not None and \
+            all(len(steps) == 2 and steps[1][1] is None for steps in self.alternatives)
+
+    def compile(self, text):
+        """
+        Return the steps of a selector, right to left: (combinator to the next step, predicate), a
+        None predicate standing for the root.
+        """
+        text = text.strip()
+        compounds = COMBINATOR.split(text)
+        combinators = [c.strip() or ' ' for c in COMBINATOR.findall(text)] + [None]
+        if SCOPE in compounds[1:] or (compounds[0] == SCOPE and (len(compounds) < 2 or combinators[0] != '>')):
+            raise ValueError('Unsupported selector: %s' % text)
+        steps = [(combinator, compile_compound(compound) if compound != SCOPE else None)
+                 for compound, combinator in zip(compounds, combinators)]
+        steps.reverse()
+        # each step's combinator links it to the following step, on its left
+        return [(steps[i + 1][0] if i + 1 < len(steps) else None, steps[i][1]) for i in range(len(steps))]
+
+    def matches(self, steps, tag, root, i=0):
+        """
+        Tell whether `tag` matches `steps` from step `i` on, leftwards.
+        """
+        combinator, predicate = steps[i]
+        if predicate is None:
+            return tag is root
+        if tag is root or not predicate(tag):
+            return False
+        if combinator is None:
+            return True
+        parent = tag.parent
+        if combinator == '>':
+            return parent is not None and self.matches(steps, parent, root, i + 1)
+        while parent is not None:
+            if self.matches(steps, parent, root, i + 1):
+                return True
+            if parent is root:
+                return False
+            parent = parent.parent
+        return False
+
+    def select(self, root, limit=0):
+        """
+        Return elements under `root` matching the selector in document order, at most `limit` if set.
+        """
+        if self.fallback:
+            return self.fallback.select(root, limit)
+        found = []
+        for tag in root.children if self.children_only else root.descendants:
+            if tag.__class__ is Tag and any(self.matches(steps, tag, root) for steps in self.alternatives):
+                found.append(tag)
+                if len(found) == limit:
+                    break
+        return found
+
+    def select_one(self, root):
+        found = self.select(root, 1)
+        return found[0] if found else None
+
+
+class Document:
+    """
+    Post page being extracted: its root elements, with the selections made so far.
+
+    Every selection is cached, so that fields sharing a container (i.e. the date and rating cells
+    of a table) search the tree for it once. Different selectors still search it one at a time.
+    """
+
+    def __init__(self, roots):
+        self.roots = roots
+        self.selections = {}
+
+    def select(self, root, selector, limit=0):
+        key = (id(root), selector.text)
+        cached = self.selections.get(key)
+        # a complete selection serves any limit, a partial one smaller limits
+        if cached is not None and (cached[1] == 0 or 0 < limit <= cached[1]):
+            return cached[0][:limit] if limit else cached[0]
+        found = selector.select(root, limit)
+        self.selections[key] = (found, limit)
+        return found
+
+    def select_one(self, root, selector):
+        found = self.select(root, selector, 1)
+        return found[0] if found else None
+
+
+class Field:
+    """
+    Extraction rule of a post field.
+
+    Elements are selected with `selector` under the page's `root` element (i.e. 'soup' or 'post'),
+    inside the first `within` element if given, or as the first `selector` match in every `each`
+    element. What is read off them (their text, or attribute `attr`) is stripped and its line breaks
+    replaced with `line_break`. Single values can then be searched for `pattern`, parsed as a date
+    with `date_format` and post-processed with `process`. Several values (`many`) are joined with
+    `separator`, or returned as a list if it is None. `read` can also be 'exists' ('1' or '0') or
+    'count' (number of elements). A field with a constant `value` reads nothing.
+    """
+
+    def __init__(self, selector=None, root='post', within=None, each=None, many=False, index=0, attr=None,
+                 read='text', strip=True, line_break=None, separator=' ', pattern=None, group=0,
+                 date_format=None, process=None, default='', value=None):
+        self.selector = Selector(selector) if selector else None
+        self.root = root
+        self.within = Selector(within) if within else None
+        self.each = Selector(each) if each else None
+        self.many = many
+        self.index = index
+        self.attr = attr
+        self.read = read
+        self.strip = strip
+        self.line_break = line_break
+        self.separator = separator
+        self.pattern = re.compile(pattern) if isinstance(pattern, basestring) else pattern
+        self.group = group
+        self.date_format = date_format
+        self.process = process
+        self.default = default
+        self.value = value
+
+    def elements(self, document):
+        root = document.roots.get(self.root)
+        if root is not None and self.within:
+            root = document.select_one(root, self.within)
+        if root is None:
+            return []
+        if self.each:
+            items = document.select(root, self.each)
+            if not self.selector:
+                return items
+            return [e for e in (document.select_one(i, self.selector) for i in items) if e is not None]
+        if self.read == 'exists':
+            return document.select(root, self.selector, 1)
+        return document.select(root, self.selector, 0 if self.many or self.read == 'count' else self.index + 1)
+
+    def clean(self, element):
+        text = element.get(self.attr, '') if self.attr else element.text
+        if self.strip:
+            text = text.strip()
+        if self.line_break is not None:
+            text = LINE_BREAK.sub(self.line_break, text)
+        return text
+
+    def extract(self, document):
+        if self.value is not None:
+            return self.value
+        elements = self.elements(document)
+        if self.read == 'exists':
+            return '1' if elements else '0'
+        if self.read == 'count':
+            return str(len(elements))
+        if self.many:
+            values = [self.clean(e) for e in elements]
+            if self.separator is None:
+                return values
+            value = self.separator.join(values).strip()
+        elif len(elements) > self.index:
+            value = self.clean(elements[self.index])
+        else:
+            return self.default
+        if self.pattern:
+            match = self.pattern.search(value)
+            if not match:
+                return self.default
+            value = match.group(self.group).strip()
+        if self.date_format:
+            value = datetime.datetime.strptime(value, self.date_format).date()
+        if self.process:
+            value = self.process(value)
+        return value
+
+
+class Spec:
+    """
+    Declarative description of a website's pages: root elements of post pages by name, post
+    fields, and post links of listing pages.
+
+    Selectors are compiled once, when the spec is defined. Each field's selector walks the tree under
+    its root on its own, stopping at the elements it needs; fields share the selections of a page,
+    so that a selector used by several of them (i.e. their container) walks it once.
+    """
+
+    def __init__(self, roots=(), fields=None, links=None):
+        self.roots = [(name, Selector(selector)) for name, selector in roots]
+        self.fields = fields or {}
+        self.links = links
+
+    def find_roots(self, soup):
+        """
+        Return the root elements of a post page by name, None for missing ones.
+        """
+        document = Document({'soup': soup})
+        for name, selector in self.roots:
+            document.roots[name] = document.select_one(soup, selector)
+        return document.roots
+
+    def extract(self, roots, names=None):
+        """
+        Return the values of all fields by name, or of specified ones only.
+        """
+        document = Document(roots)
+        values = {}
+        for name, field in self.fields.items():
+            if names is not None and name not in names:
+                continue
+            with METRICS.timer('extract_field_seconds', field=name):
+                values[name] = field.extract(document)
+        return values
+
+    def find_links(self, soup):
+        """
+        Return post urls listed on a listing page.
+        """
+        return self.links.extract(Document({'soup': soup})) if self.links else []
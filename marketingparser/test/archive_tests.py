@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import gzip
+import os.path
+import shutil
+import tempfile
+import unittest
+import mock
+import marketingparser.website
+from marketingparser.archive import Archive, ArchiveMiss
+from marketingparser.httpclient import Response
+
+
+def page(url, body):
+    return Response(url, 200, 'OK', {'content-type': 'text/html; charset=utf-8'}, body)
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'site.warc.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        archive = Archive(self.path)
+        archive.put('http://a/1', page('http://a/1', '<html>one</html>'))
+        archive.put('http://a/2', page('http://a/2/', '<html>two</html>'))
+        archive.close()
+        archive = Archive(self.path, replay=True)
+        self.assertEqual(len(archive), 2)
+        response = archive.get('http://a/2')
+        self.assertEqual(response.body, '<html>two</html>')
+        self.assertEqual(response.url, 'http://a/2/')
+        self.assertEqual(response.getheader('content-type'), 'text/html; charset=utf-8')
+        self.assertRaises(ArchiveMiss, archive.get, 'http://a/3')
+
+    def test_append(self):
+        archive = Archive(self.path)
+        archive.put('http://a/1', page('http://a/1', 'old'))
+        archive.close()
+        archive = Archive(self.path)
+        archive.put('http://a/1', page('http://a/1', 'new'))
+        archive.put(u'http://a/caf\xe9', page('http://a/2', 'unicode'))
+        archive.close()
+        archive = Archive(self.path, replay=True)
+        self.assertEqual(archive.get('http://a/1').body, 'new')
+        self.assertEqual(archive.get(u'http://a/caf\xe9').body, 'unicode')
+
+    def test_gzip_members(self):
+        archive = Archive(self.path)
+        archive.put('http://a/1', page('http://a/1', 'one'))
+        archive.put('http://a/2', page('http://a/2', 'two'))
+        archive.close()
+        content = gzip.open(self.path).read()
+        self.assertTrue(content.startswith('{"'))
+        self.assertTrue(content.endswith('two'))
+        self.assertIn('one{"', content)
+
+    def test_partial_index_line(self):
+        archive = Archive(self.path)
+        archive.put('http://a/1', page('http://a/1', 'one'))
+        archive.close()
+        with open(self.path + '.idx', 'ab') as f:
+            f.write('12345\t')
+        self.assertEqual(len(Archive(self.path, replay=True)), 1)
+
+    @mock.patch('marketingparser.website.CLIENT')
+    def test_record_and_replay_fetch(self, client):
+        client.get.side_effect = lambda url: page(url, 'live')
+        with mock.patch('marketingparser.website.ARCHIVE', Archive(self.path)):
+            self.assertEqual(marketingparser.website.urlopen('http://a/1'), 'live')
+        client.get.side_effect = IOError('offline')
+        with mock.patch('marketingparser.website.ARCHIVE', Archive(self.path, replay=True)):
+            self.assertEqual(marketingparser.website.urlopen('http://a/1'), 'live')
+            self.assertRaises(ArchiveMiss, marketingparser.website.urlopen, 'http://a/2')
+        self.assertEqual(client.get.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
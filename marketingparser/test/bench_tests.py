@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os.path
+import shutil
+import tempfile
+import unittest
+import marketingparser.website
+from marketingparser.bench.extraction import FIELDS, compare, measure, record_fixtures
+from marketingparser.parser import WEBSITES
+
+
+class ExtractionBenchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        marketingparser.website.ARCHIVE = None
+        shutil.rmtree(self.directory)
+
+    def test_listing_fixtures(self):
+        for sitename, website in WEBSITES.items():
+            urls = record_fixtures(os.path.join(self.directory, sitename), sitename)
+            self.assertEqual(len(urls), website.posts_per_page, sitename)
+
+    def test_measure(self):
+        result = measure('viralblog', 2)
+        self.assertEqual(result['posts'], 24)
+        self.assertGreater(result['posts_per_sec'], 0)
+        self.assertGreater(result['parse_ms'], 0)
+        self.assertEqual(list(result['fields_ms'].keys()), list(FIELDS))
+        self.assertGreater(result['fields_ms']['text'], 0)
+        self.assertEqual(result['fields_ms']['rating'], 0)
+        self.assertIsNone(marketingparser.website.ARCHIVE)
+
+    def test_compare(self):
+        baseline = [{'site': 'viralblog', 'posts_per_sec': 100.0}, {'site': 'guerrillacomm', 'posts_per_sec': 100.0}]
+        results = [{'site': 'viralblog', 'posts_per_sec': 85.0}, {'site': 'guerrillacomm', 'posts_per_sec': 70.0},
+                   {'site': '1000heads', 'posts_per_sec': 10.0}]
+        self.assertEqual(compare(results, baseline, 0.2), ['guerrillacomm: 70.0 posts/sec, down from 100.0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
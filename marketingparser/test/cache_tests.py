@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from marketingparser.cache import CacheMiss, ResponseCache
+from marketingparser.httpclient import Response
+
+
+class FakeClient:
+    """
+    Serves a fixed body with an ETag, answering 304 to matching conditional requests.
+    """
+
+    def __init__(self, body='<html>post</html>'):
+        self.body = body
+        self.requests = []
+
+    def request(self, url, headers=None):
+        self.requests.append(headers or {})
+        if (headers or {}).get('If-None-Match') == '"v1"':
+            return Response(url, 304, 'Not Modified', {}, '')
+        return Response(url, 200, 'OK', {'etag': '"v1"', 'content-type': 'text/html; charset=utf-8'}, self.body)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.client = FakeClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fresh_hit(self):
+        cache = ResponseCache(self.directory)
+        self.assertEqual(cache.fetch(self.client, 'http://a/1').body, '<html>post</html>')
+        self.assertEqual(cache.fetch(self.client, 'http://a/1').body, '<html>post</html>')
+        self.assertEqual(len(self.client.requests), 1)
+
+    def test_revalidation(self):
+        cache = ResponseCache(self.directory, ttl=0)
+        cache.fetch(self.client, 'http://a/1')
+        response = cache.fetch(self.client, 'http://a/1')
+        self.assertEqual(self.client.requests[1], {'If-None-Match': '"v1"'})
+        self.assertEqual(response.body, '<html>post</html>')
+        self.assertEqual(response.getheader('content-type'), 'text/html; charset=utf-8')
+        cache.fetch(self.client, 'http://a/1')
+        self.assertEqual(self.client.requests[2], {'If-None-Match': '"v1"'})
+
+    def test_revalidation_keeps_file(self):
+        cache = ResponseCache(self.directory, ttl=60)
+        cache.fetch(self.client, 'http://a/1')
+        path = cache.path(cache.key('http://a/1'))
+        inode = os.stat(path).st_ino
+        # validated long ago
+        os.utime(path, (0, 0))
+        self.assertEqual(cache.fetch(self.client, 'http://a/1').body, '<html>post</html>')
+        self.assertEqual(self.client.requests[1], {'If-None-Match': '"v1"'})
+        # fresh again, without the file being rewritten
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(cache.fetch(self.client, 'http://a/1').body, '<html>post</html>')
+        self.assertEqual(len(self.client.requests), 2)
+
+    def test_persistence_and_offline(self):
+        ResponseCache(self.directory).fetch(self.client, 'http://a/1')
+        cache = ResponseCache(self.directory, ttl=0, offline=True)
+        self.assertEqual(cache.fetch(self.client, 'http://a/1').body, '<html>post</html>')
+        self.assertRaises(CacheMiss, cache.fetch, self.client, 'http://a/2')
+        self.assertEqual(len(self.client.requests), 1)
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.directory)
+        cache.fetch(self.client, 'http://a/1')
+        cache.max_size = cache.size * 2 + 10
+        cache.fetch(self.client, 'http://a/2')
+        cache.fetch(self.client, 'http://a/1')
+        cache.fetch(self.client, 'http://a/3')
+        self.assertTrue(cache.get('http://a/1'))
+        self.assertFalse(cache.get('http://a/2'))
+        self.assertTrue(cache.get('http://a/3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
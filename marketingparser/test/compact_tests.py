@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from marketingparser.compact import compact, external_sort
+from marketingparser.website import PostInfo, Website
+from marketingparser.writer import HEADER, CSVWriter, JSONWriter
+
+
+class CompactedWebsite(Website):
+
+    def __init__(self):
+        Website.__init__(self)
+        self.url = 'http://compacted'
+        self.filename = 'compacted.csv'
+        self.posts_per_page = 2
+
+
+def post(i, day, comment_count='1', comments=''):
+    info = PostInfo()
+    info.url = 'http://compacted/%d' % i
+    info.date = datetime.date(2014, 5, day) if day else None
+    info.title = u'Post №%d' % i
+    info.comment_count = comment_count
+    info.comments = comments
+    return info
+
+
+class ExternalSortTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_spilled_runs(self):
+        items = [[(i * 7919) % 1000, 'record %d' % i] for i in range(1000)]
+        # a run of about 10 items, merged 3 runs at a time
+        self.assertEqual(list(external_sort(items, self.directory, run_size=1500, fan_in=3)), sorted(items))
+        self.assertEqual(list(external_sort([], self.directory)), [])
+
+
+class CompactTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.website = CompactedWebsite()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def save(self, writer, posts):
+        if not writer.exists():
+            writer.write_header()
+        for p in posts:
+            writer.save(p)
+        writer.close()
+
+    def check(self, writer):
+        self.save(writer, [post(0, 3), post(1, 1, comments='First line\nsecond line'), post(2, None)])
+        # a later run saves some posts again, with newer counts
+        self.save(writer, [post(3, 3), post(1, 1, '5', 'First line\nsecond line'), post(0, 3, '8')])
+        self.assertEqual(compact(writer, run_size=300, fan_in=2), (4, 2))
+        saved = list(writer.saved_posts())
+        self.assertEqual([p.url for p in saved], ['http://compacted/%d' % i for i in (0, 3, 1, 2)], writer.filename)
+        self.assertEqual([p.comment_count for p in saved], ['8', '1', '5', '1'])
+        self.assertEqual(saved[2].comments, 'First line\nsecond line')
+        self.assertEqual(saved[0].title, u'Post №0')
+        # the temporary runs and file are gone
+        self.assertEqual(os.listdir('data'), [writer.filename])
+        # compacted again, nothing changes
+        self.assertEqual(compact(writer), (4, 0))
+
+    def test_csv(self):
+        writer = CSVWriter(self.website)
+        self.check(writer)
+        with open(writer.path, 'rb') as f:
+            self.assertEqual(f.read().count('URL'), 1)
+
+    def test_gzip_json(self):
+        self.check(JSONWriter(self.website, 'gzip'))
+
+    def test_failed_post(self):
+        writer = CSVWriter(self.website)
+        self.save(writer, [post(0, 1)])
+        # the row of a post that failed to load, saved by an older version
+        with open(writer.path, 'ab') as f:
+            f.write(writer.format(PostInfo()))
+        self.save(writer, [post(1, 5), post(2, 3)])
+        self.assertEqual(compact(writer, run_size=300, fan_in=2), (3, 0))
+        self.assertEqual([(p.url, p.date.day) for p in writer.saved_posts()],
+                         [('http://compacted/%d' % i, day) for i, day in ((1, 5), (2, 3), (0, 1))])
+
+    def test_older_format(self):
+        writer = CSVWriter(self.website)
+        older = '|'.join(HEADER[:-1]) + '\n' + '2014-05-01|Post|||||||||\n'
+        with open(writer.path, 'wb') as f:
+            f.write(older)
+        self.assertRaises(ValueError, compact, writer)
+        # left as it was
+        with open(writer.path, 'rb') as f:
+            self.assertEqual(f.read(), older)
+        self.assertEqual(os.listdir('data'), [writer.filename])
+
+    def test_missing_output(self):
+        self.assertEqual(compact(CSVWriter(self.website)), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import BaseHTTPServer
+import gzip
+import StringIO
+import threading
+import unittest
+import zlib
+from marketingparser.httpclient import HTTPClient, HTTPError, ResponseTooLarge
+from marketingparser.throttle import Throttle
+
+
+PAGE = '<html><body>%s</body></html>' % ('<p>Post text</p>' * 1000)
+
+
+def gzipped(content):
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(content)
+    f.close()
+    return out.getvalue()
+
+
+ENCODED = {
+    '/gzip': ('gzip', gzipped(PAGE)),
+    '/deflate': ('deflate', zlib.compress(PAGE)),
+    # raw deflate, without the zlib wrapper
+    '/raw-deflate': ('deflate', zlib.compress(PAGE)[2:-4]),
+    '/bomb': ('gzip', gzipped('\0' * 4 * 1024 * 1024))
+}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    accept_encoding = None
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        Handler.connections += 1
+
+    def do_GET(self):
+        if self.path == '/moved':
+            self.send_response(302)
+            self.send_header('Location', '/page')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/page':
+            body = 'hello'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path in ENCODED:
+            Handler.accept_encoding = self.headers.get('accept-encoding')
+            encoding, body = ENCODED[self.path]
+            self.send_response(200)
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/big':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        Handler.connections = 0
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        # the client resets connections it gives up reading from
+        self.server.handle_error = lambda request, client_address: None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.client = HTTPClient()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for i in range(5):
+            self.assertEqual(self.client.get(self.url + '/page').body, 'hello')
+        self.assertEqual(Handler.connections, 1)
+
+    def test_redirect(self):
+        response = self.client.get(self.url + '/moved')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, 'hello')
+
+    def test_error_status(self):
+        with self.assertRaises(HTTPError) as cm:
+            self.client.get(self.url + '/missing')
+        self.assertEqual(cm.exception.code, 404)
+
+    def test_idle_eviction(self):
+        self.client.idle_timeout = 0
+        self.client.get(self.url + '/page')
+        self.client.get(self.url + '/page')
+        self.assertEqual(Handler.connections, 2)
+
+    def test_throttle(self):
+        self.client.throttle = Throttle()
+        self.assertEqual(self.client.get(self.url + '/moved').body, 'hello')
+        # redirects and robots.txt, which is missing, go over the same connection
+        self.assertEqual(Handler.connections, 1)
+        limiter = self.client.throttle.limiters[self.url]
+        self.assertIsNone(limiter.crawl_delay)
+        self.assertEqual(limiter.active, 0)
+
+    def test_compressed(self):
+        for path in ('/gzip', '/deflate', '/raw-deflate'):
+            response = self.client.get(self.url + path)
+            self.assertEqual(response.body, PAGE, path)
+            self.assertIsNone(response.getheader('content-encoding'))
+            self.assertEqual(response.getheader('content-length'), str(len(PAGE)))
+        self.assertEqual(Handler.accept_encoding, 'gzip, deflate')
+        self.assertEqual(Handler.connections, 1)
+
+    def test_max_body_size(self):
+        self.client.max_body_size = 1024 * 1024
+        self.assertEqual(self.client.get(self.url + '/big').body, PAGE)
+        # inflated past the limit from a few kilobytes
+        self.assertRaises(ResponseTooLarge, self.client.get, self.url + '/bomb')
+        self.client.max_body_size = 1024
+        self.assertRaises(ResponseTooLarge, self.client.get, self.url + '/big')
+        self.assertRaises(ResponseTooLarge, self.client.get, self.url + '/gzip')
+        # connections with unread body left are not reused
+        self.assertEqual(self.client.get(self.url + '/page').body, 'hello')
+        self.assertEqual(Handler.connections, 4)
+
+    def test_open(self):
+        self.client.max_body_size = 1024
+        for path in ('/gzip', '/raw-deflate', '/big'):
+            body = self.client.open(self.url + path).body
+            # read as it arrives, past the limit of whole bodies
+            parts = iter(lambda: body.read(100), '')
+            self.assertEqual(''.join(parts), PAGE, path)
+        # inflated a chunk at a time
+        body = self.client.open(self.url + '/bomb').body
+        self.assertEqual(len(body.read(100)), 100)
+        self.assertLessEqual(len(body.buffer), 64 * 1024)
+        # closed before its end, the connection is not reused
+        body.close()
+        self.assertEqual(self.client.open(self.url + '/moved').body.read(), 'hello')
+        self.assertRaises(HTTPError, self.client.open, self.url + '/missing')
+        self.assertEqual(self.client.get(self.url + '/page').body, 'hello')
+        self.assertEqual(Handler.connections, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+from parser import Parser, parse
+from marketingparser.httpclient import HTTPError
+from marketingparser.listing import ListingIndex
+from marketingparser.website import Website
+from marketingparser.writer import MemoryWriter
+
+
+class PagedWebsite(Website):
+    """
+    Offline website listing `posts` newest first, 5 per page, with a missing page past the last one.
+    """
+
+    posts = []
+    loaded_pages = []
+
+    def __init__(self):
+        Website.__init__(self)
+        self.url = 'http://paged'
+        self.filename = 'paged.csv'
+        self.posts_per_page = 5
+
+    def get_page_url(self, page_num):
+        return '%s/page/%d' % (self.url, page_num + 1)
+
+    def load_page(self, post_from):
+        PagedWebsite.loaded_pages.append(post_from)
+        if 'http://paged/broken' in self.posts[post_from:post_from + self.posts_per_page]:
+            raise HTTPError(self.get_page_url(post_from / self.posts_per_page), 500)
+        if post_from >= len(self.posts):
+            raise HTTPError(self.get_page_url(post_from / self.posts_per_page), 404)
+        return self.posts[post_from:(post_from / self.posts_per_page + 1) * self.posts_per_page]
+
+    def load_post(self, url):
+        self.post_url = url
+        return True
+
+    def get_post_info(self):
+        info = Website.get_post_info(self)
+        info.title = self.post_url
+        return info
+
+
+class SitemapWebsite(PagedWebsite):
+
+    NEWEST_FIRST = False
+
+    def get_page_url(self, page_num):
+        return '%s/sitemap.xml' % self.url
+
+
+def publish(first, last):
+    """
+    Add posts numbered from `first` to `last` to the top of the listing.
+    """
+    PagedWebsite.posts = ['http://paged/%d' % i for i in range(last, first - 1, -1)] + PagedWebsite.posts
+
+
+class ListingIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        PagedWebsite.posts = []
+        PagedWebsite.loaded_pages = []
+        publish(0, 11)
+        self.index = ListingIndex(PagedWebsite(), self.directory)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_build(self):
+        self.assertEqual(self.index.update(), 12)
+        self.assertEqual(PagedWebsite.loaded_pages, [0, 5, 10, 12])
+        self.assertEqual(len(self.index), 12)
+        self.assertEqual(self.index.load_page(0), PagedWebsite.posts[:5])
+        self.assertEqual(self.index.load_page(10), ['http://paged/1', 'http://paged/0'])
+        self.assertEqual(self.index.url(0), 'http://paged/0')
+        self.assertEqual(self.index.query('SELECT page_url FROM posts WHERE position = 0'), [('http://paged/page/3',)])
+
+    def test_interrupted(self):
+        PagedWebsite.posts.insert(10, 'http://paged/broken')
+        self.assertRaises(HTTPError, self.index.update)
+        # nothing is indexed before the walk is through, the pages walked are kept
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.query('SELECT COUNT(*) FROM walked'), [(10,)])
+        PagedWebsite.posts.remove('http://paged/broken')
+        publish(12, 12)
+        PagedWebsite.loaded_pages = []
+        self.assertEqual(self.index.update(), 12)
+        # continued from the last page saved, the post published since is indexed by the next update
+        self.assertEqual(PagedWebsite.loaded_pages, [5, 10, 13])
+        self.assertEqual([self.index.url(p) for p in (0, 11)], ['http://paged/0', 'http://paged/11'])
+        self.assertEqual(self.index.update(), 1)
+        self.assertEqual(self.index.url(12), 'http://paged/12')
+        self.assertEqual(self.index.query('SELECT COUNT(*) FROM walked'), [(0,)])
+
+    def test_new_posts(self):
+        self.index.update()
+        publish(12, 14)
+        PagedWebsite.loaded_pages = []
+        self.assertEqual(self.index.update(), 3)
+        # the first page has indexed posts, older pages are not loaded
+        self.assertEqual(PagedWebsite.loaded_pages, [0])
+        self.assertEqual(self.index.url(0), 'http://paged/0')
+        self.assertEqual(self.index.url(14), 'http://paged/14')
+        self.assertEqual(self.index.load_page(3), ['http://paged/%d' % i for i in range(11, 6, -1)])
+        self.assertEqual(self.index.position(3), 11)
+        # the post at offset 3 before the 3 new posts
+        self.assertEqual(self.index.offset(3, 12), 6)
+        self.assertEqual(self.index.update(), 0)
+
+    def test_unsorted_listing(self):
+        self.index = ListingIndex(SitemapWebsite(), self.directory)
+        self.index.update()
+        PagedWebsite.posts.insert(7, 'http://paged/new')
+        PagedWebsite.loaded_pages = []
+        self.assertEqual(self.index.update(), 1)
+        self.assertEqual(PagedWebsite.loaded_pages, [0, 5, 10, 13])
+        # listed in the website's order, with new posts after the others
+        self.assertEqual(self.index.url(0), 'http://paged/11')
+        self.assertEqual(self.index.url(12), 'http://paged/new')
+        self.assertEqual(self.index.load_page(10), ['http://paged/1', 'http://paged/0', 'http://paged/new'])
+        self.assertEqual(self.index.position(10), 10)
+        self.assertEqual(self.index.offset(10, 12), 10)
+        self.assertEqual(self.index.query('SELECT DISTINCT page_url FROM posts'), [('http://paged/sitemap.xml',)])
+
+    def test_parse(self):
+        self.index.update()
+        publish(12, 12)
+        writer = MemoryWriter(PagedWebsite())
+        # listed from the index, without the post published since
+        parse(PagedWebsite(), writer, 3, 4, listing=self.index)
+        self.assertEqual([p.title for p in writer.page], ['http://paged/%d' % i for i in range(8, 4, -1)])
+
+    def test_empty(self):
+        feed = Parser(PagedWebsite(), listing=self.index)
+        try:
+            self.assertIs(feed.listing, self.index)
+            self.assertFalse(feed.load(0))
+        finally:
+            feed.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
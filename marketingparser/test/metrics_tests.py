@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+from marketingparser.httpclient import HTTPError
+from marketingparser.metrics import METRICS, Exporter, Histogram, Registry
+from marketingparser.retry import RetryPolicy
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+
+    def test_quantile(self):
+        histogram = Histogram((0.1, 1))
+        for value in [0.05] * 94 + [0.5] * 5 + [2]:
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.95), 1)
+        self.assertIsNone(histogram.quantile(1))
+
+
+class RegistryTestCase(unittest.TestCase):
+
+    def test_timer(self):
+        registry = Registry()
+        with registry.timer('load_post_seconds'):
+            pass
+        try:
+            with registry.timer('load_post_seconds'):
+                raise IOError()
+        except IOError:
+            pass
+        self.assertEqual(registry.histograms[('load_post_seconds', ())].count, 2)
+
+    def test_prometheus(self):
+        registry = Registry()
+        registry.inc('posts_total', status='ok')
+        registry.inc('posts_total', 2, status='ok')
+        registry.inc('fetch_errors_total', host='a', error='Bad "quote"')
+        registry.observe('fetch_seconds', 0.02, host='a')
+        registry.observe('fetch_seconds', 60, host='a')
+        lines = registry.prometheus().splitlines()
+        self.assertIn('# TYPE marketingparser_posts_total counter', lines)
+        self.assertIn('marketingparser_posts_total{status="ok"} 3.0', lines)
+        self.assertIn('marketingparser_fetch_errors_total{error="Bad \\"quote\\"",host="a"} 1.0', lines)
+        self.assertIn('# TYPE marketingparser_fetch_seconds histogram', lines)
+        self.assertIn('marketingparser_fetch_seconds_bucket{host="a",le="0.01"} 0', lines)
+        self.assertIn('marketingparser_fetch_seconds_bucket{host="a",le="0.025"} 1', lines)
+        self.assertIn('marketingparser_fetch_seconds_bucket{host="a",le="+Inf"} 2', lines)
+        self.assertIn('marketingparser_fetch_seconds_count{host="a"} 2', lines)
+
+    def test_snapshot(self):
+        registry = Registry()
+        registry.inc('posts_total', 10, status='ok')
+        registry.inc('posts_total', status='error')
+        registry.observe('flush_seconds', 0.2, writer='CSVWriter')
+        snapshot = json.loads(json.dumps(registry.snapshot()))
+        self.assertGreater(snapshot['posts_per_sec'], 0)
+        self.assertEqual(snapshot['counters'][0], {'name': 'posts_total', 'labels': {'status': 'error'}, 'value': 1})
+        self.assertEqual(snapshot['histograms'][0]['buckets']['0.25'], 1)
+        registry.summary()
+
+    def test_merge(self):
+        worker = Registry()
+        worker.inc('posts_total', 2, status='ok')
+        worker.observe('fetch_seconds', 0.02, host='a')
+        worker.observe('fetch_seconds', 60, host='a')
+        registry = Registry()
+        registry.inc('posts_total', status='ok')
+        registry.observe('fetch_seconds', 0.02, host='a')
+        # as saved by a worker process
+        registry.merge(json.loads(json.dumps(worker.snapshot())))
+        self.assertEqual(registry.total('posts_total'), 3)
+        histogram = registry.histograms[('fetch_seconds', (('host', 'a'),))]
+        self.assertEqual((histogram.count, histogram.counts[3], histogram.counts[-1]), (3, 2, 1))
+        self.assertAlmostEqual(histogram.sum, 60.04)
+
+    def test_retries(self):
+        METRICS.reset()
+        policy = RetryPolicy(max_tries=3, sleep=lambda delay: None)
+
+        def fail():
+            raise HTTPError('http://a/1', 503)
+        self.assertRaises(HTTPError, policy.call, 'http://a/1', fail)
+        self.assertEqual(METRICS.counters[('retries_total', (('host', 'a'),))], 2)
+        self.assertEqual(METRICS.counters[('failures_total', (('host', 'a'), ('reason', 'exhausted')))], 1)
+
+
+class ExporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        registry = Registry()
+        registry.inc('posts_total', status='ok')
+        json_path = os.path.join(self.directory, 'site.metrics.json')
+        prometheus_path = os.path.join(self.directory, 'site.prom')
+        exporter = Exporter(registry, json_path, prometheus_path, 0.01)
+        exporter.start()
+        exporter.stop()
+        exporter.join()
+        with open(json_path) as f:
+            self.assertEqual(json.load(f)['counters'][0]['value'], 1)
+        with open(prometheus_path) as f:
+            self.assertIn('marketingparser_posts_total{status="ok"} 1.0\n', f.read())
+        self.assertEqual(sorted(os.listdir(self.directory)), ['site.metrics.json', 'site.prom'])
+
+
+if __name__ == '__main__':
+    unittest.main()
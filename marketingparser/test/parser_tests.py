@@ -1,9 +1,19 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import datetime
+import random
+import shutil
+import signal
+import tempfile
+import time
 import unittest
-from parser import parse
-from marketingparser.website import CreativeGuerrilla, CreativeCriminals
+import mock
+from parser import ListingPrefetcher, Parser, init_process, parse
+from marketingparser.httpclient import Response
+from marketingparser.checkpoint import Checkpoint
+from marketingparser.metrics import METRICS
+from marketingparser.website import PostInfo, Website, CreativeGuerrilla, CreativeCriminals, DigitalBuzz
 from marketingparser.writer import MemoryWriter
 
 
@@ -51,5 +61,294 @@ class ParserTestCase(unittest.TestCase):
             self.assertEqual(writer.post_count, 0)
 
 
+class FakeWebsite(Website):
+    """
+    Offline website with 3 pages of 5 posts each and random post latency.
+    """
+
+    # urls of loaded posts
+    loaded = []
+
+    def __init__(self):
+        Website.__init__(self)
+        self.url = 'http://fake'
+        self.filename = 'fake.csv'
+        self.posts_per_page = 5
+
+    def load_page(self, post_from):
+        links = ['%s/%d' % (self.url, i) for i in range(15)]
+        return links[post_from:(post_from / self.posts_per_page + 1) * self.posts_per_page]
+
+    def load_post(self, url):
+        time.sleep(random.random() / 100)
+        self.post_url = url
+        FakeWebsite.loaded.append(url)
+        return True
+
+    def get_post_info(self):
+        info = PostInfo()
+        info.url = self.post_url
+        info.title = self.post_url
+        return info
+
+
+class FailingWebsite(FakeWebsite):
+
+    def load_post(self, url):
+        if url.endswith('/7'):
+            raise IOError('Connection reset')
+        return FakeWebsite.load_post(self, url)
+
+
+class ConcurrentParserTestCase(unittest.TestCase):
+
+    def titles(self, post_from, post_count, workers):
+        writer = MemoryWriter(FakeWebsite())
+        parse(FakeWebsite(), writer, post_from, post_count, workers)
+        return [p.title for p in writer.page]
+
+    def test_listing_order(self):
+        self.assertEqual(self.titles(0, None, 4), self.titles(0, None, 1))
+        self.assertEqual(self.titles(0, None, 4), ['http://fake/%d' % i for i in range(15)])
+
+    def test_post_from_and_count(self):
+        self.assertEqual(self.titles(3, 6, 4), ['http://fake/%d' % i for i in range(3, 9)])
+        self.assertEqual(self.titles(3, 6, 4), self.titles(3, 6, 1))
+
+    def test_failed_posts(self):
+        writer = MemoryWriter(FakeWebsite())
+        parse(FailingWebsite(), writer, 0, None, 4)
+        # posts that failed to load are not saved
+        self.assertEqual([p.title for p in writer.page], ['http://fake/%d' % i for i in range(15) if i != 7])
+
+
+class ChainedWebsite(FakeWebsite):
+    """
+    Fake website whose listing pages link to the next one, like Blogger's "older posts" link.
+    """
+
+    def __init__(self):
+        FakeWebsite.__init__(self)
+        self.next_page = 0
+        self.loaded_pages = []
+
+    def load_page(self, post_from):
+        time.sleep(0.01)
+        if self.next_page == 2:
+            raise IOError('Listing page not found')
+        page = self.next_page
+        self.next_page += 1
+        self.loaded_pages.append(page)
+        return ['%s/%d' % (self.url, i) for i in range(page * 5, page * 5 + 5)]
+
+
+class PrefetchTestCase(unittest.TestCase):
+
+    def titles(self, workers, prefetch, post_count=None):
+        writer = MemoryWriter(FakeWebsite())
+        parse(FakeWebsite(), writer, 0, post_count, workers, prefetch=prefetch)
+        return [p.title for p in writer.page]
+
+    def test_listing_order(self):
+        expected = ['http://fake/%d' % i for i in range(15)]
+        self.assertEqual(self.titles(1, 2), expected)
+        self.assertEqual(self.titles(4, 2), expected)
+        self.assertEqual(self.titles(4, 1, 7), expected[:7])
+        self.assertEqual(self.titles(4, 0), expected)
+
+    def test_loads_ahead(self):
+        website = ChainedWebsite()
+        feed = Parser(website, prefetch=2)
+        try:
+            self.assertTrue(feed.load(0))
+            for _ in range(50):
+                if website.loaded_pages == [0, 1]:
+                    break
+                time.sleep(0.01)
+            # the second page is loaded while the first one is being parsed
+            self.assertEqual(website.loaded_pages, [0, 1])
+            self.assertEqual(feed.current_index, 0)
+        finally:
+            feed.close()
+
+    def test_depth(self):
+        website = ChainedWebsite()
+        prefetcher = ListingPrefetcher(website, 0, 1)
+        prefetcher.start()
+        try:
+            time.sleep(0.1)
+            # the next page is loaded ahead, not the one after it
+            self.assertEqual(website.loaded_pages, [0])
+            self.assertEqual(len(prefetcher.get()), 5)
+            time.sleep(0.1)
+            self.assertEqual(website.loaded_pages, [0, 1])
+        finally:
+            prefetcher.stop()
+            prefetcher.join()
+
+    def test_chained_pages(self):
+        writer = MemoryWriter(FakeWebsite())
+        parse(ChainedWebsite(), writer, 0, None, 4)
+        # the listing error ends the crawl after the pages loaded before it
+        self.assertEqual([p.title for p in writer.page], ['http://fake/%d' % i for i in range(10)])
+
+
+class DatedWebsite(FakeWebsite):
+    """
+    Fake website with a post a day, the newest first, and an undated post.
+    """
+
+    def get_post_info(self):
+        info = FakeWebsite.get_post_info(self)
+        number = int(self.post_url.rsplit('/', 1)[1])
+        info.date = datetime.date(2014, 5, 20 - number) if number != 3 else None
+        return info
+
+
+class ShuffledWebsite(DatedWebsite):
+
+    NEWEST_FIRST = False
+
+    def get_post_info(self):
+        info = DatedWebsite.get_post_info(self)
+        if info.date and int(self.post_url.rsplit('/', 1)[1]) % 2:
+            info.date = info.date.replace(month=4)
+        return info
+
+
+class SinceTestCase(unittest.TestCase):
+
+    def titles(self, website, workers, post_count=None):
+        writer = MemoryWriter(website)
+        parse(website, writer, 0, post_count, workers, since=datetime.date(2014, 5, 12))
+        return [p.title for p in writer.page]
+
+    def test_newest_first(self):
+        for workers in (1, 4):
+            # stops at the first older post, undated posts are kept
+            self.assertEqual(self.titles(DatedWebsite(), workers), ['http://fake/%d' % i for i in range(9)])
+
+    def test_other_order(self):
+        for workers in (1, 4):
+            self.assertEqual(self.titles(ShuffledWebsite(), workers),
+                             ['http://fake/%d' % i for i in (0, 2, 3, 4, 6, 8)])
+
+    def test_count(self):
+        for workers in (1, 4):
+            # posts older than since do not count, the posts cut off at the count are fetched instead
+            self.assertEqual(self.titles(ShuffledWebsite(), workers, 4), ['http://fake/%d' % i for i in (0, 2, 3, 4)])
+            self.assertEqual(self.titles(ShuffledWebsite(), workers, 5),
+                             ['http://fake/%d' % i for i in (0, 2, 3, 4, 6)])
+
+
+class ListedDigitalBuzz(DigitalBuzz):
+    """
+    Digital Buzz with a fixed listing of 10 posts.
+    """
+
+    def load_page(self, post_from):
+        return ['http://post/%d' % i for i in range(10)][post_from:]
+
+
+def fetch_post(url, ttl=None):
+    body = ('<html><body><div class="post box"><h2><a href="#">Post %s</a></h2>'
+            '<table class="date-comments"><tr><td>Sun, May 11, 2014</td>'
+            '<td class="post-ratings">average: 3.63 out of 5</td></tr></table>'
+            '<div class="author_info"><h3>Posted by: Aden Hepburn</h3></div>'
+            '<div class="entry"><p>Text</p></div></div>'
+            '<div id="social-tabs-comments"><div class="social-wordpress"><span>(0)</span></div></div>'
+            '</body></html>') % url.rsplit('/', 1)[-1]
+    return Response(url, 200, 'OK', {'content-type': 'text/html; charset=utf-8'}, body)
+
+
+class ProcessParserTestCase(unittest.TestCase):
+
+    @mock.patch('marketingparser.website.fetch', fetch_post)
+    def titles(self, workers, processes):
+        writer = MemoryWriter(ListedDigitalBuzz())
+        parse(ListedDigitalBuzz(), writer, 0, None, workers, processes=processes)
+        return [p.title for p in writer.page]
+
+    def test_listing_order(self):
+        self.assertEqual(self.titles(1, 2), ['Post %d' % i for i in range(10)])
+        self.assertEqual(self.titles(4, 2), self.titles(1, 0))
+
+    def test_init_process(self):
+        # as left by a thread of the parent at the fork
+        lock = METRICS.lock
+        lock.acquire()
+        interrupt = signal.getsignal(signal.SIGINT)
+        try:
+            init_process()
+            self.assertTrue(METRICS.lock.acquire(False))
+            METRICS.lock.release()
+        finally:
+            METRICS.lock = lock
+            lock.release()
+            signal.signal(signal.SIGINT, interrupt)
+
+
+class CheckpointWriter(MemoryWriter):
+    """
+    Keeps posts in memory, committing them to the checkpoint on flush like CSVWriter does.
+    """
+
+    def __init__(self, website):
+        MemoryWriter.__init__(self, website)
+        self.flushed = 0
+
+    def save(self, post):
+        MemoryWriter.save(self, post)
+        if len(self.page) - self.flushed == self.page_size:
+            self.flush()
+
+    def flush(self):
+        self.commit([p.url for p in self.page[self.flushed:]])
+        self.flushed = len(self.page)
+
+
+class ResumeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        FakeWebsite.loaded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        checkpoint = Checkpoint('fake.csv', self.directory)
+        parse(FakeWebsite(), CheckpointWriter(FakeWebsite()), 0, 7, checkpoint=checkpoint)
+        checkpoint = Checkpoint('fake.csv', self.directory)
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(checkpoint.position, 7)
+        self.assertEqual(len(checkpoint.seen), 7)
+        self.assertIsNone(checkpoint.listed)
+
+        FakeWebsite.loaded = []
+        writer = CheckpointWriter(FakeWebsite())
+        parse(FakeWebsite(), writer, checkpoint.position, checkpoint=checkpoint, resume=True)
+        self.assertEqual([p.title for p in writer.page], ['http://fake/%d' % i for i in range(7, 15)])
+        self.assertEqual(checkpoint.position, 15)
+
+    def test_listed(self):
+        checkpoint = Checkpoint('fake.csv', self.directory)
+        checkpoint.listed = 120
+        parse(FakeWebsite(), CheckpointWriter(FakeWebsite()), 0, 5, checkpoint=checkpoint)
+        checkpoint = Checkpoint('fake.csv', self.directory)
+        checkpoint.load()
+        self.assertEqual((checkpoint.position, checkpoint.listed), (5, 120))
+
+    def test_skip_seen(self):
+        checkpoint = Checkpoint('fake.csv', self.directory)
+        checkpoint.seen.add(['http://fake/%d' % i for i in (1, 2, 6)])
+        writer = CheckpointWriter(FakeWebsite())
+        parse(FakeWebsite(), writer, 0, 10, workers=3, checkpoint=checkpoint, resume=True)
+        expected = ['http://fake/%d' % i for i in range(15) if i not in (1, 2, 6)][:10]
+        self.assertEqual([p.title for p in writer.page], expected)
+        self.assertFalse(set(FakeWebsite.loaded) & set(['http://fake/1', 'http://fake/2', 'http://fake/6']))
+        self.assertEqual(checkpoint.position, 13)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from marketingparser.refresh import refresh, saved_urls
+from marketingparser.website import PostInfo, Website
+from marketingparser.writer import CSVWriter, JSONWriter, MemoryWriter, SQLiteWriter
+
+
+class CountedWebsite(Website):
+    """
+    Offline website whose posts have as many comments as their number, failing to load post #1.
+    """
+
+    def __init__(self):
+        Website.__init__(self)
+        self.url = 'http://counted'
+        self.filename = 'counted.csv'
+        self.posts_per_page = 2
+        self.loaded = []
+
+    def load_counts(self, url):
+        self.loaded.append(url)
+        number = int(url.rsplit('/', 1)[1])
+        if number == 1:
+            raise IOError('Connection reset')
+        info = PostInfo()
+        info.url = url
+        info.comment_count = str(number)
+        return info
+
+
+def post(i, comments=''):
+    info = PostInfo()
+    info.url = 'http://counted/%d' % i
+    info.date = datetime.date(2014, 5, i + 1)
+    info.title = 'Post %d' % i
+    info.comment_count = '9'
+    info.tweet_count = '7'
+    info.comments = comments
+    return info
+
+
+class RefreshTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.website = CountedWebsite()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def save(self, writer, posts):
+        writer.write_header()
+        for p in posts:
+            writer.save(p)
+        writer.close()
+
+    def test_saved_posts(self):
+        posts = [post(0), post(1, 'First line\nsecond line'), post(2)]
+        for writer in (CSVWriter(self.website), JSONWriter(self.website, 'gzip'), SQLiteWriter(self.website)):
+            self.save(writer, posts)
+            saved = list(writer.saved_posts())
+            self.assertEqual([p.url for p in saved], ['http://counted/%d' % i for i in range(3)], writer.filename)
+            self.assertEqual(saved[1].date, datetime.date(2014, 5, 2))
+            self.assertEqual(saved[1].comments, 'First line\nsecond line')
+            writer.close()
+
+    def test_saved_urls(self):
+        writer = CSVWriter(self.website)
+        self.save(writer, [post(0), post(1)])
+        writer.save(post(0))
+        writer.close()
+        self.assertEqual(list(saved_urls(writer)), ['http://counted/0', 'http://counted/1'])
+
+    def test_delta_file(self):
+        writer = CSVWriter(self.website)
+        self.save(writer, [post(i) for i in range(4)])
+        refresh(self.website, writer, writer.counts_writer(self.website), workers=2, post_count=3)
+        self.assertEqual(self.website.loaded, ['http://counted/%d' % i for i in range(3)])
+        with open(os.path.join('data', 'counted.counts.csv'), 'rb') as f:
+            rows = [line.split('|')[:4] for line in f.read().splitlines()]
+        self.assertEqual(rows, [['URL', 'Comment#', 'Tweet#', 'FB#'], ['http://counted/0', '0', '', ''],
+                                ['http://counted/1', '', '', ''], ['http://counted/2', '2', '', '']])
+        # the output itself is left as it is
+        self.assertEqual([p.comment_count for p in writer.saved_posts()], ['9'] * 4)
+
+    def test_in_place(self):
+        writer = SQLiteWriter(self.website)
+        self.save(writer, [post(i) for i in range(3)])
+        refresh(self.website, writer, writer.counts_writer(self.website))
+        db = sqlite3.connect(writer.path)
+        rows = db.execute('SELECT url, title, comment_count, tweet_count FROM posts ORDER BY url').fetchall()
+        db.close()
+        # counts that failed to load keep their value
+        self.assertEqual(rows, [('http://counted/0', 'Post 0', 0, 7), ('http://counted/1', 'Post 1', 9, 7),
+                                ('http://counted/2', 'Post 2', 2, 7)])
+
+    def test_memory(self):
+        writer = MemoryWriter(self.website)
+        self.save(writer, [post(3), post(2)])
+        counts = writer.counts_writer(self.website)
+        refresh(self.website, writer, counts)
+        self.assertEqual([(p.url, p.comment_count) for p in counts.page],
+                         [('http://counted/3', '3'), ('http://counted/2', '2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
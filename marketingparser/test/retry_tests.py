@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import socket
+import unittest
+from marketingparser.cache import CacheMiss
+from marketingparser.httpclient import HTTPError, ResponseTooLarge
+from marketingparser.retry import RetryPolicy, is_retryable
+
+
+class Failing:
+    """
+    Raises the given errors in turn, then returns 'ok'.
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class RetryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.delays = []
+        self.policy = RetryPolicy(max_tries=4, sleep=self.delays.append)
+
+    def test_classification(self):
+        self.assertTrue(is_retryable(HTTPError('http://a', 503)))
+        self.assertTrue(is_retryable(HTTPError('http://a', 429)))
+        self.assertTrue(is_retryable(socket.timeout('timed out')))
+        self.assertTrue(is_retryable(socket.error(104, 'Connection reset by peer')))
+        self.assertTrue(is_retryable(socket.gaierror(socket.EAI_AGAIN, 'Temporary failure')))
+        self.assertFalse(is_retryable(socket.gaierror(socket.EAI_NONAME, 'Name or service not known')))
+        self.assertFalse(is_retryable(HTTPError('http://a/404', 404)))
+        self.assertFalse(is_retryable(CacheMiss('not cached')))
+        self.assertFalse(is_retryable(ResponseTooLarge('http://a/big', 1024)))
+        self.assertFalse(is_retryable(ValueError('bad json')))
+
+    def test_permanent_error(self):
+        function = Failing(HTTPError('http://a/404', 404))
+        self.assertRaises(HTTPError, self.policy.call, 'http://a/404', function)
+        self.assertEqual(function.calls, 1)
+        self.assertEqual(self.policy.counters['a']['permanent_failures'], 1)
+
+    def test_backoff(self):
+        function = Failing(socket.timeout(), HTTPError('http://a/', 503))
+        self.assertEqual(self.policy.call('http://a/', function), 'ok')
+        self.assertEqual(function.calls, 3)
+        self.assertEqual(len(self.delays), 2)
+        self.assertTrue(0 <= self.delays[0] <= self.policy.base_delay)
+        self.assertTrue(0 <= self.delays[1] <= self.policy.base_delay * 2)
+        self.assertEqual(self.policy.report()['a']['retries'], 2)
+
+    def test_max_tries(self):
+        function = Failing(*[socket.timeout()] * 10)
+        self.assertRaises(socket.timeout, self.policy.call, 'http://a/', function)
+        self.assertEqual(function.calls, 4)
+        self.assertEqual(self.policy.counters['a']['exhausted_failures'], 1)
+
+    def test_budget(self):
+        self.policy.min_retries = 2
+        self.policy.budget_ratio = 0
+        self.assertRaises(socket.timeout, self.policy.call, 'http://a/', Failing(*[socket.timeout()] * 10))
+        self.assertEqual(self.policy.counters['a']['retries'], 2)
+        function = Failing(socket.timeout())
+        self.assertRaises(socket.timeout, self.policy.call, 'http://a/', function)
+        self.assertEqual(function.calls, 1)
+        self.assertEqual(self.policy.call('http://b/', Failing(socket.timeout())), 'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()
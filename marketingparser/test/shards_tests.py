@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from parser import crawl_shards
+from marketingparser.checkpoint import Checkpoint
+from marketingparser.listing import ListingIndex
+from marketingparser.metrics import METRICS
+from marketingparser.shards import DONE, FAILED, PENDING, Coordinator, ShardQueue, collect_metrics, merge, work
+from marketingparser.website import PostInfo
+from marketingparser.writer import CSVWriter, MemoryWriter
+from test.listing_tests import PagedWebsite, publish
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def posts(urls):
+    for url in urls:
+        info = PostInfo()
+        info.url = url
+        yield info
+
+
+class ShardQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = Clock()
+        self.queue = ShardQueue(os.path.join(self.directory, 'test.shards.db'), lease=10, max_attempts=2,
+                                clock=self.clock)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.directory)
+
+    def test_plan(self):
+        self.assertEqual(self.queue.plan(5, 12, 5), 3)
+        self.assertEqual([(s.post_from, s.post_count) for s in self.queue.shards(PENDING)],
+                         [(5, 5), (10, 5), (15, 2)])
+        # planned once, a crawl continues with the shards left
+        self.assertEqual(self.queue.plan(0, 100, 5), 3)
+
+    def test_lease(self):
+        self.queue.plan(0, 10, 5)
+        first = self.queue.claim('a')
+        second = self.queue.claim('b')
+        self.assertEqual((first.id, second.id), (1, 2))
+        self.assertIsNone(self.queue.claim('c'))
+        self.clock.now += 5
+        self.assertTrue(self.queue.renew(first, 'a'))
+        self.clock.now += 6
+        # b stopped renewing its lease
+        again = self.queue.claim('c')
+        self.assertEqual((again.id, again.attempts), (2, 2))
+        self.assertFalse(self.queue.renew(second, 'b'))
+        self.assertFalse(self.queue.finish(second, 'b', 5))
+        self.assertTrue(self.queue.finish(again, 'c', 5))
+        self.assertEqual(self.queue.counts(), {DONE: 1, 'running': 1})
+
+    def test_give_up(self):
+        self.queue.plan(0, 5, 5)
+        for worker in ('a', 'b'):
+            shard = self.queue.claim(worker)
+            self.assertEqual(self.queue.release(worker, shard), 1)
+        self.assertIsNone(self.queue.claim('c'))
+        self.assertEqual(self.queue.unfinished(), 0)
+        self.assertEqual(self.queue.counts(), {FAILED: 1})
+        # failed shards are tried again in the next crawl
+        self.assertEqual(self.queue.plan(0, 5, 5), 1)
+        self.assertEqual(self.queue.claim('d').attempts, 1)
+
+    def test_work_and_merge(self):
+        self.queue.plan(0, 6, 2)
+        crawled = {}
+
+        def crawl(shard):
+            if shard.id == 2 and shard.attempts == 1:
+                raise IOError('Connection reset')
+            urls = ['http://a/%d' % i for i in range(shard.post_from, shard.post_from + shard.post_count)]
+            # posts that moved to the next page between listings
+            if shard.id == 3:
+                urls.insert(0, 'http://a/3')
+            crawled[shard.output] = urls
+            return len(urls)
+
+        work(self.queue, 'a', crawl, self.directory)
+        self.assertEqual(self.queue.counts(), {DONE: 3})
+        self.assertEqual(self.queue.shards()[1].output, os.path.join(self.directory, 'shard-2.2.jsonl'))
+        writer = MemoryWriter(PagedWebsite())
+        self.assertEqual(merge(self.queue, lambda path: posts(crawled[path]), writer), 1)
+        self.assertEqual([p.url for p in writer.page], ['http://a/%d' % i for i in range(6)])
+
+    def test_metrics(self):
+        self.queue.plan(0, 4, 2)
+
+        def crawl(shard):
+            METRICS.inc('posts_total', shard.post_count, status='ok')
+            return shard.post_count
+
+        METRICS.reset()
+        work(self.queue, 'a', crawl, self.directory)
+        self.assertEqual(METRICS.total('posts_total'), 0)
+        collect_metrics(self.directory)
+        self.assertEqual(METRICS.total('posts_total'), 4)
+        self.assertEqual(os.listdir(self.directory), ['test.shards.db'])
+
+
+def crawl_or_die(queue_path, directory):
+    def target(worker):
+        queue = ShardQueue(queue_path)
+        # the first worker dies with its shard claimed
+        if worker.endswith('.1'):
+            queue.claim(worker)
+            os._exit(1)
+
+        def crawl(shard):
+            # leaves the first worker time to claim a shard
+            time.sleep(0.05)
+            METRICS.inc('posts_total', status='ok')
+            with open(shard.output, 'wb') as f:
+                f.write(str(shard.id))
+            return 1
+        work(queue, worker, crawl, directory)
+    return target
+
+
+class CoordinatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = ShardQueue(os.path.join(self.directory, 'test.shards.db'))
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.directory)
+
+    def test_dead_worker(self):
+        self.queue.plan(0, 8, 2)
+        METRICS.reset()
+        Coordinator(self.queue, 2, crawl_or_die(self.queue.path, self.directory), poll_interval=0.05,
+                    directory=self.directory).run()
+        self.assertEqual(self.queue.counts(), {DONE: 4})
+        # merged from the workers
+        self.assertEqual(METRICS.total('posts_total'), 4)
+        outputs = [name for name in os.listdir(self.directory) if name.endswith('.jsonl')]
+        self.assertEqual(sorted(name.split('.')[0] for name in outputs), ['shard-%d' % i for i in range(1, 5)])
+        # the dead worker's shard was crawled on its second claim
+        self.assertEqual(len([name for name in outputs if '.2.' in name]), 1)
+
+
+class CrawlShardsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        PagedWebsite.posts = []
+        publish(0, 11)
+        self.index = ListingIndex(PagedWebsite())
+        self.index.update()
+
+    def tearDown(self):
+        self.index.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_merged_output(self):
+        # published after the index was updated, not crawled
+        publish(12, 12)
+        writer = CSVWriter(PagedWebsite())
+        crawl_shards(PagedWebsite(), writer, self.index, 1, 10, 3, shard_size=3, social=False, prefetch=0)
+        titles = [p.title for p in writer.saved_posts()]
+        self.assertEqual(titles, ['http://paged/%d' % i for i in range(10, 0, -1)])
+        with open(writer.path, 'rb') as f:
+            self.assertEqual(f.read().count('URL'), 1)
+        # the queue and shard files are removed once merged
+        self.assertEqual(sorted(os.listdir('data')), ['paged.csv', 'paged.index.db'])
+
+    def test_saved_posts(self):
+        writer = CSVWriter(PagedWebsite())
+        checkpoint = Checkpoint(writer.filename)
+        crawl_shards(PagedWebsite(), writer, self.index, 0, None, 3, shard_size=3, social=False, checkpoint=checkpoint,
+                     prefetch=0)
+        self.assertEqual(len(checkpoint.seen), 12)
+        publish(12, 13)
+        self.index.update()
+        PagedWebsite.loaded_pages = []
+        for resume, since in ((False, datetime.date(2014, 5, 1)), (True, None)):
+            writer = CSVWriter(PagedWebsite())
+            crawl_shards(PagedWebsite(), writer, self.index, 0, None, 3, shard_size=3, social=False,
+                         checkpoint=checkpoint, prefetch=0, since=since, resume=resume)
+            # added to the output, without the posts saved before
+            self.assertEqual([p.title for p in writer.saved_posts()],
+                             ['http://paged/%d' % i for i in range(11, -1, -1) + [13, 12]])
+        self.assertEqual(len(checkpoint.seen), 14)
+
+    def test_planned_range(self):
+        ShardQueue(os.path.join('data', 'paged.shards.db')).plan(1, 10, 3)
+        writer = CSVWriter(PagedWebsite())
+        crawl_shards(PagedWebsite(), writer, self.index, 0, 5, 3, shard_size=3, social=False, prefetch=0)
+        # refused, the queued shards are left to crawl
+        self.assertFalse(writer.exists())
+        crawl_shards(PagedWebsite(), writer, self.index, 1, None, 3, shard_size=3, social=False, prefetch=0)
+        self.assertEqual(len(list(writer.saved_posts())), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import datetime
+import gzip
+import StringIO
+import unittest
+from marketingparser.sitemap import SitemapIndex, iter_entries
+from marketingparser.website import CreativeCriminals
+
+URLSET = '<?xml version="1.0" encoding="UTF-8"?>' \
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</urlset>'
+INDEX = '<?xml version="1.0" encoding="UTF-8"?>' \
+    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</sitemapindex>'
+
+
+def urlset(*locs):
+    return URLSET % ''.join('<url><loc>%s</loc><lastmod>2014-05-11</lastmod></url>' % l for l in locs)
+
+
+def gzipped(content):
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(content)
+    f.close()
+    return out.getvalue()
+
+
+class SitemapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.fetched = []
+        self.sitemaps = {
+            'http://a/sitemap.xml': INDEX % (
+                '<sitemap><loc>http://a/posts.xml</loc></sitemap>'
+                '<sitemap><loc>http://a/more.xml.gz</loc></sitemap>'),
+            'http://a/posts.xml': urlset('http://a/1', 'http://a/2'),
+            'http://a/more.xml.gz': gzipped(urlset('http://a/3'))
+        }
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        return StringIO.StringIO(self.sitemaps[url])
+
+    def test_index_and_gzip(self):
+        entries = list(iter_entries('http://a/sitemap.xml', self.fetch))
+        self.assertEqual(entries, [('http://a/1', '2014-05-11'), ('http://a/2', '2014-05-11'),
+                                   ('http://a/3', '2014-05-11')])
+
+    def test_closed(self):
+        opened = []
+
+        def fetch(url):
+            opened.append(self.fetch(url))
+            return opened[-1]
+        entries = iter_entries('http://a/sitemap.xml', fetch)
+        self.assertEqual(next(entries), ('http://a/1', '2014-05-11'))
+        # left before the end, i.e. by takewhile
+        entries.close()
+        self.assertEqual([f.closed for f in opened], [True, True])
+
+    def test_read_once(self):
+        index = SitemapIndex('http://a/sitemap.xml', lambda entries: (loc for loc, _ in entries), self.fetch)
+        self.assertEqual(index.page(1, 1), ['http://a/2'])
+        self.assertEqual(index.page(2, 10), ['http://a/3'])
+        self.assertEqual(index.page(3, 10), [])
+        self.assertEqual(len(self.fetched), 3)
+
+    def test_since(self):
+        self.sitemaps['http://a/posts.xml'] = URLSET % (
+            '<url><loc>http://a/1</loc><lastmod>2014-05-09T10:00:00+00:00</lastmod></url>'
+            '<url><loc>http://a/2</loc><lastmod>2014-05-10T10:00:00+00:00</lastmod></url>'
+            '<url><loc>http://a/4</loc></url>')
+        index = SitemapIndex('http://a/sitemap.xml', lambda entries: (loc for loc, _ in entries), self.fetch,
+                             datetime.date(2014, 5, 10))
+        self.assertEqual(index.page(0, 10), ['http://a/2', 'http://a/4', 'http://a/3'])
+
+    def test_creativecriminals_posts(self):
+        locs = ['http://creativecriminals.com/page%d' % i for i in range(CreativeCriminals.STATIC_PAGE_COUNT)]
+        locs += ['http://creativecriminals.com/brand/post', 'http://creativecriminals.com//company']
+        website = CreativeCriminals()
+        posts = list(website.select_posts((l, None) for l in locs))
+        self.assertEqual(posts, ['http://creativecriminals.com/brand/post'])
+
+
+if __name__ == '__main__':
+    unittest.main()
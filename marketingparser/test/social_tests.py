@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+import urllib
+import urlparse
+from marketingparser.social import CircuitBreaker, Facebook, SocialCounter, Twitter
+from marketingparser.website import PostInfo
+
+
+def post(url):
+    info = PostInfo()
+    info.url = url
+    return info
+
+
+class FakeAPI:
+    """
+    Answers Twitter and Facebook count requests, failing Twitter if asked to.
+    """
+
+    def __init__(self, twitter_down=False):
+        self.twitter_down = twitter_down
+        self.requests = []
+
+    def fetch(self, url):
+        self.requests.append(url)
+        parts = urlparse.urlsplit(url)
+        query = urlparse.parse_qs(parts.query)
+        if parts.path.endswith('count.json'):
+            if self.twitter_down:
+                raise IOError('Twitter is down')
+            return json.dumps({'count': len(query['url'][0])})
+        urls = query['q'][0].split('"')[1::2]
+        return json.dumps({'data': [{'url': u, 'like_count': 1} for u in urls]})
+
+
+class SocialTestCase(unittest.TestCase):
+
+    def test_order_and_counts(self):
+        api = FakeAPI()
+        counter = SocialCounter(api.fetch, batch_size=3)
+        urls = ['http://a/%s' % ('x' * i) for i in range(7)]
+        posts = list(counter.process(post(u) for u in urls))
+        counter.close()
+        self.assertEqual([p.url for p in posts], urls)
+        self.assertEqual([p.tweet_count for p in posts], [str(len(u)) for u in urls])
+        self.assertEqual([p.fb_count for p in posts], ['1'] * 7)
+        # one Twitter request per post, one Facebook request per batch
+        self.assertEqual(len(api.requests), 7 + 3)
+
+    def test_circuit_breaker(self):
+        api = FakeAPI(twitter_down=True)
+        counter = SocialCounter(api.fetch, batch_size=1, workers=1)
+        posts = list(counter.process(post('http://a/%d' % i) for i in range(10)))
+        counter.close()
+        self.assertEqual([p.tweet_count for p in posts], [''] * 10)
+        self.assertEqual([p.fb_count for p in posts], ['1'] * 10)
+        twitter_requests = [r for r in api.requests if 'count.json' in r]
+        self.assertEqual(len(twitter_requests), counter.providers[0].breaker.threshold)
+
+    def test_half_open(self):
+        breaker = CircuitBreaker('Test', threshold=2, cooldown=0)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.failures, 0)
+
+    def test_endpoint(self):
+        self.assertEqual(Twitter('http://localhost:8000').request_url(['http://a/1']),
+                         'http://localhost:8000/1/urls/count.json?url=http://a/1')
+        self.assertTrue(Facebook('http://localhost:8000').request_url(['http://a/1']).startswith(
+            'http://localhost:8000/fql?q=' + urllib.quote('select url, like_count')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+from bs4 import BeautifulSoup
+from marketingparser.metrics import METRICS
+from marketingparser.spec import Field, Selector, Spec
+
+PAGE = '''<html><body><div id="main" class="post box">
+<h2><a href="/1">First</a></h2><p class="lead">Intro
+text</p><div class="body"><p>Nested</p><h3>Part</h3><img src="x.jpg"></div>
+<p><a rel="nofollow bookmark" href="/2">Second</a></p><i>Jane</i><i>3 May 2014</i>
+</div><div class="post"><p>Other</p></div></body></html>'''
+
+
+class SelectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.soup = BeautifulSoup(PAGE, 'html.parser')
+        self.main = self.soup.find(id='main')
+
+    def test_compiled(self):
+        for selector in ('p', 'div.post', '.post.box', '#main p', '#main > p', 'div p.lead', 'a[rel~=bookmark]',
+                         'a[href="/1"]', 'p, h3', '*.body > *'):
+            compiled = Selector(selector)
+            self.assertIsNone(compiled.fallback, selector)
+            self.assertEqual(compiled.select(self.soup), self.soup.select(selector), selector)
+
+    def test_within_root(self):
+        self.assertEqual([p.text for p in Selector(':scope > p').select(self.main)], ['Intro\ntext', 'Second'])
+        # ancestors above the root do not match
+        self.assertEqual(Selector('#main p').select(self.main), [])
+        self.assertEqual(Selector('p').select(self.main, 2), self.main.find_all('p', limit=2))
+
+    def test_fallback(self):
+        selector = Selector('p:first-of-type')
+        self.assertIsNotNone(selector.fallback)
+        self.assertEqual(selector.select_one(self.main).text, 'Intro\ntext')
+
+
+class SpecTestCase(unittest.TestCase):
+
+    SPEC = Spec(
+        roots=(('post', '.post.box'), ('missing', '#missing')),
+        fields={
+            'title': Field('a', within='h2'),
+            'author': Field('i'),
+            'date': Field('i', index=1, date_format='%d %B %Y'),
+            'text': Field('p, h3', many=True, line_break=' '),
+            'media': Field('img, video', read='exists'),
+            'paragraphs': Field('p', read='count'),
+            'number': Field('.lead', pattern=r'(\w+)\s+(\w+)', group=2, process=lambda s: s.upper()),
+            'links': Field('a', root='soup', each='.post p', many=True, attr='href', separator=None),
+            'comments': Field('p', root='missing', many=True),
+            'site': Field(value='Example')
+        }
+    )
+
+    def test_extract(self):
+        soup = BeautifulSoup(PAGE, 'html.parser')
+        METRICS.reset()
+        values = SpecTestCase.SPEC.extract(SpecTestCase.SPEC.find_roots(soup))
+        self.assertEqual(values, {
+            'title': 'First',
+            'author': 'Jane',
+            'date': datetime.date(2014, 5, 3),
+            'text': 'Intro text Nested Part Second',
+            'media': '1',
+            'paragraphs': '3',
+            'number': 'TEXT',
+            'links': ['/2'],
+            'comments': '',
+            'site': 'Example'
+        })
+        self.assertEqual(METRICS.histograms[('extract_field_seconds', (('field', 'title'),))].count, 1)
+
+    def test_missing_post(self):
+        soup = BeautifulSoup('<p>Not found</p>', 'html.parser')
+        roots = SpecTestCase.SPEC.find_roots(soup)
+        self.assertIsNone(roots['post'])
+        values = SpecTestCase.SPEC.extract(roots)
+        self.assertEqual(values['title'], '')
+        self.assertEqual(values['media'], '0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import socket
+import unittest
+from marketingparser.httpclient import Response
+from marketingparser.throttle import ERROR, OK, REJECTED, THROTTLED, HostLimiter, Throttle, TokenBucket, \
+    parse_crawl_delay
+
+ROBOTS = '''# robots.txt
+User-agent: Googlebot
+Crawl-delay: 1
+
+User-agent: magic browser
+User-agent: Other
+Disallow: /private
+Crawl-delay: 5
+
+User-agent: *
+Crawl-delay: 2
+'''
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CrawlDelayTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_crawl_delay(ROBOTS), 5)
+        self.assertEqual(parse_crawl_delay(ROBOTS, 'Googlebot/2.1'), 1)
+        self.assertEqual(parse_crawl_delay(ROBOTS, 'curl'), 2)
+        self.assertIsNone(parse_crawl_delay('User-agent: *\nDisallow: /\nCrawl-delay: soon'))
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_reserve(self):
+        clock = Clock()
+        bucket = TokenBucket(2.0, 2, clock)
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0, 0, 0.5, 1.0])
+        clock.now += 2
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0.5])
+
+
+class HostLimiterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.sleeps = []
+        self.limiter = HostLimiter('a', rate=2, concurrency=2, max_concurrency=4, sleep=self.sleeps.append,
+                                   clock=self.clock)
+
+    def request(self, latency, outcome):
+        self.limiter.acquire()
+        self.limiter.release(latency, outcome)
+
+    def test_grow(self):
+        for _ in range(20):
+            self.request(0.1, OK)
+        self.assertEqual(self.limiter.concurrency, 4)
+        self.assertGreater(self.limiter.rate, 3)
+        rate = self.limiter.rate
+        self.request(5, OK)
+        self.request(0.1, REJECTED)
+        self.assertEqual(self.limiter.rate, rate)
+        self.request(0.1, ERROR)
+        self.assertEqual(self.limiter.rate, rate / 2)
+
+    def test_back_off(self):
+        for _ in range(20):
+            self.request(0.1, OK)
+        rate = self.limiter.rate
+        self.request(0.1, THROTTLED)
+        self.request(0.1, THROTTLED)
+        # requests failing together back off once
+        self.assertEqual(self.limiter.concurrency, 2)
+        self.assertEqual(self.limiter.rate, rate / 2)
+        self.clock.now += 2
+        self.request(0.1, THROTTLED)
+        self.request(0.1, THROTTLED)
+        self.clock.now += 2
+        self.request(0.1, THROTTLED)
+        self.assertEqual(self.limiter.concurrency, 1)
+
+    def test_crawl_delay(self):
+        self.limiter.set_crawl_delay(2)
+        for _ in range(20):
+            self.request(0.1, OK)
+        self.assertEqual(self.limiter.rate, 0.5)
+        self.assertEqual(self.sleeps[:3], [2.0, 4.0, 6.0])
+
+    def test_share(self):
+        # one of 4 processes crawling the host
+        limiter = HostLimiter('a', rate=2, max_rate=8, concurrency=2, max_concurrency=8, sleep=self.sleeps.append,
+                              clock=self.clock, share=0.25)
+        self.assertEqual((limiter.rate, limiter.max_rate, limiter.concurrency, limiter.max_concurrency),
+                         (0.5, 2, 1, 2))
+        limiter.set_crawl_delay(10)
+        self.assertEqual(limiter.rate, 0.025)
+
+
+class ThrottleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.throttle = Throttle(rate=100, sleep=lambda delay: None)
+
+    def send(self, url, headers=None):
+        self.sent.append(url)
+        if url.endswith('/robots.txt'):
+            return Response(url, 200, 'OK', {}, 'User-agent: *\nCrawl-delay: 0.5\n')
+        if url.endswith('/busy'):
+            return Response(url, 429, 'Too Many Requests', {}, '')
+        if url.endswith('/slow'):
+            raise socket.timeout('timed out')
+        if url.endswith('/broken'):
+            return Response(url, 502, 'Bad Gateway', {}, '')
+        if url.endswith('/down'):
+            raise socket.error('refused')
+        if url.endswith('/missing'):
+            return Response(url, 404, 'Not Found', {}, '')
+        return Response(url, 200, 'OK', {}, 'hello')
+
+    def test_robots_once(self):
+        for path in ('/1', '/2'):
+            self.assertEqual(self.throttle.call(self.send, 'http://a' + path).body, 'hello')
+        self.assertEqual(self.sent, ['http://a/robots.txt', 'http://a/1', 'http://a/2'])
+        self.assertEqual(self.throttle.report()['a'], {'concurrency': 2, 'rate': 2.0, 'crawl_delay': 0.5})
+
+    def test_share(self):
+        self.throttle.share = 0.5
+        self.throttle.call(self.send, 'http://a/1')
+        limiter = self.throttle.limiters['http://a']
+        self.assertEqual((limiter.max_rate, limiter.max_concurrency), (1.0, 4))
+
+    def test_missing_robots(self):
+        def send(url, headers=None):
+            if url.endswith('/robots.txt'):
+                raise socket.error('refused')
+            return Response(url, 200, 'OK', {}, 'hello')
+        self.throttle.call(send, 'http://b/1')
+        self.assertIsNone(self.throttle.limiters['http://b'].crawl_delay)
+
+    def test_back_off(self):
+        self.throttle.robots = False
+        self.assertEqual(self.throttle.call(self.send, 'http://a/busy').status, 429)
+        self.assertRaises(socket.timeout, self.throttle.call, self.send, 'http://c/slow')
+        self.assertEqual(self.throttle.limiters['http://a'].concurrency, 1)
+        self.assertEqual(self.throttle.limiters['http://c'].concurrency, 1)
+        self.assertEqual(self.throttle.limiters['http://a'].active, 0)
+
+    def test_errors(self):
+        self.throttle.robots = False
+        self.assertEqual(self.throttle.call(self.send, 'http://a/broken').status, 502)
+        self.assertRaises(socket.error, self.throttle.call, self.send, 'http://b/down')
+        for _ in range(20):
+            self.throttle.call(self.send, 'http://c/missing')
+        self.assertEqual(self.throttle.limiters['http://a'].concurrency, 1)
+        self.assertEqual(self.throttle.limiters['http://b'].concurrency, 1)
+        # client errors neither grow nor cut the limits
+        self.assertEqual((self.throttle.limiters['http://c'].concurrency, self.throttle.limiters['http://c'].rate),
+                         (2, 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
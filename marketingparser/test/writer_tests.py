@@ -0,0 +1,250 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+import zlib
+from marketingparser.website import PostInfo, DigitalBuzz
+from marketingparser.writer import HEADER, CSVWriter, JSONWriter, MemoryWriter, SQLiteWriter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def post(i):
+    info = PostInfo()
+    info.url = 'http://www.digitalbuzzblog.com/%d/' % i
+    info.date = datetime.date(2014, 5, i + 1)
+    info.title = u'Post №%d' % i
+    info.text = u'Text'
+    return info
+
+
+class WriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.website = DigitalBuzz()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def lines(self, writer):
+        with open(writer.path, 'rb') as f:
+            return f.read().decode('utf-8').splitlines()
+
+
+class CSVWriterTestCase(WriterTestCase):
+
+    def test_rows(self):
+        writer = CSVWriter(self.website)
+        writer.write_header()
+        writer.save(post(0))
+        writer.close()
+        lines = self.lines(writer)
+        self.assertEqual(lines[0].split('|')[-1], 'URL')
+        self.assertEqual(lines[1].split('|'), [u'2014-05-01', u'Post №0', u'', u'', u'', u'', u'', u'', u'',
+                                              u'Text', u'', u'http://www.digitalbuzzblog.com/0/'])
+
+    def test_flush_rows(self):
+        writer = CSVWriter(self.website, flush_rows=2)
+        writer.write_header()
+        handle = writer.file
+        writer.save(post(0))
+        self.assertEqual(len(self.lines(writer)), 0)
+        writer.save(post(1))
+        self.assertEqual(len(self.lines(writer)), 3)
+        writer.save(post(2))
+        self.assertTrue(writer.file is handle)
+        writer.close()
+        self.assertEqual(len(self.lines(writer)), 4)
+        self.assertTrue(handle.closed)
+
+    def test_flush_bytes_and_interval(self):
+        writer = CSVWriter(self.website, flush_bytes=1)
+        writer.save(post(0))
+        self.assertEqual(len(self.lines(writer)), 1)
+        writer = CSVWriter(self.website, flush_interval=0)
+        writer.save(post(1))
+        self.assertEqual(len(self.lines(writer)), 2)
+        writer.close()
+
+    def test_flush_timer(self):
+        writer = CSVWriter(self.website, flush_interval=0.05)
+        writer.save(post(0))
+        self.assertEqual(len(self.lines(writer)), 0)
+        # flushed while no other post comes
+        time.sleep(0.3)
+        self.assertEqual(len(self.lines(writer)), 1)
+        self.assertEqual(writer.page, [])
+        writer.close()
+        self.assertFalse(writer.timer)
+
+    def test_append(self):
+        writer = CSVWriter(self.website)
+        writer.write_header()
+        writer.save(post(0))
+        writer.close()
+        writer = CSVWriter(self.website)
+        self.assertTrue(writer.exists())
+        writer.save(post(1))
+        writer.close()
+        self.assertEqual(len(self.lines(writer)), 3)
+
+    def test_saved_posts(self):
+        writer = CSVWriter(self.website)
+        writer.write_header()
+        writer.save(post(0))
+        # a post that failed to load, saved without a url before
+        writer.open().write(writer.format(PostInfo()))
+        multiline = post(1)
+        multiline.text = u'Text | with a separator'
+        multiline.comments = u'First line\nhttp://link.to/comment\nlast line'
+        writer.save(multiline)
+        writer.save(post(2))
+        writer.close()
+        saved = list(writer.saved_posts())
+        self.assertEqual([p.url for p in saved], ['http://www.digitalbuzzblog.com/%d/' % i for i in range(3)])
+        self.assertEqual([p.date for p in saved], [datetime.date(2014, 5, i + 1) for i in range(3)])
+        self.assertEqual(saved[1].title, u'Post №1')
+
+    def test_older_format(self):
+        writer = CSVWriter(self.website)
+        with open(writer.path, 'wb') as f:
+            f.write('|'.join(HEADER[:-1]) + '\n' + '2014-05-01|Post|||||||||\n')
+        self.assertRaises(ValueError, list, writer.saved_posts())
+
+
+class JSONWriterTestCase(WriterTestCase):
+
+    def test_plain(self):
+        writer = JSONWriter(self.website)
+        writer.write_header()
+        writer.save(post(0))
+        writer.close()
+        self.assertEqual(writer.path, os.path.join('data', 'digitalbuzzblog.jsonl'))
+        record = json.loads(self.lines(writer)[0])
+        self.assertEqual(record['title'], u'Post №0')
+        self.assertEqual(record['date'], '2014-05-01')
+        self.assertEqual(record['url'], 'http://www.digitalbuzzblog.com/0/')
+
+    def test_gzip(self):
+        writer = JSONWriter(self.website, 'gzip', flush_rows=1)
+        writer.write_header()
+        writer.save(post(0))
+        writer.save(post(1))
+        # flushed records can be streamed before the writer is closed
+        with open(writer.path, 'rb') as f:
+            data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(f.read())
+        self.assertEqual(len(data.splitlines()), 2)
+        writer.close()
+        writer = JSONWriter(self.website, 'gzip')
+        writer.save(post(2))
+        writer.close()
+        with gzip.open(writer.path) as f:
+            titles = [json.loads(l)['title'] for l in f.read().splitlines()]
+        self.assertEqual(titles, [u'Post №0', u'Post №1', u'Post №2'])
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_zstd(self):
+        for i in range(2):
+            writer = JSONWriter(self.website, 'zstd')
+            writer.save(post(i))
+            writer.close()
+        with open(writer.path, 'rb') as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            lines = reader.read(1024 * 1024).splitlines()
+        self.assertEqual([json.loads(l)['title'] for l in lines], [u'Post №0', u'Post №1'])
+
+
+class SQLiteWriterTestCase(WriterTestCase):
+
+    def test_upsert(self):
+        writer = SQLiteWriter(self.website, flush_rows=2)
+        writer.write_header()
+        for i in range(3):
+            writer.save(post(i))
+        writer.close()
+        updated = post(1)
+        updated.rating = '3.63'
+        updated.media = '1'
+        updated.comment_count = '5'
+        writer = SQLiteWriter(self.website)
+        writer.save(updated)
+        writer.close()
+
+        db = sqlite3.connect(writer.path, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        rows = db.execute('SELECT url, date, title, rating, media, comment_count, tweet_count FROM posts '
+                          'ORDER BY date').fetchall()
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1], ('http://www.digitalbuzzblog.com/1/', datetime.date(2014, 5, 2), u'Post №1',
+                                   3.63, 1, 5, None))
+        db.close()
+
+    def test_flush_bytes_and_interval(self):
+        def count(writer):
+            db = sqlite3.connect(writer.path)
+            try:
+                return db.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+            finally:
+                db.close()
+        writer = SQLiteWriter(self.website, flush_bytes=1)
+        writer.save(post(0))
+        self.assertEqual(count(writer), 1)
+        writer.close()
+        writer = SQLiteWriter(self.website, flush_interval=0.05)
+        writer.save(post(1))
+        self.assertEqual(count(writer), 1)
+        # inserted by the flush timer while no other post comes
+        time.sleep(0.3)
+        self.assertEqual(count(writer), 2)
+        writer.close()
+
+
+class NewestDateTestCase(WriterTestCase):
+
+    def test_formats(self):
+        writers = [lambda: CSVWriter(self.website), lambda: JSONWriter(self.website),
+                   lambda: JSONWriter(self.website, 'gzip'), lambda: SQLiteWriter(self.website),
+                   lambda: MemoryWriter(self.website)]
+        if zstandard:
+            writers.append(lambda: JSONWriter(self.website, 'zstd'))
+        undated = post(3)
+        undated.date = None
+        for create in writers:
+            writer = create()
+            self.assertIsNone(writer.newest_date())
+            writer.write_header()
+            writer.save(post(2))
+            writer.save(post(0))
+            writer.save(undated)
+            writer.close()
+            self.assertEqual(writer.newest_date(), datetime.date(2014, 5, 3), writer.filename)
+
+    def test_failed_post(self):
+        writer = CSVWriter(self.website)
+        writer.write_header()
+        writer.save(post(0))
+        # the row of a post that failed to load does not take the next one with it
+        writer.open().write(writer.format(PostInfo()))
+        writer.save(post(4))
+        writer.save(post(2))
+        writer.close()
+        self.assertEqual(writer.newest_date(), datetime.date(2014, 5, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
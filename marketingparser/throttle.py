@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import socket
+import threading
+import time
+import urlparse
+from timeit import default_timer as timer
+from marketingparser.httpclient import USER_AGENT
+from marketingparser.metrics import METRICS
+
+INITIAL_RATE = 2.0
+MAX_RATE = 20.0
+MIN_RATE = 0.2
+# requests per second added for every second's worth of healthy responses
+RATE_STEP = 0.5
+INITIAL_CONCURRENCY = 2
+MAX_CONCURRENCY = 8
+BACKOFF = 0.5
+# responses slower than this do not grow the limits
+LATENCY_TARGET = 2.0
+# several requests in flight fail together, back off once for all of them
+BACKOFF_INTERVAL = 1.0
+THROTTLE_STATUS = (429, 503)
+
+# a client error is no sign of the host's health, it neither grows nor cuts the limits
+OK, REJECTED, ERROR, THROTTLED = 'ok', 'rejected', 'error', 'throttled'
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_crawl_delay(robots, agent=USER_AGENT):
+    """
+    Return the Crawl-delay of a robots.txt for specified user agent, falling back to '*', or None.
+    """
+    delays = {}
+    agents = []
+    rules = False
+    for line in robots.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+        field, value = [part.strip() for part in line.split(':', 1)]
+        field = field.lower()
+        if field == 'user-agent':
+            # consecutive User-agent lines share the rules that follow them
+            if rules:
+                agents = []
+                rules = False
+            agents.append(value.lower())
+            continue
+        rules = True
+        if field == 'crawl-delay':
+            try:
+                delay = float(value)
+            except ValueError:
+                continue
+            for name in agents:
+                delays[name] = delay
+    agent = agent.lower()
+    for name, delay in delays.items():
+        if name != '*' and name in agent:
+            return delay
+    return delays.get('*')
+
+
+class TokenBucket:
+    """
+    Spaces requests out to `rate` per second on average, allowing bursts of `burst` requests.
+    """
+
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        Take a token, returning the seconds to wait before it is due.
+        """
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            # tokens go negative while requests queue up, each one waiting for its turn
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.refill()
+            self.rate = rate
+            if burst is not None:
+                self.burst = burst
+                self.tokens = min(self.tokens, burst)
+
+
+class HostLimiter:
+    """
+    Rate and concurrency limits of requests to a host, adjusted to the responses it gives.
+
+    Both limits grow additively while responses come back fast and healthy, and are cut by
+    `backoff` when the host throttles us (429 or 503 status, timeouts) or fails (other 5xx status,
+    connection errors): AIMD, as in TCP congestion control. A robots.txt Crawl-delay caps the rate.
+
+    A process crawling alongside others gets their `share` of every limit, the Crawl-delay's
+    included, down to one request at a time.
+    """
+
+    def __init__(self, host, rate=INITIAL_RATE, max_rate=MAX_RATE, concurrency=INITIAL_CONCURRENCY,
+                 max_concurrency=MAX_CONCURRENCY, backoff=BACKOFF, latency_target=LATENCY_TARGET,
+                 sleep=time.sleep, clock=time.time, share=1.0):
+        self.host = host
+        self.share = share
+        rate *= share
+        self.max_rate = max_rate * share
+        self.max_concurrency = max(1, int(max_concurrency * share))
+        self.concurrency = float(max(1, min(int(concurrency * share), self.max_concurrency)))
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.sleep = sleep
+        self.clock = clock
+        self.bucket = TokenBucket(min(rate, self.max_rate), max(1, int(rate)), clock)
+        self.crawl_delay = None
+        self.active = 0
+        self.backed_off = 0
+        self.condition = threading.Condition()
+        self.ready = threading.Event()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def set_crawl_delay(self, delay):
+        if not delay or delay <= 0:
+            return
+        with self.condition:
+            self.crawl_delay = delay
+            self.max_rate = min(self.max_rate, self.share / delay)
+            self.bucket.set_rate(min(self.rate, self.max_rate), 1)
+        logger.info('%s asks for %gs between requests' % (self.host, delay))
+
+    def acquire(self):
+        """
+        Wait for a free request slot and the rate limit, returning the seconds waited.
+        """
+        start = timer()
+        with self.condition:
+            while self.active >= int(self.concurrency):
+                self.condition.wait()
+            self.active += 1
+            delay = self.bucket.reserve()
+        if delay:
+            self.sleep(delay)
+        return timer() - start
+
+    def release(self, latency, outcome):
+        with self.condition:
+            self.active -= 1
+            if outcome in (THROTTLED, ERROR):
+                self.back_off()
+            elif outcome == OK and latency < self.latency_target:
+                self.grow()
+            self.condition.notify_all()
+
+    def grow(self):
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+        self.bucket.set_rate(min(self.max_rate, self.rate + RATE_STEP / self.rate))
+
+    def back_off(self):
+        now = self.clock()
+        if now - self.backed_off < BACKOFF_INTERVAL:
+            return
+        self.backed_off = now
+        self.concurrency = max(1.0, self.concurrency * self.backoff)
+        self.bucket.set_rate(max(MIN_RATE * self.share, self.rate * self.backoff))
+        METRICS.inc('throttled_total', host=self.host)
+        logger.warning('Slowing down on %s: %d concurrent requests, %.1f requests/sec' %
+                       (self.host, self.concurrency, self.rate))
+
+
+def classify(status):
+    """
+    Return the outcome of a response with specified status, for the limiter of its host.
+    """
+    if status in THROTTLE_STATUS:
+        return THROTTLED
+    if status >= 500:
+        return ERROR
+    if status >= 400:
+        return REJECTED
+    return OK
+
+
+class Throttle:
+    """
+    Per-host limiters of the requests sent by an HTTP client.
+
+    Every host's robots.txt is fetched once, before the first request to it, for its Crawl-delay.
+    The limits of processes crawling together are divided among them by setting their `share`.
+    """
+
+    def __init__(self, rate=INITIAL_RATE, max_rate=MAX_RATE, max_concurrency=MAX_CONCURRENCY, robots=True,
+                 sleep=time.sleep, share=1.0):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.share = share
+        self.robots = robots
+        self.sleep = sleep
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def crawl_delay(self, send, url):
+        try:
+            response = send(url)
+        except StandardError as ex:
+            logger.warning('Failed to load %s: %s' % (url, ex))
+            return None
+        return parse_crawl_delay(response.body) if response.status == 200 else None
+
+    def limiter(self, send, url):
+        """
+        Return the limiter of the url's host, creating it on the first request.
+        """
+        parts = urlparse.urlsplit(url)
+        origin = '%s://%s' % (parts.scheme, parts.netloc)
+        with self.lock:
+            limiter = self.limiters.get(origin)
+            created = limiter is None
+            if created:
+                limiter = self.limiters[origin] = HostLimiter(
+                    parts.hostname, self.rate, self.max_rate, max_concurrency=self.max_concurrency, sleep=self.sleep,
+                    share=self.share)
+        if created:
+            # outside the lock, so that other hosts do not wait for this one's robots.txt
+            try:
+                if self.robots:
+                    limiter.set_crawl_delay(self.crawl_delay(send, origin + '/robots.txt'))
+            finally:
+                limiter.ready.set()
+        limiter.ready.wait()
+        return limiter
+
+    def call(self, send, url, headers=None):
+        """
+        Send a request with `send(url, headers)` within the limits of its host, and adjust them to the response.
+        """
+        limiter = self.limiter(send, url)
+        METRICS.observe('throttle_wait_seconds', limiter.acquire(), host=limiter.host)
+        start = timer()
+        outcome = ERROR
+        try:
+            response = send(url, headers)
+            outcome = classify(response.status)
+            return response
+        except socket.timeout:
+            outcome = THROTTLED
+            raise
+        finally:
+            limiter.release(timer() - start, outcome)
+
+    def report(self):
+        """
+        Log and return the limits reached by host.
+        """
+        with self.lock:
+            limiters = sorted(self.limiters.values(), key=lambda l: l.host)
+        limits = {}
+        for limiter in limiters:
+            limits[limiter.host] = {'concurrency': int(limiter.concurrency), 'rate': limiter.rate,
+                                    'crawl_delay': limiter.crawl_delay}
+            logger.info('%s: %d concurrent requests, %.1f requests/sec%s' %
+                        (limiter.host, limiter.concurrency, limiter.rate,
+                         ', crawl delay %gs' % limiter.crawl_delay if limiter.crawl_delay else ''))
+        return limits
@@ -1,52 +1,164 @@
 # -*- coding: utf-8 -*-
 
-import datetime
-import json
+import itertools
 import logging
 import re
-import urllib2
-from bs4 import BeautifulSoup
+import StringIO
+import urlparse
+from bs4 import BeautifulSoup, SoupStrainer
+from marketingparser.httpclient import HTTPClient
+from marketingparser.metrics import METRICS
+from marketingparser.retry import RetryPolicy
+from marketingparser.sitemap import SitemapIndex
+from marketingparser.social import Facebook, Twitter
+from marketingparser.spec import Field, Selector, Spec
+from marketingparser.throttle import Throttle
+
+try:
+    import lxml
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
 
 DIGITS_ONLY = re.compile(r'\d+')
-LINE_BREAK = re.compile(r'[\r\n]+')
+CHARSET = re.compile(r'charset=["\']?([\w.:-]+)', re.I)
 TIMEOUT = 10
 RETRY_COUNT = 10
-
-TWEET_COUNT = 'http://urls.api.twitter.com/1/urls/count.json?url=%s'
-FB_COUNT = 'https://graph.facebook.com/fql?q=select%%20like_count%%20from%%20link_stat%%20where%%20url=%%22%s%%22'
+# listing pages change as posts are published, so cached copies are always revalidated
+LISTING_TTL = 0
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# per-host rate and concurrency limits, adapting to how fast each host answers
+THROTTLE = Throttle()
+# shared by all websites, so that fetches reuse warm keep-alive connections
+CLIENT = HTTPClient(timeout=TIMEOUT, throttle=THROTTLE)
+# optional ResponseCache, see marketingparser.cache
+CACHE = None
+# optional Archive that fetched responses are recorded to, or replayed from, see marketingparser.archive
+ARCHIVE = None
+RETRY = RetryPolicy(max_tries=RETRY_COUNT)
+
 
-def urlopen(url):
+def fetch(url, ttl=None):
     """
-    Load specified url resource, retrying on error.
+    Load specified url resource once, through the response cache and the archive if enabled.
     """
-    tries = 0
-    response = None
-    while not response and tries < RETRY_COUNT:
-        try:
-            if tries > 0:
-                logger.warning('Retry #%d for "%s"' % (tries, url))
-            req = urllib2.Request(url, headers={'User-Agent' : "Magic Browser"})
-            con = urllib2.urlopen(req, timeout=TIMEOUT)
-            response = con.read()
-        except StandardError:
-            pass
-        finally:
-            tries += 1
-    if not response:
-        raise IOError('Failed to open url: %s' % url)
+    host = urlparse.urlsplit(url).hostname
+    try:
+        with METRICS.timer('fetch_seconds', host=host):
+            if ARCHIVE is not None and ARCHIVE.replay:
+                response = ARCHIVE.get(url)
+            else:
+                response = CACHE.fetch(CLIENT, url, ttl) if CACHE else CLIENT.get(url)
+                if ARCHIVE is not None:
+                    ARCHIVE.put(url, response)
+    except StandardError as ex:
+        METRICS.inc('fetch_errors_total', host=host, error=ex.__class__.__name__)
+        raise
+    METRICS.inc('fetched_bytes_total', len(response.body), host=host)
     return response
 
 
-class PostInfo:
+def load_response(url, ttl=None):
+    """
+    Load specified url resource, retrying on transient errors.
+
+    `ttl` overrides the cache's time to live for this url.
+    """
+    def attempt():
+        response = fetch(url, ttl)
+        if not response.body:
+            raise IOError('Empty response: %s' % url)
+        return response
+    return RETRY.call(url, attempt)
+
+
+def urlopen(url, ttl=None):
+    """
+    Load specified url resource body, retrying on error.
+    """
+    return load_response(url, ttl).body
+
+
+def open_url(url, ttl=None):
+    """
+    Open specified url resource to read its body as it arrives, retrying on errors before it does.
+
+    Bodies from the response cache or the archive, which keep them whole, are read from memory.
+    """
+    if CACHE is not None or ARCHIVE is not None:
+        return StringIO.StringIO(urlopen(url, ttl))
+    host = urlparse.urlsplit(url).hostname
+
+    def attempt():
+        try:
+            with METRICS.timer('fetch_seconds', host=host):
+                return CLIENT.open(url).body
+        except StandardError as ex:
+            METRICS.inc('fetch_errors_total', host=host, error=ex.__class__.__name__)
+            raise
+    return RETRY.call(url, attempt)
+
+
+def get_charset(response):
+    """
+    Return the charset declared in the response's Content-Type header, if any.
+    """
+    match = CHARSET.search(response.getheader('content-type') or '')
+    return match.group(1) if match else None
+
+
+def make_soup(html, parse_only=None, charset=None):
+    """
+    Parse a document, keeping only `parse_only` elements if given.
+
+    A known charset (i.e. declared over HTTP) skips encoding detection.
+    """
+    return BeautifulSoup(html, PARSER, parse_only=parse_only, from_encoding=charset)
+
+
+def load_soup(url, parse_only=None, ttl=None):
+    """
+    Load and parse specified url, keeping only `parse_only` elements if given.
+    """
+    response = load_response(url, ttl)
+    return make_soup(response.body, parse_only, get_charset(response))
+
+
+def extract_post(website_class, html, url, charset=None):
+    """
+    Extract post info from a post page; module-level, so that process pools can call it.
+    """
+    return website_class().extract(html, url, charset)
+
+
+def containers(ids=(), classes=()):
+    """
+    Build a SoupStrainer keeping elements with any of specified ids or classes, with all their content.
+
+    Classes match like find(class_=...): either a single class or the whole class attribute.
+    """
+    def match(name, attrs):
+        if attrs.get('id') in ids:
+            return True
+        value = attrs.get('class') or ''
+        names = value.split() if isinstance(value, basestring) else value
+        return ' '.join(names) in classes or any(n in classes for n in names)
+    return SoupStrainer(match)
+
+
+class PostInfo(object):
     """
     Information about a blog post.
     """
 
+    __slots__ = ('url', 'date', 'title', 'author', 'rating', 'category', 'media', 'comment_count',
+                 'tweet_count', 'fb_count', 'text', 'comments')
+
     def __init__(self):
+        self.url = ''
         self.date = None
         self.title = ''
         self.author = ''
@@ -75,9 +187,26 @@ class Website:
     Parsing methods for specific website.
     """
 
+    # elements of a post page used by the parsing methods, the rest of the page is not parsed
+    POST_CONTAINERS = None
+    # elements of a post page holding its comment count, parsed instead of POST_CONTAINERS to refresh counts
+    COUNT_CONTAINERS = None
+    # declarative description of the site's post and listing pages, see marketingparser.spec
+    SPEC = None
+    # whether the listing starts with the newest posts, so that new posts come first
+    NEWEST_FIRST = True
+    # attributes holding parts of the loaded post page
+    DOM_ATTRIBUTES = ('soup', 'roots', 'extracted')
+    # PostInfo fields extracted from the post page, with their getters, in extraction order
+    FIELD_GETTERS = (('title', 'get_title'), ('date', 'get_date'), ('author', 'get_author'),
+                     ('rating', 'get_rating'), ('category', 'get_category'), ('media', 'has_media'),
+                     ('text', 'get_text'), ('comment_count', 'get_comment_count'), ('comments', 'get_comments'))
+
     def __init__(self):
         self.url = ''
         self.post_url = ''
+        # date before which listings may leave posts out, set for crawls since a date
+        self.since = None
 
     def get_page_url(self, page_num):
         """
@@ -89,557 +218,405 @@ class Website:
         """
         Load a list of post urls on a page, starting from specified post index.
         """
-        return []
+        if self.SPEC is None or self.SPEC.links is None:
+            return []
+        page_num = post_from / self.posts_per_page
+        from_index = post_from % self.posts_per_page
+        soup = load_soup(self.get_page_url(page_num), ttl=LISTING_TTL)
+        return self.SPEC.find_links(soup)[from_index:]
 
     def load_post(self, url):
         """
         Load and parse a post, returning True on success, False otherwise.
         """
-        return False
+        response = load_response(url)
+        return self.parse_post(response.body, url, get_charset(response))
+
+    def parse_post(self, html, url, charset=None):
+        """
+        Parse a post page, returning True if it has a post, False otherwise.
+        """
+        if self.SPEC is None:
+            return False
+        self.post_url = url
+        self.soup = make_soup(html, self.POST_CONTAINERS, charset)
+        self.roots = self.SPEC.find_roots(self.soup)
+        self.extracted = None
+        return self.roots.get('post') is not None
+
+    def extract(self, html, url, charset=None):
+        """
+        Extract post info from a post page, or return None if it has no post.
+
+        Parsing happens on a new instance, so this can be called from several threads at once.
+        """
+        website = self.__class__()
+        if not website.parse_post(html, url, charset):
+            website.release()
+            return None
+        return website.get_post_info()
+
+    def field(self, name, default=''):
+        """
+        Return a field of the loaded post, all fields being extracted on first use.
+        """
+        if self.SPEC is None:
+            return default
+        if getattr(self, 'extracted', None) is None:
+            self.extracted = self.SPEC.extract(self.roots)
+        return self.extracted.get(name, default)
 
     def get_title(self):
-        return ''
+        return self.field('title')
 
     def get_date(self):
-        return None
+        return self.field('date', None)
 
     def get_author(self):
-        return ''
+        return self.field('author')
 
     def get_rating(self):
-        return ''
+        return self.field('rating')
 
     def get_category(self):
-        return ''
+        return self.field('category')
 
     def has_media(self):
-        return ''
+        return self.field('media')
 
     def get_comment_count(self):
-        return '0'
+        return self.field('comment_count', '0')
 
-    def get_tweet_count(self):
+    def has_comment_count(self):
+        return self.SPEC is not None and 'comment_count' in self.SPEC.fields
+
+    def parse_counts(self, html, charset=None):
+        """
+        Return the comment count on a post page, extracting nothing else.
+        """
+        if not self.has_comment_count():
+            return '0'
+        soup = make_soup(html, self.COUNT_CONTAINERS or self.POST_CONTAINERS, charset)
         try:
-            tweets = json.loads(urlopen(TWEET_COUNT % self.post_url))
-            return str(tweets['count'])
-        except StandardError:
-            return ''
+            return self.SPEC.extract(self.SPEC.find_roots(soup), ('comment_count',))['comment_count']
+        finally:
+            soup.decompose()
+
+    def load_counts(self, url):
+        """
+        Load a post's comment count, returning a PostInfo with its url and comment count only.
+
+        Post pages of websites without comment counts are not loaded. Safe to call from several threads.
+        """
+        info = PostInfo()
+        info.url = url
+        if not self.has_comment_count():
+            info.comment_count = '0'
+            return info
+        # counts change, so cached pages are revalidated
+        response = load_response(url, 0)
+        info.comment_count = self.parse_counts(response.body, get_charset(response))
+        return info
+
+    def get_tweet_count(self):
+        counts = Twitter().lookup([self.post_url], lambda url: urlopen(url, 0))
+        return counts.get(self.post_url, '')
 
     def get_fb_count(self):
-        try:
-            likes = json.loads(urlopen(FB_COUNT % self.post_url))
-            return str(likes['data'][0]['like_count'])
-        except StandardError:
-            return ''
+        counts = Facebook().lookup([self.post_url], lambda url: urlopen(url, 0))
+        return counts.get(self.post_url, '')
 
     def get_text(self):
-        return ''
+        return self.field('text')
 
     def get_comments(self):
-        return ''
+        return self.field('comments')
 
     def get_post_info(self):
+        """
+        Extract post fields; tweet and Facebook like counts are filled in by social.SocialCounter.
+        """
         info = PostInfo()
-        info.title = self.get_title()
-        logger.info(u'Processing "%s"...' % info.title)
-        info.date = self.get_date()
-        info.author = self.get_author()
-        info.rating = self.get_rating()
-        info.category = self.get_category()
-        info.media = self.has_media()
-        info.text = self.get_text()
-        info.comment_count = self.get_comment_count()
-        info.tweet_count = self.get_tweet_count()
-        info.fb_count = self.get_fb_count()
-        info.comments = self.get_comments()
+        try:
+            info.url = self.post_url
+            for field, getter in Website.FIELD_GETTERS:
+                setattr(info, field, getattr(self, getter)())
+                if field == 'title':
+                    logger.info(u'Processing "%s"...' % info.title)
+        finally:
+            self.release()
         return info
 
+    def release(self):
+        """
+        Drop the loaded post page, so that its tree is freed as soon as fields are extracted.
+        """
+        soup = getattr(self, 'soup', None)
+        for name in Website.DOM_ATTRIBUTES:
+            if hasattr(self, name):
+                setattr(self, name, None)
+        if soup is not None:
+            # break the tree's parent/child reference cycles, so it does not wait for the garbage collector
+            soup.decompose()
+
 
 class DigitalBuzz(Website):
 
-    RATING = re.compile(r'average: ([\d.]+)')
+    POST_CONTAINERS = containers(ids=('social-tabs-comments',), classes=('post box',))
+    COUNT_CONTAINERS = containers(ids=('social-tabs-comments',))
+    SPEC = Spec(
+        roots=(('post', '.post.box'), ('comments', '#social-tabs-comments')),
+        fields={
+            'title': Field('a', within='h2'),
+            'date': Field('td', within='.date-comments', date_format='%a, %b %d, %Y', default=None),
+            'author': Field('h3', within='.author_info', process=lambda s: s.replace('Posted by:', '').strip()),
+            'rating': Field('.post-ratings', within='.date-comments', pattern=r'average: ([\d.]+)', group=1),
+            'media': Field('img, video', read='exists'),
+            'comment_count': Field('span', root='comments', within='.social-wordpress', pattern=DIGITS_ONLY,
+                                   default='0'),
+            'text': Field('p', within='.entry', many=True, line_break=''),
+            'comments': Field('.social-comment-body', root='comments', each='li.wordpress', many=True,
+                              line_break='')
+        },
+        links=Field('a[rel~=bookmark]', root='soup', within='#centercol', many=True, attr='href', separator=None)
+    )
 
     def __init__(self):
         self.url = 'http://www.digitalbuzzblog.com'
         self.filename = 'digitalbuzzblog.csv'
         self.posts_per_page = 15
         self.soup = None
-        self.post = None
-        self.comments = None
-
-    def parse_date(self, str_date):
-        return datetime.datetime.strptime(str_date, '%a, %b %d, %Y').date()
 
     def get_page_url(self, page_num):
         return self.url if page_num == 0 else \
             '%s/page/%d' % (self.url, page_num + 1)
 
-    def load_page(self, post_from):
-        page_num = post_from / self.posts_per_page
-        from_index = post_from % self.posts_per_page
-        url = self.get_page_url(page_num)
-        soup = BeautifulSoup(urlopen(url))
-        links = soup.find(id='centercol').find_all('a', rel='bookmark')
-        return [l['href'] for l in links][from_index:]
-
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(class_='post box')
-        self.comments = self.soup.find(id='social-tabs-comments')
-        return True if self.post else False
-
-    def get_title(self):
-        return self.post.h2.a.text.strip()
-
-    def get_date(self):
-        return self.parse_date(
-            self.post.find(class_='date-comments').td.text.strip()
-        )
-
-    def get_author(self):
-        return self.post.find(class_='author_info').h3.text.replace('Posted by:', '').strip()
-
-    def get_rating(self):
-        rating_match = DigitalBuzz.RATING.search(
-            self.post.find(class_='date-comments').find(class_='post-ratings').text)
-        return rating_match.group(1) if rating_match else ''
-
-    def has_media(self):
-        media = self.post.find('img')
-        if not media:
-            media = self.post.find('video')
-        return '1' if media else '0'
-
-    def get_comment_count(self):
-        count = self.comments.find(class_='social-wordpress')
-        return DIGITS_ONLY.search(count.span.text).group(0).strip() if count else '0'
-
-    def get_text(self):
-        containers = self.post.find(class_='entry').find_all('p')
-        paragraphs = [c.text.strip() or '' for c in containers]
-        return ' '.join([LINE_BREAK.sub('', p) for p in paragraphs]).strip()
-
-    def get_comments(self):
-        containers = self.comments.find_all(name='li', class_='wordpress')
-        comments = [c.find(class_='social-comment-body').text.strip() for c in containers]
-        return ' '.join([LINE_BREAK.sub('', c) for c in comments]).strip()
-
 
 class CreativeGuerrilla(Website):
 
+    POST_CONTAINERS = containers(ids=('post-content', 'disqus_thread'),
+                                 classes=('page-title', 'meta-date', 'meta-author', 'meta-cats'))
+    COUNT_CONTAINERS = containers(ids=('disqus_thread',))
+    SPEC = Spec(
+        roots=(('post', '#post-content'), ('comments', '#disqus_thread')),
+        fields={
+            'title': Field('.page-title', root='soup'),
+            'date': Field('.meta-date', root='soup', date_format='%B %d, %Y', default=None),
+            'author': Field('.meta-author', root='soup'),
+            'category': Field('a', root='soup', within='.meta-cats'),
+            'media': Field('img, video', read='exists'),
+            'comment_count': Field('.comment-count', root='comments', pattern=DIGITS_ONLY, default='0'),
+            'text': Field('p', many=True, line_break='', process=lambda s: s.replace('|', '')),
+            'comments': Field('.post-message', root='comments', many=True, strip=False, line_break='',
+                              process=lambda s: s.replace('|', ''))
+        },
+        links=Field('a', root='soup', each='.post-thumbnail', many=True, attr='href', separator=None)
+    )
+
     def __init__(self):
         self.url = 'http://www.creativeguerrillamarketing.com/'
         self.filename = 'creativeguerrillamarketing.csv'
         self.posts_per_page = 10
         self.soup = None
-        self.post = None
-        self.comments = None
-
-    def parse_date(self, str_date):
-        return datetime.datetime.strptime(str_date, '%B %d, %Y').date()
 
     def get_page_url(self, page_num):
         return self.url if page_num == 0 else \
             '%s/page/%d' % (self.url, page_num + 1)
 
-    def load_page(self, post_from):
-        page_num = post_from / self.posts_per_page
-        from_index = post_from % self.posts_per_page
-        url = self.get_page_url(page_num)
-        soup = BeautifulSoup(urlopen(url))
-        thumbnails = soup.find_all(class_='post-thumbnail')
-        if thumbnails:
-            return [t.find('a')['href'] for t in thumbnails][from_index:]
-        else:
-            return []
-
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(id='post-content')
-        self.comments = self.soup.find(id='disqus_thread')
-        return True if self.post else False
-
-    def get_title(self):
-        return self.soup.find(class_='page-title').text.strip()
-
-    def get_date(self):
-        return self.parse_date(
-            self.soup.find(class_='meta-date').text.strip()
-        )
-
-    def get_author(self):
-        return self.soup.find(class_='meta-author').text.strip()
-
-    def get_category(self):
-        cats = self.soup.find(class_='meta-cats')
-        return cats.find('a').text.strip() if cats else ''
-
-    def has_media(self):
-        media = self.post.find('img')
-        if not media:
-            media = self.post.find('video')
-        return '1' if media else '0'
-
-    def get_comment_count(self):
-        count = self.comments.find(class_='comment-count')
-        return DIGITS_ONLY.search(count.text).group(0).strip() if count else '0'
-
-    def get_text(self):
-        containers = self.post.find_all('p')
-        paragraphs = [c.text.strip() or '' for c in containers]
-        return ' '.join([LINE_BREAK.sub('', p) for p in paragraphs]).strip().replace('|', '')
-
-    def get_comments(self):
-        comments = self.comments.find_all(class_='post-message')
-        return ' '.join([LINE_BREAK.sub('', c.text) for c in comments]).strip().replace('|', '')
-
 
 class CreativeCriminals(Website):
 
     STATIC_PAGE_COUNT = 8
+    # posts are listed in sitemap order
+    NEWEST_FIRST = False
+    POST_CONTAINERS = containers(ids=('content',))
+    COUNT_CONTAINERS = containers(classes=('comment_div',))
+    SPEC = Spec(
+        roots=(('post', '#content'),),
+        fields={
+            'title': Field('span', within='h1'),
+            'date': Field('span', within='.date', attr='content', date_format='%Y-%m-%d'),
+            'author': Field('a', within='.author'),
+            'rating': Field('.loves', within='h1'),
+            'category': Field('a', within='.industry'),
+            'media': Field('img, video', read='exists'),
+            'comment_count': Field('.comment_div', root='soup', read='count'),
+            'text': Field('p', within='[itemprop=articleBody]', many=True, line_break=' '),
+            'comments': Field('.comment_text', each='.comment_div', many=True, line_break=' ')
+        }
+    )
 
     def __init__(self):
         self.url = 'http://creativecriminals.com'
         self.filename = 'creativecriminals.csv'
         self.posts_per_page = 10
         self.soup = None
-        self.post = None
-        self.comments = None
-
-    def parse_date(self, str_date):
-        return datetime.datetime.strptime(str_date, '%Y-%m-%d').date()
+        self.sitemap = None
+        self.since = None
 
     def get_page_url(self, page_num):
-        return '%s/sitemap.xml' % self.url if page_num == 0 \
-            else '%s/404' % self.url
-
-    def load_page(self, post_from):
-        url = self.get_page_url(0)
-        soup = BeautifulSoup(urlopen(url))
-        locs = soup.find_all('loc')
-        links = []
-        for l in locs[CreativeCriminals.STATIC_PAGE_COUNT + post_from:]:
-            # these are companies' and members' pages
-            if l.text.startswith('http://creativecriminals.com//'):
-                break
-            links.append(l.text)
-        return links
-
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(id='content')
-        return True if self.post else False
-
-    def get_title(self):
-        return self.post.h1.span.text.strip()
+        # every page is a slice of the sitemap
+        return '%s/sitemap.xml' % self.url
 
-    def get_date(self):
-        date = self.post.find(class_='date')
-        return self.parse_date(date.span['content']) if date else ''
-
-    def get_author(self):
-        author = self.post.find(class_='author')
-        return author.a.text.strip() if author else ''
-
-    def get_rating(self):
-        loves = self.post.h1.find(class_='loves')
-        return loves.text.strip() if loves else ''
-
-    def get_category(self):
-        industry = self.post.find(class_='industry')
-        return industry.a.text.strip() if industry else ''
+    def select_posts(self, entries):
+        locs = itertools.islice(entries, CreativeCriminals.STATIC_PAGE_COUNT, None)
+        # posts are followed by companies' and members' pages
+        return itertools.takewhile(lambda l: not l.startswith('http://creativecriminals.com//'),
+                                   (loc for loc, _ in locs))
 
-    def has_media(self):
-        media = self.post.find('img')
-        if not media:
-            media = self.post.find('video')
-        return '1' if media else '0'
-
-    def get_comment_count(self):
-        comments = self.post.find_all(class_='comment_div')
-        return str(len(comments))
-
-    def get_text(self):
-        containers = self.post.find(itemprop='articleBody').find_all('p')
-        paragraphs = [c.text.strip() or '' for c in containers]
-        return ' '.join([LINE_BREAK.sub(' ', p) for p in paragraphs]).strip()
-
-    def get_comments(self):
-        containers = self.post.find_all(class_='comment_div')
-        comments = [c.find(class_='comment_text').text.strip() for c in containers]
-        return ' '.join([LINE_BREAK.sub(' ', c) for c in comments]).strip()
+    def load_page(self, post_from):
+        if not self.sitemap:
+            self.sitemap = SitemapIndex(self.get_page_url(0), self.select_posts,
+                                        lambda url: open_url(url, LISTING_TTL), self.since)
+        return self.sitemap.page(post_from, self.posts_per_page)
 
 
 class ViralBlog(Website):
 
-    DATE = re.compile(r'[\d/]+')
+    POST_CONTAINERS = containers(ids=('single-post',))
+    SPEC = Spec(
+        roots=(('post', '#single-post'), ('pre_post', '#single-post .pre-post')),
+        fields={
+            'title': Field('h1'),
+            'date': Field('.date', root='pre_post', pattern=r'[\d/]+', date_format='%d/%m/%Y', default=None),
+            'author': Field('a span', root='pre_post', within='.author'),
+            'category': Field('a span', root='pre_post', within='.category'),
+            'text': Field('p, h2, h3', within='.post-all', many=True, line_break='')
+        },
+        links=Field('a', root='soup', each='.item-list-small', many=True, attr='href', separator=None)
+    )
 
     def __init__(self):
         self.url = 'http://www.viralblog.com/'
         self.filename = 'viralblog.csv'
         self.posts_per_page = 12
         self.soup = None
-        self.post = None
-        self.comments = None
-
-    def parse_date(self, str_date):
-        date_match = ViralBlog.DATE.search(str_date)
-        if date_match:
-            return datetime.datetime.strptime(date_match.group(0), '%d/%m/%Y').date()
-        else:
-            return None
 
     def get_page_url(self, page_num):
         return self.url if page_num == 0 else \
             '%s/page/%d' % (self.url, page_num + 1)
 
-    def load_page(self, post_from):
-        page_num = post_from / self.posts_per_page
-        from_index = post_from % self.posts_per_page
-        url = self.get_page_url(page_num)
-        soup = BeautifulSoup(urlopen(url))
-        thumbs = soup.find_all(class_='item-list-small')
-        links = [thumb.find('a') for thumb in thumbs]
-        return [l['href'] for l in links][from_index:]
-
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(id='single-post')
-        self.pre_post = self.post.find(class_='pre-post')
-        return True if self.post else False
-
-    def get_title(self):
-        return self.post.find('h1').text.strip()
-
-    def get_date(self):
-        return self.parse_date(
-            self.pre_post.find(class_='date').text.strip()
-        )
-
-    def get_author(self):
-        return self.pre_post.find(class_='author').a.span.text.strip()
-
-    def get_category(self):
-        return self.pre_post.find(class_='category').a.span.text.strip()
-
-    def get_text(self):
-        containers = self.post.find(class_='post-all').find_all(['p', 'h2', 'h3'])
-        paragraphs = [c.text.strip() or '' for c in containers]
-        return ' '.join([LINE_BREAK.sub('', p) for p in paragraphs]).strip()
-
 
 class ImprovEverywhere(Website):
 
+    POST_CONTAINERS = containers(classes=('type-post', 'entry-meta'))
+    SPEC = Spec(
+        roots=(('post', '.type-post'), ('meta', '.entry-meta')),
+        fields={
+            'title': Field('h1.entry-title'),
+            'date': Field('.entry-date', root='meta', date_format='%B %d, %Y', default=None),
+            'author': Field('a', root='meta', within='.author'),
+            'text': Field('p, h2, h3', within='.entry-content', many=True, line_break='')
+        },
+        links=Field('a', root='soup', each='h2.entry-title', many=True, attr='href', separator=None)
+    )
+
     def __init__(self):
         self.url = 'http://improveverywhere.com/'
         self.filename = 'improveverywhere.csv'
         self.posts_per_page = 5
         self.soup = None
-        self.post = None
-        self.comments = None
-
-    def parse_date(self, str_date):
-        return datetime.datetime.strptime(str_date, '%B %d, %Y').date()
 
     def get_page_url(self, page_num):
         return self.url if page_num == 0 else \
             '%s/page/%d' % (self.url, page_num + 1)
 
-    def load_page(self, post_from):
-        page_num = post_from / self.posts_per_page
-        from_index = post_from % self.posts_per_page
-        url = self.get_page_url(page_num)
-        soup = BeautifulSoup(urlopen(url))
-        thumbs = soup.find_all('h2', class_='entry-title')
-        links = [thumb.find('a') for thumb in thumbs]
-        return [l['href'] for l in links][from_index:]
-
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(class_='type-post')
-        self.meta = self.soup.find(class_='entry-meta')
-        return True if self.post else False
-
-    def get_title(self):
-        return self.post.find('h1', class_='entry-title').text.strip()
-
-    def get_date(self):
-        return self.parse_date(
-            self.meta.find(class_='entry-date').text.strip()
-        )
-
-    def get_author(self):
-        return self.meta.find(class_='author').a.text.strip()
-
-    def get_text(self):
-        containers = self.post.find(class_='entry-content').find_all(['p', 'h2', 'h3'])
-        paragraphs = [c.text.strip() or '' for c in containers]
-        return ' '.join([LINE_BREAK.sub('', p) for p in paragraphs]).strip()
-
 
 class OnTheGroundLookingUp(Website):
 
+    POST_CONTAINERS = containers(ids=('alpha-inner',))
+    SPEC = Spec(
+        roots=(('post', '#alpha-inner'),),
+        fields={
+            'title': Field('h3.entry-header'),
+            'date': Field('h2.date-header', date_format='%d %B %Y', default=None),
+            'author': Field(value='Sam Ewen'),
+            'category': Field('a', within='.post-footers', many=True, separator=', '),
+            'text': Field('p, h2, h3', within='.entry-body', many=True, line_break='')
+        },
+        links=Field('a', root='soup', each='h3.entry-header', many=True, attr='href', separator=None)
+    )
+
     def __init__(self):
         self.url = 'http://www.onthegroundlookingup.com/'
         self.filename = 'onthegroundlookingup.csv'
         self.posts_per_page = 10
         self.soup = None
-        self.post = None
-        self.comments = None
-
-    def parse_date(self, str_date):
-        return datetime.datetime.strptime(str_date, '%d %B %Y').date()
 
     def get_page_url(self, page_num):
         return self.url if page_num == 0 else \
             '%s/page/%d' % (self.url, page_num + 1)
 
-    def load_page(self, post_from):
-        page_num = post_from / self.posts_per_page
-        from_index = post_from % self.posts_per_page
-        url = self.get_page_url(page_num)
-        soup = BeautifulSoup(urlopen(url))
-        thumbs = soup.find_all('h3', class_='entry-header')
-        links = [thumb.find('a') for thumb in thumbs]
-        return [l['href'] for l in links][from_index:]
-
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(id='alpha-inner')
-        return True if self.post else False
-
-    def get_title(self):
-        return self.post.find('h3', class_='entry-header').text.strip()
-
-    def get_date(self):
-        return self.parse_date(
-            self.post.find('h2', class_='date-header').text.strip()
-        )
-
-    def get_author(self):
-        return 'Sam Ewen'
-
-    def get_category(self):
-        footer = self.post.find(class_='post-footers')
-        cats = [cat.text.strip() for cat in footer.find_all('a')] if footer else []
-        return ', '.join(cats) if cats else ''
-
-    def get_text(self):
-        containers = self.post.find(class_='entry-body').find_all(['p', 'h2', 'h3'])
-        paragraphs = [c.text.strip() or '' for c in containers]
-        return ' '.join([LINE_BREAK.sub('', p) for p in paragraphs]).strip()
-
 
 class ThousandHeads(Website):
 
+    # posts are listed in sitemap order
+    NEWEST_FIRST = False
     BLOG_LINK = re.compile('^http://1000heads.com/\d{4}/')
+    POST_CONTAINERS = containers(classes=('type-post',))
+    SPEC = Spec(
+        roots=(('post', '.type-post'), ('meta', '.type-post .blog-meta')),
+        fields={
+            'title': Field('a', root='meta', within='h2'),
+            'author': Field('i', root='meta'),
+            'date': Field('i', root='meta', index=1, date_format='%d %B %Y'),
+            'text': Field(':scope > p', many=True, line_break=' ')
+        }
+    )
 
     def __init__(self):
         self.url = 'http://1000heads.com'
         self.filename = '1000heads.csv'
         self.posts_per_page = 10
         self.soup = None
-        self.post = None
-
-    def parse_date(self, str_date):
-        return datetime.datetime.strptime(str_date, '%d %B %Y').date()
+        self.sitemap = None
+        self.since = None
 
     def get_page_url(self, page_num):
-        return '%s/sitemap.xml' % self.url if page_num == 0 \
-            else '%s/404' % self.url
-
-    def load_page(self, post_from):
-        url = self.get_page_url(0)
-        soup = BeautifulSoup(urlopen(url))
-        locs = soup.find_all('loc')
-        links = []
-        for l in locs[post_from:]:
-            # skip static pages
-            if ThousandHeads.BLOG_LINK.match(l.text):
-                links.append(l.text)
-        return links
+        # every page is a slice of the sitemap
+        return '%s/sitemap.xml' % self.url
 
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(class_='type-post')
-        self.meta = self.post.find(class_='blog-meta') if self.post else None
-        return True if self.post else False
+    def select_posts(self, entries):
+        # skip static pages
+        return (loc for loc, _ in entries if ThousandHeads.BLOG_LINK.match(loc))
 
-    def get_title(self):
-        return self.meta.h2.a.text.strip()
-
-    def get_date(self):
-        author_and_date = self.meta.find_all('i')
-        return self.parse_date(author_and_date[1].text.strip()) if author_and_date else ''
-
-    def get_author(self):
-        author_and_date = self.meta.find_all('i')
-        return author_and_date[0].text.strip() if author_and_date else ''
-
-    def get_text(self):
-        containers = self.post.find_all('p', recursive=False)
-        paragraphs = [c.text.strip() or '' for c in containers]
-        return ' '.join([LINE_BREAK.sub(' ', p) for p in paragraphs]).strip()
+    def load_page(self, post_from):
+        if not self.sitemap:
+            self.sitemap = SitemapIndex(self.get_page_url(0), self.select_posts,
+                                        lambda url: open_url(url, LISTING_TTL), self.since)
+        return self.sitemap.page(post_from, self.posts_per_page)
 
 
 class GuerrillaComm(Website):
 
     BLOG_LINK = re.compile('^http://blog.guerrillacomm.com/\d{4}/.+html$')
+    POST_CONTAINERS = containers(classes=('blog-posts',))
+    SPEC = Spec(
+        roots=(('post', '.blog-posts'),),
+        fields={
+            'title': Field('h3.post-title'),
+            'date': Field('h2.date-header', date_format='%B %d, %Y'),
+            'author': Field('span[itemprop=name]', within='.post-author'),
+            'category': Field('a', within='.post-labels', many=True, separator=', '),
+            'text': Field('.post-body', line_break=' ')
+        },
+        links=Field('a', root='soup', each='h3.post-title', many=True, attr='href', separator=None)
+    )
+    NEXT_PAGE = Selector('#blog-pager-older-link a')
 
     def __init__(self):
         self.url = 'http://blog.guerrillacomm.com'
         self.filename = 'guerrillacomm.csv'
         self.posts_per_page = 10
         self.soup = None
-        self.post = None
         self.next_url = '%s/search?updated-max=2015-01-01T00:00:00-04:00&max-results=10' % self.url
 
-    def parse_date(self, str_date):
-        return datetime.datetime.strptime(str_date, '%B %d, %Y').date()
-
     def get_page_url(self, page_num):
         return self.next_url
 
     def load_page(self, post_from):
-        page_num = post_from / self.posts_per_page
         from_index = post_from % self.posts_per_page
-        url = self.get_page_url(page_num)
-        soup = BeautifulSoup(urlopen(url))
-        next_url_container = soup.find(id='blog-pager-older-link')
-        self.next_url = next_url_container.a['href'] if next_url_container else '%s/404' % self.url
-        thumbs = soup.find_all('h3', class_='post-title')
-        links = [thumb.find('a') for thumb in thumbs]
-        return [l['href'] for l in links][from_index:]
-
-    def load_post(self, url):
-        self.post_url = url
-        self.soup = BeautifulSoup(urlopen(url))
-        self.post = self.soup.find(class_='blog-posts')
-        return True if self.post else False
-
-    def get_title(self):
-        return self.post.find('h3', class_='post-title').text.strip()
-
-    def get_date(self):
-        date = self.post.find('h2', class_='date-header')
-        return self.parse_date(date.text.strip()) if date else ''
-
-    def get_author(self):
-        author = self.post.find(class_='post-author')
-        return author.find('span', itemprop='name').text.strip() if author else ''
-
-    def get_category(self):
-        cat_container = self.post.find(class_='post-labels')
-        cats = [cat.text.strip() for cat in cat_container.find_all('a')] if cat_container else []
-        return ', '.join(cats) if cats else ''
-
-    def get_text(self):
-        body = self.post.find(class_='post-body')
-        return LINE_BREAK.sub(' ', body.text.strip()) if body else '' 
+        soup = load_soup(self.get_page_url(post_from / self.posts_per_page), ttl=LISTING_TTL)
+        next_link = GuerrillaComm.NEXT_PAGE.select_one(soup)
+        self.next_url = next_link['href'] if next_link else '%s/404' % self.url
+        return self.SPEC.find_links(soup)[from_index:]
@@ -1,19 +1,83 @@
 # -*- coding: utf-8 -*-
 
-import codecs
+import collections
+import datetime
+import gzip
+import io
+import json
 import logging
 import os
 import os.path
+import sqlite3
+import threading
+import time
+from marketingparser.metrics import METRICS
+from marketingparser.website import PostInfo
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 SEP = '|'
 # SEP = u'⌑'
 BASE_DIR = 'data'
 ENCODING = 'utf-8'
+BUFFER_SIZE = 1024 * 1024
+FIELDS = ('url', 'date', 'title', 'author', 'rating', 'category', 'media', 'comment_count',
+          'tweet_count', 'fb_count', 'text', 'comments')
+HEADER = ('Date', 'Title', 'Author', 'Rating', 'Category', 'Media', 'Comment#',
+          'Tweet#', 'FB#', 'Text', 'Comments', 'URL')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def parse_date(text):
+    """
+    Return the date an ISO formatted value starts with, None if it does not.
+    """
+    try:
+        return datetime.datetime.strptime(text[:10], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def sync(path):
+    """
+    Flush a file, or a directory's entries, to disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FlushTimer(threading.Thread):
+    """
+    Flushes a writer's rows once they have waited `flush_interval` seconds, whether or not posts
+    keep coming, i.e. while the crawl waits on slow or throttled hosts.
+    """
+
+    def __init__(self, writer):
+        threading.Thread.__init__(self, name='flush-timer')
+        self.daemon = True
+        self.writer = writer
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.writer.flush_interval):
+            try:
+                self.writer.flush_due()
+            except EnvironmentError as ex:
+                logger.warning('Failed to flush %s: %s' % (self.writer.filename, ex))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
 class Writer:
     """
     Post writer.
@@ -24,16 +88,57 @@ class Writer:
         self.page = []
         self.page_size = website.posts_per_page
         self.post_count = 0
+        self.checkpoint = None
+        # held while saving and flushing, which a FlushTimer does from its own thread
+        self.lock = threading.RLock()
 
     def save(self, post):
         pass
 
+    def exists(self):
+        """
+        Tell whether output from a previous run exists.
+        """
+        return False
+
     def write_header(self):
         pass
 
+    def saved_posts(self):
+        """
+        Yield posts in the output from a previous run, with the fields it stores, in output order.
+        """
+        return iter(())
+
+    def newest_date(self):
+        """
+        Return the newest publication date of posts in the output, None if there are none.
+        """
+        newest = None
+        for post in self.saved_posts():
+            if isinstance(post.date, datetime.date) and (newest is None or post.date > newest):
+                newest = post.date
+        return newest
+
+    def counts_writer(self, website):
+        """
+        Return a writer saving refreshed counts of the posts in this writer's output.
+        """
+        return MemoryWriter(website)
+
     def flush(self):
         pass
 
+    def close(self):
+        self.flush()
+
+    def commit(self, urls):
+        """
+        Record urls of flushed posts in the checkpoint, if any.
+        """
+        if self.checkpoint:
+            self.checkpoint.save(urls)
+
 
 class MemoryWriter(Writer):
     """
@@ -47,38 +152,479 @@ class MemoryWriter(Writer):
         self.page.append(post)
         self.post_count += 1
 
+    def saved_posts(self):
+        return iter(self.page)
+
 
-class CSVWriter(Writer):
+class FileWriter(Writer):
     """
-    Saves posts to a CSV file.
+    Saves posts to a file under BASE_DIR.
+
+    The file stays open for the whole run. Buffered rows are flushed (and fsync'ed if asked to)
+    every `flush_rows` posts (a page by default), every `flush_bytes` bytes or every
+    `flush_interval` seconds, whichever comes first. The interval is also checked by a FlushTimer
+    thread, so that rows do not wait for the next post past it.
     """
 
-    def __init__(self, website):
+    def __init__(self, website, flush_rows=None, flush_bytes=None, flush_interval=None, fsync=False):
         Writer.__init__(self, website)
         if not os.path.exists(BASE_DIR):
             os.mkdir(BASE_DIR)
+        self.path = os.path.join(BASE_DIR, self.filename)
+        self.file = None
+        self.flush_rows = flush_rows or self.page_size
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffered_bytes = 0
+        self.flushed_at = time.time()
+        self.timer = None
+
+    def open(self, mode='ab', path=None):
+        if not self.file:
+            self.file = open(path or self.path, mode, BUFFER_SIZE)
+        return self.file
+
+    def header(self):
+        return ''
+
+    def format(self, post):
+        """
+        Return the encoded record of a post.
+        """
+        return ''
+
+    def read(self):
+        """
+        Open the output for reading, as a file of lines.
+        """
+        return open(self.path, 'rb')
+
+    def records(self, lines):
+        """
+        Return the encoded records in lines of the output.
+        """
+        return lines
+
+    def parse_record(self, record):
+        """
+        Return the post in an encoded record, None if it is not one.
+        """
+        return None
+
+    def saved_records(self):
+        """
+        Yield (encoded record, post) pairs of posts in the output, in output order.
+        """
+        if not self.exists():
+            return
+        with self.read() as lines:
+            for record in self.records(lines):
+                post = self.parse_record(record)
+                # rows of posts that failed to load were saved without urls before
+                if post is not None and post.url:
+                    yield record, post
+
+    def saved_posts(self):
+        return (post for _, post in self.saved_records())
+
+    def replace(self, records):
+        """
+        Replace the output with specified encoded records, atomically.
+
+        Records are written to a temporary file next to the output, which is synced to disk and
+        renamed over it, so that the output is never seen half written.
+        """
+        self.close()
+        path = self.path + '.tmp'
+        try:
+            self.open('wb', path).write(self.header())
+            for record in records:
+                self.file.write(record)
+            # compressed streams end when closed
+            self.file.close()
+            self.file = None
+            sync(path)
+            os.rename(path, self.path)
+            sync(os.path.dirname(self.path) or '.')
+        except:
+            if self.file:
+                self.file.close()
+                self.file = None
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    def counts_writer(self, website):
+        return CountsWriter(website, self.flush_rows, self.flush_bytes, self.flush_interval, self.fsync)
 
     def save(self, post):
-        self.page.append(post)
-        self.post_count += 1
-        if len(self.page) == self.page_size:
+        row = self.format(post)
+        with self.lock:
+            self.open().write(row)
+            # only urls are kept until the flush, records are released as soon as they are written
+            self.page.append(post.url)
+            self.post_count += 1
+            self.buffered_bytes += len(row)
+            if self.should_flush():
+                self.flush()
+        if self.flush_interval and self.timer is None:
+            self.timer = FlushTimer(self)
+            self.timer.start()
+
+    def should_flush(self):
+        return len(self.page) >= self.flush_rows or \
+            (self.flush_bytes and self.buffered_bytes >= self.flush_bytes) or \
+            (self.flush_interval is not None and time.time() - self.flushed_at >= self.flush_interval)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def write_header(self):
+        self.close()
+        self.open('wb').write(self.header())
+
+    def flush_due(self):
+        """
+        Flush buffered rows if they have waited `flush_interval` seconds.
+        """
+        with self.lock:
+            if self.page and time.time() - self.flushed_at >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self.lock, METRICS.timer('flush_seconds', writer=self.__class__.__name__):
+            if self.file:
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            self.flushed_at = time.time()
+            METRICS.inc('written_bytes_total', self.buffered_bytes)
+            self.buffered_bytes = 0
+            if self.page:
+                self.commit(self.page)
+                METRICS.inc('saved_posts_total', len(self.page))
+                logger.info('Saved %d posts, total %d...' % (len(self.page), self.post_count))
+                self.page = []
+
+    def close(self):
+        if self.timer:
+            # stopped first, as it waits for the lock to flush
+            self.timer.stop()
+            self.timer = None
+        with self.lock:
             self.flush()
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class CSVWriter(FileWriter):
+    """
+    Saves posts to a CSV file.
+    """
+
+    def header(self):
+        return (SEP.join(HEADER) + '\n').encode(ENCODING)
+
+    def format(self, post):
+        row = SEP.join(
+            (str(post.date), post.title, post.author, post.rating, post.category, post.media,
+             post.comment_count, post.tweet_count, post.fb_count, post.text, post.comments, post.url))
+        return (row + '\n').encode(ENCODING)
+
+    def records(self, lines):
+        # text and comments may span several lines and hold separators: a record ends on a line with a separator,
+        # once it has a column per header, with its post url, or with nothing for a post that failed to load
+        header = SEP.join(HEADER)
+        parts = []
+        separators = 0
+        for number, line in enumerate(lines):
+            if not parts and line.rstrip('\r\n') == header:
+                continue
+            if number == 0 and line.rstrip('\r\n') == SEP.join(HEADER[:-1]):
+                # without urls, records cannot be told apart
+                raise ValueError('%s has no %s column, it was saved in an older format' % (self.filename, HEADER[-1]))
+            parts.append(line)
+            separators += line.count(SEP)
+            if SEP not in line or separators < len(HEADER) - 1:
+                continue
+            last = line.rstrip('\r\n').rsplit(SEP, 1)[1]
+            if last.startswith('http') or (not last and separators == len(HEADER) - 1):
+                yield ''.join(parts)
+                parts = []
+                separators = 0
+
+    def parse_record(self, record):
+        values = record.decode(ENCODING).rstrip('\r\n').split(SEP)
+        if len(values) < len(HEADER):
+            return None
+        post = PostInfo()
+        post.date = parse_date(values[0])
+        (post.title, post.author, post.rating, post.category, post.media, post.comment_count, post.tweet_count,
+         post.fb_count) = values[1:9]
+        # text with separators in it leaves the columns between ambiguous
+        if len(values) == len(HEADER):
+            post.text, post.comments = values[9:11]
+        post.url = values[-1]
+        return post
+
+
+class CountsWriter(FileWriter):
+    """
+    Saves refreshed comment, tweet and Facebook like counts to a CSV file of deltas keyed by url.
+
+    Every refresh appends its rows with the time it ran, so the file tracks counts over time.
+    """
+
+    HEADER = ('URL', 'Comment#', 'Tweet#', 'FB#', 'Refreshed')
+
+    def __init__(self, website, flush_rows=None, flush_bytes=None, flush_interval=None, fsync=False):
+        FileWriter.__init__(self, website, flush_rows, flush_bytes, flush_interval, fsync)
+        self.filename = os.path.splitext(website.filename)[0] + '.counts.csv'
+        self.path = os.path.join(BASE_DIR, self.filename)
+        self.refreshed = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def header(self):
+        return (SEP.join(CountsWriter.HEADER) + '\n').encode(ENCODING)
+
+    def format(self, post):
+        row = SEP.join((post.url, post.comment_count, post.tweet_count, post.fb_count, self.refreshed))
+        return (row + '\n').encode(ENCODING)
+
+
+class ZstdFile:
+    """
+    Write-only zstd stream over a file, flushable block by block.
+    """
+
+    def __init__(self, path, mode):
+        self.file = open(path, mode, BUFFER_SIZE)
+        self.stream = zstandard.ZstdCompressor().stream_writer(self.file)
+
+    def write(self, data):
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush(zstandard.FLUSH_BLOCK)
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.stream.flush(zstandard.FLUSH_FRAME)
+        self.file.close()
+
+
+class JSONWriter(FileWriter):
+    """
+    Saves posts as JSON lines, one object per post, optionally gzip or zstd compressed.
+
+    Records are compressed as they are written; every run appends a new gzip member or zstd frame,
+    so the output stays a single valid stream.
+    """
+
+    EXTENSIONS = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+    def __init__(self, website, compression=None, **options):
+        if compression not in JSONWriter.EXTENSIONS:
+            raise ValueError('Unsupported compression: %s' % compression)
+        if compression == 'zstd' and not zstandard:
+            raise ValueError('zstd compression requires the zstandard package')
+        self.compression = compression
+        FileWriter.__init__(self, website, **options)
+        self.filename = os.path.splitext(website.filename)[0] + JSONWriter.EXTENSIONS[compression]
+        self.path = os.path.join(BASE_DIR, self.filename)
+
+    def open(self, mode='ab', path=None):
+        path = path or self.path
+        if not self.file:
+            if self.compression == 'gzip':
+                self.file = gzip.GzipFile(path, mode)
+            elif self.compression == 'zstd':
+                self.file = ZstdFile(path, mode)
+            else:
+                self.file = open(path, mode, BUFFER_SIZE)
+        return self.file
+
+    def format(self, post):
+        record = collections.OrderedDict((f, getattr(post, f)) for f in FIELDS)
+        record['date'] = post.date.isoformat() if post.date else None
+        return (json.dumps(record, ensure_ascii=False) + '\n').encode(ENCODING)
+
+    def read(self):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(self.path, 'rb')
+        if self.compression == 'zstd':
+            # a frame per run
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(self.path, 'rb'),
+                                                                                read_across_frames=True))
+        return FileWriter.read(self)
+
+    def parse_record(self, record):
+        try:
+            values = json.loads(record)
+        except ValueError:
+            # a record cut short by an interrupted run
+            return None
+        post = PostInfo()
+        for field in FIELDS:
+            setattr(post, field, values.get(field, ''))
+        post.date = parse_date(values.get('date'))
+        return post
+
+
+class SQLiteWriter(Writer):
+    """
+    Saves posts to a SQLite database, inserting a page of posts per transaction.
+
+    Posts are keyed by url, so saving a post again updates its row. Like file output, buffered rows
+    are inserted every `flush_rows` posts, every `flush_bytes` bytes of text or every `flush_interval`
+    seconds, whichever comes first.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS posts (
+            url TEXT PRIMARY KEY,
+            date DATE,
+            title TEXT,
+            author TEXT,
+            rating REAL,
+            category TEXT,
+            media INTEGER,
+            comment_count INTEGER,
+            tweet_count INTEGER,
+            fb_count INTEGER,
+            text TEXT,
+            comments TEXT
+        )""",
+        'CREATE INDEX IF NOT EXISTS posts_date ON posts (date)'
+    )
+    INSERT = 'INSERT OR REPLACE INTO posts (%s) VALUES (%s)' % (', '.join(FIELDS), ', '.join('?' * len(FIELDS)))
+
+    def __init__(self, website, flush_rows=None, flush_bytes=None, flush_interval=None, fsync=False, **options):
+        Writer.__init__(self, website)
+        if not os.path.exists(BASE_DIR):
+            os.mkdir(BASE_DIR)
+        self.filename = os.path.splitext(website.filename)[0] + '.db'
+        self.path = os.path.join(BASE_DIR, self.filename)
+        self.page_size = flush_rows or self.page_size
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.connection = None
+        self.buffered_bytes = 0
+        self.flushed_at = time.time()
+        self.timer = None
+
+    def connect(self):
+        if not self.connection:
+            # the flush timer inserts from its own thread, under the writer lock
+            self.connection = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES,
+                                              check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=%s' % ('FULL' if self.fsync else 'NORMAL'))
+            for statement in SQLiteWriter.SCHEMA:
+                self.connection.execute(statement)
+        return self.connection
+
+    def number(self, value, kind=int):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            return None
+
+    def row(self, post):
+        return (post.url, post.date or None, post.title, post.author, self.number(post.rating, float),
+                post.category, self.number(post.media), self.number(post.comment_count),
+                self.number(post.tweet_count), self.number(post.fb_count), post.text, post.comments)
+
+    def save(self, post):
+        if not post.url:
+            return
+        row = self.row(post)
+        with self.lock:
+            self.page.append(row)
+            self.post_count += 1
+            self.buffered_bytes += sum(len(value) for value in row if isinstance(value, basestring))
+            if self.should_flush():
+                self.flush()
+        if self.flush_interval and self.timer is None:
+            self.timer = FlushTimer(self)
+            self.timer.start()
+
+    def should_flush(self):
+        return len(self.page) >= self.page_size or \
+            (self.flush_bytes and self.buffered_bytes >= self.flush_bytes) or \
+            (self.flush_interval is not None and time.time() - self.flushed_at >= self.flush_interval)
+
+    def exists(self):
+        return os.path.exists(self.path)
 
     def write_header(self):
-        f = codecs.open(os.path.join(BASE_DIR, self.filename), 'w', ENCODING)
-        f.write(SEP.join(
-            ('Date', 'Title', 'Author', 'Rating', 'Category', 'Media', 'Comment#',
-             'Tweet#', 'FB#', 'Text', 'Comments')))
-        f.write('\n')
-        f.close()
+        self.connect()
+
+    def saved_posts(self):
+        if not self.exists():
+            return
+        for row in self.connect().execute('SELECT %s FROM posts ORDER BY rowid' % ', '.join(FIELDS)):
+            post = PostInfo()
+            for field, value in zip(FIELDS, row):
+                setattr(post, field, value)
+            yield post
+
+    def newest_date(self):
+        if not self.exists():
+            return None
+        return parse_date(self.connect().execute('SELECT MAX(date) FROM posts').fetchone()[0])
+
+    def counts_writer(self, website):
+        return SQLiteCountsWriter(website, self.page_size, self.flush_bytes, self.flush_interval, self.fsync)
+
+    def flush_due(self):
+        """
+        Insert buffered rows if they have waited `flush_interval` seconds.
+        """
+        with self.lock:
+            if self.page and time.time() - self.flushed_at >= self.flush_interval:
+                self.flush()
 
     def flush(self):
-        f = codecs.open(os.path.join(BASE_DIR, self.filename), 'a', ENCODING)
-        for p in self.page:
-            f.write(SEP.join(
-                (str(p.date), p.title, p.author, p.rating, p.category, p.media, p.comment_count,
-                p.tweet_count, p.fb_count, p.text, p.comments)))
-            f.write('\n')
-        f.close()
-        logger.info('Saved %d posts, total %d...' % (len(self.page), self.post_count))
-        self.page = []
+        with self.lock:
+            self.flushed_at = time.time()
+            self.buffered_bytes = 0
+            if not self.page:
+                return
+            with METRICS.timer('flush_seconds', writer=self.__class__.__name__):
+                with self.connect():
+                    self.connection.executemany(self.INSERT, self.page)
+                self.commit([row[0] for row in self.page])
+            METRICS.inc('saved_posts_total', len(self.page))
+            logger.info('Saved %d posts, total %d...' % (len(self.page), self.post_count))
+            self.page = []
+
+    def close(self):
+        if self.timer:
+            # stopped first, as it waits for the lock to flush
+            self.timer.stop()
+            self.timer = None
+        with self.lock:
+            self.flush()
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+
+class SQLiteCountsWriter(SQLiteWriter):
+    """
+    Updates comment, tweet and Facebook like counts of posts in a SQLite database in place.
+
+    Counts that could not be refreshed keep their previous value.
+    """
+
+    INSERT = 'UPDATE posts SET comment_count = COALESCE(?2, comment_count), tweet_count = COALESCE(?3, tweet_count), ' \
+        'fb_count = COALESCE(?4, fb_count) WHERE url = ?1'
+
+    def row(self, post):
+        return (post.url, self.number(post.comment_count), self.number(post.tweet_count), self.number(post.fb_count))